@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+
+""" Load-test the bridge against the mock simulator.
+
+    Starts `mock_simulator.py` and launches `tesse_bridge.launch` against it
+    once per configuration of a sweep over IMU rate, frame rate, resolution
+    and enabled cameras. For each run, after a warm-up, it measures per topic
+    the end-to-end latency from sim timestamp to receipt here, throughput,
+    and drops (samples missing from the stamp sequence, and of those the
+    ones lost in transport, from header sequence gaps), as well as the
+    bridge's CPU use and peak RSS. Results go to a JSON report.
+
+    Latency relies on the mock's stamps being wall seconds since a start
+    time given to it by this script, so runs use real-time mode and the
+    mock, the bridge and this script must share a clock (one machine).
+    The mock batches metadata to its sleep granularity, which adds up to
+    about one IMU period of latency at high rates.
+
+    Starts a roscore if none is running. Messages are received unparsed, so
+    this script's own cost barely depends on image size.
+
+    Usage:
+        python load_test.py [--imu-rates 200,500,1000,2000]
+            [--frame-rates 20,60] [--resolutions 720x480,1280x720]
+            [--cameras stereo,all] [--duration 15] [--warmup 5]
+            [--output load_test.json] [--launch-arg compressed_images:=true]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import signal
+import struct
+import subprocess
+import sys
+import time
+
+import numpy as np
+import rosgraph
+import rospy
+
+# Bridge node, relative to the launch namespace.
+NODE_NAME = 'tesse_ros_bridge'
+
+MOCK_SIMULATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'mock_simulator.py')
+
+# Cameras published by each camera set, with their image topics.
+CAMERA_SETS = {
+    'stereo':     ['left_cam/rgb/image_raw', 'right_cam/rgb/image_raw'],
+    'stereo_seg': ['left_cam/rgb/image_raw', 'right_cam/rgb/image_raw',
+                   'seg_cam/rgb/image_raw'],
+    'all':        ['left_cam/rgb/image_raw', 'right_cam/rgb/image_raw',
+                   'seg_cam/rgb/image_raw', 'depth_cam/mono/image_raw'],
+}
+
+# Every stamped message starts with the header's seq, secs and nsecs.
+_header = struct.Struct('<3I')
+
+
+class TopicMonitor(object):
+    """ Records the receipt time, stamp, seq and size of a topic's messages
+        without deserializing them.
+    """
+
+    def __init__(self, topic):
+        self.topic = topic
+        self.samples = []
+        self.subscriber = rospy.Subscriber(topic, rospy.AnyMsg, self.callback,
+                                           queue_size=100, buff_size=1 << 26)
+
+    def callback(self, msg):
+        receipt = time.time()
+        seq, secs, nsecs = _header.unpack_from(msg._buff)
+        self.samples.append((receipt, secs + 1e-9 * nsecs, seq,
+                             len(msg._buff)))
+
+    def close(self):
+        self.subscriber.unregister()
+
+    def report(self, start_time, window, rate, speedup_factor):
+        """ Summarize the messages received in a wall time window.
+
+            Args:
+                start_time: A float, wall time at which the mock's sim time
+                    was 0.
+                window: A tuple of start and end wall times.
+                rate: A float, expected messages per sim second.
+                speedup_factor: A float, sim seconds per stamp second.
+
+            Returns:
+                A dictionary of the topic's statistics.
+        """
+        samples = np.array([sample for sample in self.samples
+                            if window[0] <= sample[0] < window[1]])
+        report = {'count': len(samples), 'expected': 0, 'drops': 0,
+                  'drop_rate': 0.0, 'transport_drops': 0, 'rate': 0.0,
+                  'bytes_per_sec': 0.0}
+        duration = window[1] - window[0]
+        if len(samples) == 0:
+            return report
+
+        receipts, stamps, seqs, sizes = samples.T
+        expected = int(round((stamps.max() - stamps.min()) * speedup_factor *
+                             rate)) + 1
+        latencies = (receipts - start_time - stamps) * 1e3
+        report.update({
+            'expected': expected,
+            'drops': max(0, expected - len(samples)),
+            'drop_rate': max(0.0, 1.0 - len(samples) / float(expected)),
+            'transport_drops': int(np.maximum(np.diff(seqs) - 1, 0).sum()),
+            'rate': len(samples) / duration,
+            'bytes_per_sec': float(sizes.sum()) / duration,
+            'latency_ms': {'mean': float(latencies.mean()),
+                           'p50': float(np.percentile(latencies, 50)),
+                           'p99': float(np.percentile(latencies, 99)),
+                           'max': float(latencies.max())}})
+        return report
+
+
+class ProcessMonitor(object):
+    """ Samples the CPU time and RSS of a process from /proc. """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.ticks_per_sec = float(os.sysconf('SC_CLK_TCK'))
+        self.page_size = os.sysconf('SC_PAGE_SIZE')
+        self.max_rss = 0
+        self.start_cpu = self.cpu_time()
+        self.start_wall = time.time()
+
+    def cpu_time(self):
+        with open('/proc/%d/stat' % self.pid) as stat_file:
+            # Fields after the parenthesized command name, from `state`.
+            fields = stat_file.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self.ticks_per_sec
+
+    def sample(self):
+        with open('/proc/%d/statm' % self.pid) as statm_file:
+            rss = int(statm_file.read().split()[1]) * self.page_size
+        self.max_rss = max(self.max_rss, rss)
+
+    def report(self):
+        wall = time.time() - self.start_wall
+        return {'pid': self.pid,
+                'cpu_percent': 100.0 * (self.cpu_time() - self.start_cpu) /
+                    wall,
+                'max_rss_mb': self.max_rss / 1e6}
+
+
+def node_pid(node):
+    """ Get the pid of a running node from its XML-RPC API. """
+    try:
+        from xmlrpc.client import ServerProxy
+    except ImportError:
+        from xmlrpclib import ServerProxy
+    uri = rosgraph.Master(rospy.get_name()).lookupNode(node)
+    code, message, pid = ServerProxy(uri).getPid(rospy.get_name())
+    return pid
+
+
+def wait_for_messages(monitor, timeout):
+    """ Wait for a topic's first message, e.g. until the bridge is up. """
+    deadline = time.time() + timeout
+    while time.time() < deadline and not rospy.is_shutdown():
+        if monitor.samples:
+            return
+        time.sleep(0.1)
+    raise RuntimeError("nothing received on %s within %.0f s" %
+                       (monitor.topic, timeout))
+
+
+def run_config(config, args):
+    """ Launch the bridge for one configuration and measure it. """
+    width, height = config['resolution']
+    node = '/%s/%s' % (args.ns, NODE_NAME)
+
+    # Stamps are wall seconds since `start_time`.
+    start_time = time.time()
+    mock = [sys.executable, MOCK_SIMULATOR,
+            '--start-time', repr(start_time),
+            '--speedup', '%g' % args.speedup,
+            '--imu-rate', '%g' % config['imu_rate'],
+            '--frame-rate', '%g' % config['frame_rate'],
+            '--width', '%d' % width, '--height', '%d' % height]
+
+    cameras = CAMERA_SETS[config['cameras']]
+    launch = ['roslaunch', 'tesse_ros_bridge', 'tesse_bridge.launch',
+              'ns:=%s' % args.ns, 'use_sim_time:=false',
+              'enable_collision:=false',
+              'speedup_factor:=%g' % args.speedup,
+              'imu_rate:=%g' % config['imu_rate'],
+              'frame_rate:=%g' % config['frame_rate'],
+              'width:=%d' % width, 'height:=%d' % height,
+              'publish_segmentation:=%s' %
+                  str('seg_cam/rgb/image_raw' in cameras).lower(),
+              'publish_depth:=%s' %
+                  str('depth_cam/mono/image_raw' in cameras).lower()] + \
+        args.launch_arg
+    with open(os.devnull, 'w') as devnull:
+        simulator = subprocess.Popen(mock, stdout=devnull, stderr=devnull)
+        process = subprocess.Popen(launch, stdout=devnull, stderr=devnull)
+
+    rates = {'imu': config['imu_rate'], 'odom': config['imu_rate']}
+    rates.update((camera, config['frame_rate']) for camera in cameras)
+    monitors = dict((topic, TopicMonitor('/%s/%s' % (args.ns, topic)))
+                    for topic in rates)
+    try:
+        wait_for_messages(monitors['imu'], args.startup_timeout)
+        pid = node_pid(node)
+        time.sleep(args.warmup)
+
+        window_start = time.time()
+        bridge = ProcessMonitor(pid)
+        while time.time() < window_start + args.duration and \
+                not rospy.is_shutdown():
+            bridge.sample()
+            time.sleep(min(1.0, args.duration))
+        window = (window_start, time.time())
+        result = dict(config, bridge=bridge.report(), topics={})
+    finally:
+        for monitor in monitors.values():
+            monitor.close()
+        process.send_signal(signal.SIGINT)
+        process.wait()
+        simulator.send_signal(signal.SIGINT)
+        simulator.wait()
+
+    for topic, monitor in monitors.items():
+        result['topics'][topic] = monitor.report(start_time, window,
+            rates[topic], args.speedup)
+    return result
+
+
+def print_result(result):
+    imu = result['topics']['imu']
+    images = [report for topic, report in result['topics'].items()
+              if topic not in ['imu', 'odom']]
+    image_p99 = max([report['latency_ms']['p99'] for report in images
+                     if 'latency_ms' in report] or [float('nan')])
+    print("imu %6g Hz  frames %4g Hz  %4dx%-4d  %-10s | imu p99 %7.2f ms "
+          "drops %5.1f%% | images p99 %7.2f ms drops %5.1f%% | cpu %5.1f%% "
+          "rss %6.1f MB" % (result['imu_rate'], result['frame_rate'],
+          result['resolution'][0], result['resolution'][1],
+          result['cameras'],
+          imu.get('latency_ms', {}).get('p99', float('nan')),
+          100.0 * imu['drop_rate'], image_p99,
+          100.0 * max([report['drop_rate'] for report in images] or [0.0]),
+          result['bridge']['cpu_percent'], result['bridge']['max_rss_mb']))
+
+
+def floats(text):
+    return [float(value) for value in text.split(',')]
+
+
+def resolutions(text):
+    return [tuple(int(size) for size in value.split('x'))
+            for value in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--imu-rates', type=floats,
+                        default=[200.0, 500.0, 1000.0, 2000.0])
+    parser.add_argument('--frame-rates', type=floats, default=[20.0, 60.0])
+    parser.add_argument('--resolutions', type=resolutions,
+                        default=[(720, 480), (1280, 720)])
+    parser.add_argument('--cameras', type=lambda text: text.split(','),
+                        default=['stereo', 'all'],
+                        help='camera sets among %s' %
+                            ', '.join(sorted(CAMERA_SETS)))
+    parser.add_argument('--speedup', type=float, default=1.0)
+    parser.add_argument('--duration', type=float, default=15.0,
+                        help='measured seconds per configuration')
+    parser.add_argument('--warmup', type=float, default=5.0)
+    parser.add_argument('--startup-timeout', type=float, default=60.0)
+    parser.add_argument('--ns', default='tesse')
+    parser.add_argument('--launch-arg', action='append', default=[],
+                        help='extra roslaunch argument, e.g. '
+                             'compressed_images:=true')
+    parser.add_argument('--output', default='load_test.json')
+    args = parser.parse_args()
+    for cameras in args.cameras:
+        assert cameras in CAMERA_SETS, "Unknown camera set %s" % cameras
+
+    roscore = None
+    if not rosgraph.is_master_online():
+        roscore = subprocess.Popen(['roscore'])
+        while not rosgraph.is_master_online():
+            time.sleep(0.2)
+    rospy.init_node('load_test', anonymous=True, disable_signals=True)
+
+    report = {'host': platform.node(), 'python': platform.python_version(),
+              'speedup_factor': args.speedup, 'duration': args.duration,
+              'warmup': args.warmup, 'launch_args': args.launch_arg,
+              'results': []}
+    try:
+        for imu_rate, frame_rate, resolution, cameras in itertools.product(
+                args.imu_rates, args.frame_rates, args.resolutions,
+                args.cameras):
+            config = {'imu_rate': imu_rate, 'frame_rate': frame_rate,
+                      'resolution': list(resolution), 'cameras': cameras}
+            try:
+                result = run_config(config, args)
+            except RuntimeError as error:
+                result = dict(config, error=str(error))
+                print("%s: %s" % (config, error))
+            else:
+                print_result(result)
+            report['results'].append(result)
+
+            # Write as we go, so an interrupted sweep keeps its results.
+            with open(args.output, 'w') as report_file:
+                json.dump(report, report_file, indent=2, sort_keys=True)
+    finally:
+        rospy.signal_shutdown('load test done')
+        if roscore is not None:
+            roscore.send_signal(signal.SIGINT)
+            roscore.wait()
+    print("Wrote %d results to %s" % (len(report['results']), args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+""" Serve a mock TESSE simulator on the simulator's ports.
+
+    Stands in for a Unity build: answers the bridge's requests through the
+    tesse-interface protocol with synthetic images at the configured
+    resolution, and streams the metadata of a scripted trajectory to
+    `--udp-port` at `--imu-rate`, in real time or in step mode. The bridge
+    connects to it with its usual networking parameters. Runs until
+    interrupted.
+
+    Usage:
+        python mock_simulator.py --imu-rate 1000 --width 1280 --height 720
+        roslaunch tesse_ros_bridge tesse_bridge.launch imu_rate:=1000 \
+            width:=1280 height:=720
+"""
+
+import argparse
+import time
+
+from tesse_ros_bridge.mock_simulator import MockSimulator
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    # The ports of launch/tesse_bridge.launch.
+    parser.add_argument('--position-port', type=int, default=9000)
+    parser.add_argument('--metadata-port', type=int, default=9001)
+    parser.add_argument('--image-port', type=int, default=9002)
+    parser.add_argument('--step-port', type=int, default=9005)
+    parser.add_argument('--udp-host', default='127.0.0.1')
+    parser.add_argument('--udp-port', type=int, default=9004)
+    parser.add_argument('--encoding', choices=['xml', 'binary'],
+                        default='xml')
+    parser.add_argument('--imu-rate', type=float, default=200.0)
+    parser.add_argument('--frame-rate', type=float, default=20.0,
+                        help='frames per second in step mode')
+    parser.add_argument('--speedup', type=float, default=1.0)
+    parser.add_argument('--width', type=int, default=720)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--fov', type=float, default=60.0)
+    parser.add_argument('--start-time', type=float, default=None,
+                        help='wall time at which sim time is 0, e.g. for '
+                             'measuring latency from another process')
+    args = parser.parse_args()
+
+    simulator = MockSimulator(width=args.width, height=args.height,
+        fov=args.fov, frame_rate=args.frame_rate, imu_rate=args.imu_rate,
+        host=args.host, position_port=args.position_port,
+        metadata_port=args.metadata_port, image_port=args.image_port,
+        step_port=args.step_port, udp_host=args.udp_host,
+        udp_port=args.udp_port, encoding=args.encoding,
+        speedup_factor=args.speedup)
+    simulator.start(args.start_time)
+    print("Serving a mock simulator on %s: %s" % (args.host, ", ".join(
+        "%s %d" % item for item in sorted(simulator.ports.items()))))
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    simulator.stop()
+    print("Stopped: %s" % simulator.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,18 @@
 #!/bin/bash
 
+# Topics of tesse_ros_node.py in the default "tesse" namespace. To record
+# without rosbag, set the record_dir launch argument instead.
 rosbag record \
 /clock \
-/tesse/gt \
 /tesse/imu \
-/tesse/left_cam \
-/tesse/depth \
-/tesse/segmentation \
-/tesse/left_cam/camera_info \
 /tesse/odom \
-/tesse/right_cam \
+/tesse/left_cam/rgb/image_raw \
+/tesse/left_cam/camera_info \
+/tesse/right_cam/rgb/image_raw \
 /tesse/right_cam/camera_info \
+/tesse/seg_cam/rgb/image_raw \
+/tesse/seg_cam/camera_info \
+/tesse/depth_cam/mono/image_raw \
+/tesse/depth_cam/camera_info \
 /tf \
 /tf_static
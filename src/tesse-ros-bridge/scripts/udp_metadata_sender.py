@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+""" Stream synthetic agent metadata over UDP, like the simulator does.
+
+    Samples a scripted trajectory at a fixed rate and sends it to the bridge's
+    `udp_port` as xml, packed binary, or alternating between the two, so that
+    `TesseROSWrapper.udp_cb` can be exercised without Unity. With
+    `--benchmark`, nothing is sent; instead both encodings are decoded locally
+    and their size and decode cost are reported.
+
+    Usage:
+        python udp_metadata_sender.py --port 9004 --rate 200 --encoding binary
+        python udp_metadata_sender.py --benchmark
+"""
+
+import argparse
+import socket
+import time
+import timeit
+
+import tesse_ros_bridge.utils
+from tesse_ros_bridge.trajectory import CircleTrajectory
+
+ENCODERS = {
+    'xml': tesse_ros_bridge.utils.encode_metadata_xml,
+    'binary': tesse_ros_bridge.utils.encode_metadata_binary,
+}
+
+
+def benchmark(trajectory, n_samples, iterations):
+    """ Report packet size and decode time for each encoding. """
+    samples = trajectory.metadata_sequence(n_samples, 200.0)
+    for name in ['xml', 'binary']:
+        packets = [ENCODERS[name](metadata) for metadata in samples]
+        for packet, metadata in zip(packets, samples):
+            assert(tesse_ros_bridge.utils.decode_metadata(packet) == metadata)
+
+        def run():
+            for packet in packets:
+                tesse_ros_bridge.utils.decode_metadata(packet)
+
+        best = min(timeit.repeat(run, number=iterations, repeat=5))
+        per_packet = best / (iterations * len(packets))
+        print("%-6s %5d bytes/packet  %8.2f us/packet  %10.0f packets/s" %
+              (name, len(packets[0]), per_packet * 1e6, 1.0 / per_packet))
+
+
+def send(trajectory, host, port, rate, duration, encoding):
+    """ Send metadata packets at `rate` Hz for `duration` seconds. """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    encodings = ['xml', 'binary'] if encoding == 'both' else [encoding]
+
+    period = 1.0 / rate
+    n_packets = int(duration * rate)
+    n_bytes = 0
+    start = time.time()
+    for i in range(n_packets):
+        packet = ENCODERS[encodings[i % len(encodings)]](
+            trajectory.metadata(i * period))
+        n_bytes += len(packet)
+        sock.sendto(packet, (host, port))
+
+        # Sleep until the next packet is due, without accumulating drift.
+        delay = start + (i + 1) * period - time.time()
+        if delay > 0.0:
+            time.sleep(delay)
+
+    elapsed = time.time() - start
+    print("Sent %d packets (%d bytes) in %.2f s: %.1f packets/s, %.1f kB/s" %
+          (n_packets, n_bytes, elapsed, n_packets / elapsed,
+           n_bytes / elapsed / 1e3))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    # The udp_port of launch/tesse_bridge.launch.
+    parser.add_argument('--port', type=int, default=9004)
+    parser.add_argument('--rate', type=float, default=200.0)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--encoding', choices=['xml', 'binary', 'both'],
+                        default='binary')
+    parser.add_argument('--benchmark', action='store_true')
+    parser.add_argument('--samples', type=int, default=1000)
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    trajectory = CircleTrajectory()
+    if args.benchmark:
+        benchmark(trajectory, args.samples, args.iterations)
+    else:
+        send(trajectory, args.host, args.port, args.rate, args.duration,
+             args.encoding)
+
+
+if __name__ == '__main__':
+    main()
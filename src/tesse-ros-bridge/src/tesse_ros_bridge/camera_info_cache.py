@@ -0,0 +1,91 @@
+import json
+import os
+
+
+def camera_info_key(camera_id, width, height, fov, near, far, position,
+                    orientation):
+    """ Build the cache key of a camera's configuration.
+
+        Args:
+            camera_id: An integer, the camera's id in the simulator.
+            width: An integer, image width in pixels.
+            height: An integer, image height in pixels.
+            fov: A float, vertical field of view in degrees.
+            near: A float, near draw distance in meters.
+            far: A float, far draw distance in meters.
+            position: A sequence of the x, y, z position of the camera in
+                the body frame.
+            orientation: A sequence of the x, y, z, w quaternion of the
+                camera in the body frame.
+
+        Returns:
+            A string, identical for identical configurations.
+    """
+    return json.dumps([int(camera_id), int(width), int(height), float(fov),
+                       float(near), float(far),
+                       [float(value) for value in position],
+                       [float(value) for value in orientation]])
+
+
+class CameraInfoCache(object):
+    """ Camera information responses of the simulator, keyed by the camera
+        configuration that produced them (see `camera_info_key`).
+
+        The cache is loaded from and saved to a JSON file, so that a bridge
+        restarted with unchanged parameters can reuse the responses of its
+        last run instead of querying every camera again. A missing or
+        unreadable file is treated as an empty cache.
+    """
+
+    def __init__(self, path=None):
+        """ Load the cache.
+
+            Args:
+                path: A string, path of the cache file; None to keep the
+                    cache in memory only.
+        """
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        if path and os.path.exists(path):
+            try:
+                with open(path) as cache_file:
+                    entries = json.load(cache_file)
+                if isinstance(entries, dict):
+                    self.entries = entries
+            except (IOError, ValueError) as error:
+                print("TESSE_ROS_NODE: ignoring camera info cache %s: %s" %
+                      (path, error))
+
+    def get(self, key):
+        """ Get the cached camera information metadata of a configuration,
+            or None if there is none.
+        """
+        return self.entries.get(key)
+
+    def put(self, key, metadata):
+        """ Cache the camera information metadata of a configuration.
+
+            Args:
+                key: A string, as returned by `camera_info_key`.
+                metadata: A string, the CameraInformationRequest response
+                    metadata.
+        """
+        if self.entries.get(key) != metadata:
+            self.entries[key] = metadata
+            self.dirty = True
+
+    def save(self):
+        """ Write the cache to its file if it changed, atomically so that a
+            concurrent or interrupted run never reads a partial file.
+        """
+        if not self.path or not self.dirty:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        temp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(temp_path, 'w') as cache_file:
+            json.dump(self.entries, cache_file, indent=1, sort_keys=True)
+        os.rename(temp_path, self.path)
+        self.dirty = False
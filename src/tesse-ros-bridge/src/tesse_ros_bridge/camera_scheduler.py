@@ -0,0 +1,68 @@
+import threading
+
+
+class CameraScheduler(object):
+    """ Decides which cameras are due on each tick of a base-rate timer.
+
+        Cameras run at their own rates, each no faster than the base rate.
+        Time is counted in ticks rather than read from a clock, so the
+        schedule is deterministic and, over time, every camera is requested
+        at exactly its rate. A camera that is due is requested on the first
+        tick at or after its due time; missed frames are not made up in
+        bursts. A camera whose frame was requested but not published can be
+        retried on the next tick with `requeue`, without shifting its
+        schedule.
+    """
+
+    def __init__(self, rates, base_rate):
+        """ Set up the schedule.
+
+            Args:
+                rates: A list of floats, the rate of each camera in Hz.
+                base_rate: A float, the rate in Hz at which `tick` is called.
+        """
+        assert(base_rate > 0.0)
+        for rate in rates:
+            assert(0.0 < rate <= base_rate)
+        self.rates     = list(rates)
+        self.base_rate = base_rate
+
+        # Due times are in ticks; a small tolerance absorbs rounding.
+        self.periods  = [base_rate / float(rate) for rate in rates]
+        self.next_due = [0.0] * len(rates)
+        self.ticks    = 0
+
+        # Requeued cameras; `requeue` and `tick` may run on different threads.
+        self.lock  = threading.Lock()
+        self.retry = set()
+
+    def tick(self):
+        """ Advance by one base period.
+
+            Returns:
+                A list of the indices of the cameras due on this tick, in
+                increasing order.
+        """
+        now = self.ticks
+        with self.lock:
+            due, self.retry = sorted(self.retry), set()
+        for i, next_due in enumerate(self.next_due):
+            if next_due <= now + 1e-6:
+                if i not in due:
+                    due.append(i)
+                next_due += self.periods[i]
+                self.next_due[i] = next_due if next_due > now \
+                    else now + self.periods[i]
+
+        self.ticks += 1
+        return sorted(due)
+
+    def requeue(self, indices):
+        """ Make cameras due again on the next tick, e.g. because the frame
+            they were due on was skipped.
+
+            Args:
+                indices: A list of camera indices, as returned by `tick`.
+        """
+        with self.lock:
+            self.retry.update(indices)
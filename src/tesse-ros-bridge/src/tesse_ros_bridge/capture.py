@@ -0,0 +1,376 @@
+import collections
+import json
+import struct
+import threading
+import time
+import traceback
+
+import numpy as np
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# A capture file is CAPTURE_MAGIC followed by records, each a header
+# (kind, arrival wall time, payload size) and the payload.
+CAPTURE_MAGIC = b'TESSECAPTURE1\n'
+
+CAPTURE_METADATA    = 0  # Raw UDP metadata packet.
+CAPTURE_FRAME       = 1  # Camera indices and DataResponse of an image request.
+CAPTURE_CAMERA_INFO = 2  # CameraInformationRequest response metadata.
+
+_record_header = struct.Struct('<BdI')
+_json_size = struct.Struct('<I')
+
+# Stand-in for the DataResponse of a captured frame.
+CapturedResponse = collections.namedtuple('CapturedResponse',
+                                          ['images', 'metadata'])
+
+
+class CaptureWriter(object):
+    """ Writes simulator traffic to a capture file as it arrives.
+
+        Metadata packets are captured as received, before decoding, and
+        image responses as returned by the simulator interface, so replaying
+        a capture exercises the same processing as live data. Thread safe.
+
+        Like `Recorder`, the write methods only stamp and queue a record; a
+        writer thread writes it to the file, so a large frame never holds up
+        the metadata thread unless the writer falls `queue_size` records
+        behind. Records arriving once `close` has begun are dropped and
+        counted.
+    """
+
+    def __init__(self, path, queue_size=256):
+        """ Create the capture file and start its writer thread.
+
+            Args:
+                path: A string, path of the capture file to write.
+                queue_size: An integer, number of records that may wait for
+                    the writer before the write methods block.
+        """
+        assert(queue_size > 0)
+        self.file = open(path, 'wb')
+        self.file.write(CAPTURE_MAGIC)
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.closed = False
+        self.lock = threading.Lock()
+        self.counts = {'records': 0, 'bytes': 0, 'dropped': 0,
+                       'write_errors': 0}
+        self.thread = threading.Thread(target=self._run,
+                                       name='capture_write')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write_metadata(self, data, arrival=None):
+        """ Capture a metadata packet.
+
+            Args:
+                data: A bytestring, the packet as received.
+                arrival: A float, wall time of arrival. Defaults to now.
+        """
+        self._write(CAPTURE_METADATA, arrival, [data])
+
+    def write_frame(self, camera_indices, data_response, arrival=None):
+        """ Capture the response to an image request.
+
+            Args:
+                camera_indices: A list of the indices of the requested
+                    cameras in `TesseROSWrapper.cameras`.
+                data_response: A DataResponse with numpy or encoded images.
+                arrival: A float, wall time of arrival. Defaults to now.
+        """
+        images = []
+        blobs = []
+        for image in data_response.images:
+            if isinstance(image, np.ndarray):
+                image = np.ascontiguousarray(image)
+                images.append({'dtype': image.dtype.str,
+                               'shape': list(image.shape)})
+                blobs.append(image)
+            else:
+                images.append({'encoded': len(image)})
+                blobs.append(image)
+        self._write_json(CAPTURE_FRAME, arrival,
+                         {'cameras': list(camera_indices),
+                          'metadata': _text(data_response.metadata),
+                          'images': images}, blobs)
+
+    def write_camera_info(self, camera_id, metadata, arrival=None):
+        """ Capture the response to a CameraInformationRequest.
+
+            Args:
+                camera_id: An integer, the simulator camera id.
+                metadata: A string, the metadata of the response.
+                arrival: A float, wall time of arrival. Defaults to now.
+        """
+        self._write_json(CAPTURE_CAMERA_INFO, arrival,
+                         {'camera': int(camera_id),
+                          'metadata': _text(metadata)})
+
+    def close(self):
+        """ Write the queued records, then close the capture file. """
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
+        # Records queued after the end marker by threads racing `close`.
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self._count('dropped')
+
+    def stats(self):
+        """ Get the numbers of 'records' and 'bytes' written, of records
+            'dropped' because they arrived after `close`, of 'write_errors'
+            and of 'queued' records.
+        """
+        with self.lock:
+            stats = dict(self.counts)
+        stats['queued'] = self.queue.qsize()
+        return stats
+
+    def _write_json(self, kind, arrival, header, blobs=()):
+        header = json.dumps(header).encode('utf-8')
+        self._write(kind, arrival,
+                    [_json_size.pack(len(header)), header] + list(blobs))
+
+    def _write(self, kind, arrival, parts):
+        if arrival is None:
+            arrival = time.time()
+        if self.closed:
+            self._count('dropped')
+            return
+        # Wait for room, unless closed meanwhile.
+        while True:
+            try:
+                self.queue.put((kind, arrival, parts), timeout=0.1)
+                return
+            except queue.Full:
+                if self.closed:
+                    self._count('dropped')
+                    return
+
+    def _run(self):
+        """ Writer thread: write queued records until closed. """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            kind, arrival, parts = item
+            try:
+                size = sum(part.nbytes if isinstance(part, np.ndarray)
+                           else len(part) for part in parts)
+                self.file.write(_record_header.pack(kind, arrival, size))
+                for part in parts:
+                    self.file.write(part.data if isinstance(part, np.ndarray)
+                                    else part)
+                self._count('records')
+                self._count('bytes', _record_header.size + size)
+            except Exception:
+                self._count('write_errors')
+                print("TESSE_ROS_NODE: capture write error:\n%s" %
+                      traceback.format_exc())
+
+    def _count(self, key, value=1):
+        with self.lock:
+            self.counts[key] += value
+
+
+def _text(metadata):
+    """ Metadata as text, for JSON. """
+    return metadata.decode('utf-8') if isinstance(metadata, bytes) \
+        else metadata
+
+
+def read_capture(path):
+    """ Read the records of a capture file in order.
+
+        Args:
+            path: A string, path of the capture file.
+
+        Yields:
+            Tuples of kind, arrival wall time and value, where the value is
+            the packet bytestring for CAPTURE_METADATA, a tuple of camera
+            indices and CapturedResponse for CAPTURE_FRAME, and a tuple of
+            camera id and metadata string for CAPTURE_CAMERA_INFO. Captured
+            images are read-only numpy arrays, or bytestrings if encoded.
+    """
+    with open(path, 'rb') as capture_file:
+        if capture_file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError("%s is not a capture file" % path)
+
+        while True:
+            header = capture_file.read(_record_header.size)
+            if len(header) < _record_header.size:
+                return
+            kind, arrival, size = _record_header.unpack(header)
+            payload = capture_file.read(size)
+            if len(payload) < size:
+                return  # Truncated by an interrupted capture.
+
+            if kind == CAPTURE_METADATA:
+                yield kind, arrival, payload
+            elif kind == CAPTURE_FRAME:
+                yield kind, arrival, _decode_frame(payload)
+            elif kind == CAPTURE_CAMERA_INFO:
+                info, _ = _decode_json(payload)
+                yield kind, arrival, (info['camera'], str(info['metadata']))
+
+
+def read_camera_info(path):
+    """ Read the captured camera information of a capture file.
+
+        Camera information is captured at startup, so only the records
+        before the first metadata or frame record are read.
+
+        Args:
+            path: A string, path of the capture file.
+
+        Returns:
+            A dictionary from simulator camera ids to metadata strings.
+    """
+    camera_info = {}
+    for kind, arrival, value in read_capture(path):
+        if kind != CAPTURE_CAMERA_INFO:
+            break
+        camera_info[value[0]] = value[1]
+    return camera_info
+
+
+def _decode_json(payload):
+    """ Split a payload into its JSON header and the offset after it. """
+    size, = _json_size.unpack_from(payload)
+    end = _json_size.size + size
+    return json.loads(payload[_json_size.size:end].decode('utf-8')), end
+
+
+def _decode_frame(payload):
+    frame, offset = _decode_json(payload)
+    images = []
+    for image in frame['images']:
+        if 'encoded' in image:
+            size = image['encoded']
+            images.append(payload[offset:offset + size])
+        else:
+            dtype = np.dtype(str(image['dtype']))
+            shape = tuple(image['shape'])
+            size = dtype.itemsize * int(np.prod(shape))
+            images.append(np.frombuffer(payload, dtype=dtype,
+                count=size // dtype.itemsize, offset=offset).reshape(shape))
+        offset += size
+    return frame['cameras'], CapturedResponse(images, str(frame['metadata']))
+
+
+class Replayer(object):
+    """ Feeds captured records to handlers with their original timing.
+
+        Records are delivered at their captured arrival times scaled by
+        `speed`, or back to back. Each handler call is timed, so a replay
+        reports the throughput and latency of every processing stage.
+    """
+
+    def __init__(self, handlers, speed=1.0, wall_clock=time.time,
+                 sleep=time.sleep):
+        """ Set up the replay.
+
+            Args:
+                handlers: A dictionary from record kinds to functions taking
+                    a record value. Records of other kinds are skipped.
+                speed: A float, replay speed relative to capture; 0 replays
+                    as fast as possible.
+                wall_clock: A function returning the wall time in seconds.
+                sleep: A function sleeping for a number of seconds.
+        """
+        assert(speed >= 0.0)
+        self.handlers   = handlers
+        self.speed      = speed
+        self.wall_clock = wall_clock
+        self.sleep      = sleep
+
+        self.durations = dict((kind, []) for kind in handlers)
+        self.errors    = dict((kind, 0) for kind in handlers)
+        self.max_lag   = 0.0
+        self.wall_time = 0.0
+        self.capture_time = 0.0
+
+    def run(self, records, is_shutdown=None):
+        """ Replay records until they are exhausted or `is_shutdown()`.
+
+            Args:
+                records: An iterable of (kind, arrival, value) tuples, e.g.
+                    from `read_capture`.
+                is_shutdown: An optional function returning True to stop.
+
+            Returns:
+                The replay statistics, see `stats`.
+        """
+        start = self.wall_clock()
+        first_arrival = None
+        for kind, arrival, value in records:
+            handler = self.handlers.get(kind)
+            if handler is None:
+                continue
+            if is_shutdown is not None and is_shutdown():
+                break
+
+            if first_arrival is None:
+                first_arrival = arrival
+            self.capture_time = arrival - first_arrival
+            if self.speed > 0.0:
+                delay = start + self.capture_time / self.speed - \
+                    self.wall_clock()
+                if delay > 0.0:
+                    self.sleep(delay)
+                else:
+                    self.max_lag = max(self.max_lag, -delay)
+
+            begin = self.wall_clock()
+            try:
+                handler(value)
+            except Exception:
+                self.errors[kind] += 1
+                print("TESSE_ROS_NODE: replay error:\n%s" %
+                      traceback.format_exc())
+            self.durations[kind].append(self.wall_clock() - begin)
+
+        self.wall_time = self.wall_clock() - start
+        return self.stats()
+
+    def stats(self):
+        """ Get the replay statistics.
+
+            Returns:
+                A dictionary with 'wall_time' and 'capture_time' (seconds
+                spanned by the replayed records), 'max_lag' (seconds a record
+                was delivered late at most) and 'stages', which maps each
+                handled kind to a dictionary with 'count', 'errors', 'rate'
+                (records per wall second), 'busy' (fraction of wall time in
+                the handler) and 'mean', 'p50', 'p99' and 'max' handler
+                durations in seconds.
+        """
+        stages = {}
+        for kind, durations in self.durations.items():
+            durations = np.array(durations)
+            stage = {'count': len(durations), 'errors': self.errors[kind],
+                     'rate': 0.0, 'busy': 0.0, 'mean': 0.0, 'p50': 0.0,
+                     'p99': 0.0, 'max': 0.0}
+            if len(durations) > 0:
+                stage['mean'] = float(durations.mean())
+                stage['p50'] = float(np.percentile(durations, 50))
+                stage['p99'] = float(np.percentile(durations, 99))
+                stage['max'] = float(durations.max())
+            if self.wall_time > 0.0:
+                stage['rate'] = len(durations) / self.wall_time
+                stage['busy'] = float(durations.sum()) / self.wall_time
+            stages[kind] = stage
+        return {'wall_time': self.wall_time,
+                'capture_time': self.capture_time,
+                'max_lag': self.max_lag, 'stages': stages}
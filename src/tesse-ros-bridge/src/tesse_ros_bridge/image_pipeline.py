@@ -0,0 +1,140 @@
+import threading
+import traceback
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class ImagePipeline(object):
+    """ Overlaps simulator image requests with conversion and publishing.
+
+        A producer thread keeps the next image request in flight while a
+        consumer thread converts and publishes the previous response. The two
+        are joined by a bounded queue: when the consumer falls behind, the
+        oldest queued response is dropped so that published frames stay as
+        fresh as possible. Every outcome is counted, see `stats`.
+    """
+
+    def __init__(self, fetch, publish, pace=None, queue_size=2,
+                 on_drop=None, name='image_pipeline'):
+        """ Set up the pipeline; call `start` to run it.
+
+            Args:
+                fetch: A function taking no arguments that requests a frame
+                    from the simulator and returns it, or None if there is
+                    nothing to publish. Called on the producer thread.
+                publish: A function taking a fetched frame that converts and
+                    publishes it. It returns False if the frame was skipped
+                    (e.g. a duplicate timestamp). Called on the consumer
+                    thread.
+                pace: An optional function called by the producer before
+                    each request to wait for the next frame to be due, e.g.
+                    `rospy.Rate.sleep`. By default requests are back to back.
+                queue_size: An integer, number of fetched frames that may
+                    wait for the consumer.
+                on_drop: An optional function taking a frame dropped from
+                    the full queue, e.g. to fetch its cameras again. Called
+                    on the producer thread.
+                name: A string used to name the threads.
+        """
+        assert(queue_size > 0)
+        self.fetch   = fetch
+        self.publish = publish
+        self.pace    = pace
+        self.on_drop = on_drop
+        self.name    = name
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.running = False
+        self.threads = []
+
+        self.lock = threading.Lock()
+        self.counts = {'fetched': 0, 'published': 0, 'skipped': 0,
+                       'dropped': 0, 'fetch_errors': 0, 'publish_errors': 0}
+
+    def start(self):
+        """ Start the producer and consumer threads. """
+        assert(not self.running)
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self._produce, name=self.name + '_fetch'),
+            threading.Thread(target=self._consume, name=self.name + '_publish'),
+        ]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self, timeout=1.0):
+        """ Stop both threads, waiting up to `timeout` seconds for each. """
+        self.running = False
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def stats(self):
+        """ Counts of each outcome since start, plus the current queue depth.
+
+            Returns:
+                A dictionary with 'fetched', 'published', 'skipped' (rejected
+                by `publish`), 'dropped' (discarded from a full queue),
+                'fetch_errors', 'publish_errors' and 'queued'.
+        """
+        with self.lock:
+            stats = dict(self.counts)
+        stats['queued'] = self.queue.qsize()
+        return stats
+
+    def _count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def _produce(self):
+        """ Producer loop: request frames and queue them, newest first. """
+        while self.running:
+            try:
+                if self.pace is not None:
+                    self.pace()
+                frame = self.fetch()
+            except Exception as error:
+                if self.running:
+                    self._count('fetch_errors')
+                    print("TESSE_ROS_NODE: %s fetch error: %s" %
+                          (self.name, error))
+                continue
+
+            if frame is None:
+                continue
+            self._count('fetched')
+
+            while True:
+                try:
+                    self.queue.put_nowait(frame)
+                    break
+                except queue.Full:
+                    try:
+                        dropped = self.queue.get_nowait()
+                    except queue.Empty:
+                        continue
+                    self._count('dropped')
+                    if self.on_drop is not None:
+                        self.on_drop(dropped)
+
+    def _consume(self):
+        """ Consumer loop: publish queued frames in order. """
+        while self.running:
+            try:
+                frame = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            try:
+                if self.publish(frame) is False:
+                    self._count('skipped')
+                else:
+                    self._count('published')
+            except Exception:
+                self._count('publish_errors')
+                print("TESSE_ROS_NODE: %s publish error: %s" %
+                      (self.name, traceback.format_exc()))
@@ -0,0 +1,117 @@
+import threading
+
+import numpy as np
+
+
+class ImuMonitor(object):
+    """ Tracks the timing regularity of the published IMU stream.
+
+        Every sample is added with its sim time and the wall time at which
+        it is published, in increasing sim time. Gaps (sim steps over 1.5
+        IMU periods) are counted as they arrive. Statistics
+        of sim and wall inter-arrival times and of the sim-to-publish delay
+        are computed over the last `window` samples on demand.
+
+        Sim and wall clocks share no origin, so the delay is measured
+        relative to the smallest wall-minus-sim offset in the window: it is
+        how much later than the most promptly published sample of the
+        window each sample was published, which is what grows when the
+        bridge falls behind the simulator.
+    """
+
+    def __init__(self, rate, speedup_factor=1.0, window=2000,
+                 jitter_threshold=0.002):
+        """ Set up an empty monitor.
+
+            Args:
+                rate: A float, nominal IMU rate in samples per sim second.
+                speedup_factor: A float, sim seconds per wall second.
+                window: An integer, number of recent samples statistics are
+                    computed over.
+                jitter_threshold: A float, standard deviation of wall
+                    inter-arrival times in seconds above which `stats`
+                    flags the stream.
+        """
+        assert(rate > 0.0 and speedup_factor > 0.0 and window > 1)
+        self.period           = 1.0 / rate
+        self.speedup_factor   = speedup_factor
+        self.window           = window
+        self.jitter_threshold = jitter_threshold
+
+        self.lock = threading.Lock()
+        self.sim_times  = [0.0] * window
+        self.wall_times = [0.0] * window
+        self.count = 0
+        self.last_sim_time = None
+        self.counts = {'gaps': 0, 'missing': 0}
+
+    def add(self, sim_time, wall_time):
+        """ Add a sample.
+
+            Args:
+                sim_time: A float, the sample's sim time in seconds, later
+                    than that of the last sample.
+                wall_time: A float, wall time of publishing in seconds.
+        """
+        with self.lock:
+            if self.last_sim_time is not None:
+                dt = sim_time - self.last_sim_time
+                assert(dt > 0.0)
+                if dt > 1.5 * self.period:
+                    self.counts['gaps'] += 1
+                    self.counts['missing'] += \
+                        int(round(dt / self.period)) - 1
+            self.last_sim_time = sim_time
+
+            i = self.count % self.window
+            self.sim_times[i]  = sim_time
+            self.wall_times[i] = wall_time
+            self.count += 1
+
+    def stats(self):
+        """ Get the monitor's statistics.
+
+            Returns:
+                A dictionary with the number of 'samples', the counts of
+                'gaps' and 'missing' samples in them since start, and over
+                the window: the
+                'rate' in samples per wall second, 'sim_period' and
+                'wall_period' dictionaries of inter-arrival 'mean', 'std',
+                'min' and 'max', a 'delay' dictionary of 'mean', 'p99' and
+                'max', all in seconds, the wall 'jitter' (the standard
+                deviation of wall inter-arrival times) and whether it
+                exceeds the threshold, 'jitter_exceeded'.
+        """
+        with self.lock:
+            n = min(self.count, self.window)
+            start = self.count % self.window if self.count > self.window \
+                else 0
+            sim_times = np.roll(self.sim_times[:n], -start)
+            wall_times = np.roll(self.wall_times[:n], -start)
+            stats = dict(self.counts, samples=self.count)
+
+        stats.update({'rate': 0.0, 'jitter': 0.0, 'jitter_exceeded': False})
+        for key in ['sim_period', 'wall_period']:
+            stats[key] = {'mean': 0.0, 'std': 0.0, 'min': 0.0, 'max': 0.0}
+        stats['delay'] = {'mean': 0.0, 'p99': 0.0, 'max': 0.0}
+        if n < 2:
+            return stats
+
+        for key, times in [('sim_period', sim_times),
+                           ('wall_period', wall_times)]:
+            periods = np.diff(times)
+            stats[key] = {'mean': float(periods.mean()),
+                          'std': float(periods.std()),
+                          'min': float(periods.min()),
+                          'max': float(periods.max())}
+        offsets = wall_times - sim_times / self.speedup_factor
+        delays = offsets - offsets.min()
+        stats['delay'] = {'mean': float(delays.mean()),
+                          'p99': float(np.percentile(delays, 99)),
+                          'max': float(delays.max())}
+        wall_span = wall_times[-1] - wall_times[0]
+        if wall_span > 0.0:
+            stats['rate'] = (n - 1) / wall_span
+        stats['jitter'] = stats['wall_period']['std']
+        stats['jitter_exceeded'] = stats['jitter'] > self.jitter_threshold
+        return stats
@@ -0,0 +1,188 @@
+import threading
+import time
+
+
+class LockstepDriver(object):
+    """ Drives the simulator in lockstep with publishing.
+
+        Each call to `advance` steps the simulator once, requests one image
+        set from the paused simulator, and waits until the metadata samples
+        generated by that step have arrived, i.e. until a sample at or after
+        the sim time the step ended at (that of the images) has. It then
+        publishes the samples up to that time in time order, followed by the
+        images; later samples are carried over to the next step. The
+        simulator is paused in between, so nothing is dropped or duplicated
+        and the sequence is deterministic; each step takes as long as its
+        slowest stage. Progress is counted, see `stats`.
+    """
+
+    def __init__(self, step, request_frame, publish_sample, publish_frame,
+                 frame_time, step_period, samples_per_step, timeout=1.0,
+                 time_tolerance=0.0, wall_clock=time.time):
+        """ Set up the driver.
+
+            Args:
+                step: A function taking no arguments that advances the
+                    simulator by one step.
+                request_frame: A function taking no arguments that requests
+                    images from the paused simulator and returns them, or
+                    None if there is nothing to publish.
+                publish_sample: A function taking a sample passed to
+                    `add_sample` that publishes it.
+                publish_frame: A function taking a frame returned by
+                    `request_frame` that publishes it.
+                frame_time: A function taking a frame returned by
+                    `request_frame` that returns its sim time.
+                step_period: A float, sim seconds per step; the end of a
+                    step without a frame is that of the last step plus this.
+                samples_per_step: An integer, number of metadata samples the
+                    simulator is expected to send per step, for counting
+                    missing ones.
+                timeout: A float, seconds to wait for the samples of a step
+                    before publishing the ones that arrived.
+                time_tolerance: A float, sim seconds by which a sample may
+                    precede the end of its step and still end it, e.g. half
+                    a sample period, to absorb rounding of sim times.
+                wall_clock: A function returning the wall time in seconds.
+        """
+        assert(step_period > 0.0)
+        assert(samples_per_step > 0)
+        assert(timeout > 0.0)
+        assert(time_tolerance >= 0.0)
+        self.step             = step
+        self.request_frame    = request_frame
+        self.publish_sample   = publish_sample
+        self.publish_frame    = publish_frame
+        self.frame_time       = frame_time
+        self.step_period      = step_period
+        self.samples_per_step = samples_per_step
+        self.timeout          = timeout
+        self.time_tolerance   = time_tolerance
+        self.wall_clock       = wall_clock
+
+        self.condition = threading.Condition()
+        self.samples   = []
+        # Newest sim time buffered, and end of the last step published.
+        self.newest_time = None
+        self.end_time    = None
+
+        self.counts = {'steps': 0, 'samples': 0, 'missing_samples': 0,
+                       'late_samples': 0, 'timeouts': 0, 'frames': 0}
+        self.first_sim_time  = None
+        self.last_sim_time   = None
+        self.first_wall_time = None
+        self.last_wall_time  = None
+
+    def add_sample(self, sim_time, sample):
+        """ Buffer a metadata sample until its step is published.
+
+            Thread safe; called from the metadata listener.
+
+            Args:
+                sim_time: A float, the simulator time of the sample.
+                sample: The sample, passed on to `publish_sample`.
+        """
+        with self.condition:
+            self.samples.append((sim_time, sample))
+            if self.newest_time is None or sim_time > self.newest_time:
+                self.newest_time = sim_time
+            self.condition.notify()
+
+    def advance(self):
+        """ Step the simulator once and publish everything it generated.
+
+            Returns:
+                An integer, number of metadata samples published.
+        """
+        self.step()
+        frame = self.request_frame()
+        if frame is not None:
+            end_time = self.frame_time(frame)
+        elif self.end_time is not None:
+            end_time = self.end_time + self.step_period
+        else:
+            end_time = None
+        samples = self._wait_for_samples(end_time)
+
+        for sim_time, sample in samples:
+            self.publish_sample(sample)
+        if frame is not None:
+            self.publish_frame(frame)
+
+        self.counts['steps'] += 1
+        self.counts['samples'] += len(samples)
+        self.counts['missing_samples'] += max(
+            0, self.samples_per_step - len(samples))
+        if frame is not None:
+            self.counts['frames'] += 1
+        # Elapsed times are measured from the end of the first step with
+        # samples, so that both cover the same steps.
+        if samples:
+            self.last_sim_time = samples[-1][0]
+            self.last_wall_time = self.wall_clock()
+            if self.first_sim_time is None:
+                self.first_sim_time = self.last_sim_time
+                self.first_wall_time = self.last_wall_time
+
+        return len(samples)
+
+    def stats(self):
+        """ Get the progress so far.
+
+            Returns:
+                A dictionary with 'steps', 'samples', 'missing_samples',
+                'late_samples' (dropped for arriving after their step was
+                published), 'timeouts' (steps published without their end
+                sample), 'frames', 'sim_time' and 'wall_time' (seconds
+                elapsed in each after the first step) and 'realtime_factor'
+                (their ratio, 0 until known).
+        """
+        stats = dict(self.counts)
+        stats['sim_time'] = 0.0
+        stats['wall_time'] = 0.0
+        if self.first_sim_time is not None:
+            stats['sim_time'] = self.last_sim_time - self.first_sim_time
+            stats['wall_time'] = self.last_wall_time - self.first_wall_time
+        stats['realtime_factor'] = stats['sim_time'] / stats['wall_time'] \
+            if stats['wall_time'] > 0.0 else 0.0
+        return stats
+
+    def _wait_for_samples(self, end_time):
+        """ Take the buffered samples of a step once its end sample arrived.
+
+            Args:
+                end_time: A float, sim time the step ended at, or None if
+                    unknown, in which case all samples that arrive within
+                    the timeout are taken.
+
+            Returns:
+                A list of (sim time, sample) tuples, in time order.
+        """
+        deadline = self.wall_clock() + self.timeout
+        with self.condition:
+            while end_time is None or self.newest_time is None or \
+                    self.newest_time < end_time - self.time_tolerance:
+                remaining = deadline - self.wall_clock()
+                if remaining <= 0.0:
+                    if end_time is not None:
+                        self.counts['timeouts'] += 1
+                    break
+                self.condition.wait(remaining)
+
+            samples, self.samples = self.samples, []
+            if end_time is not None:
+                # Samples of the next step, sent before it was requested.
+                later = [s for s in samples
+                         if s[0] > end_time + self.time_tolerance]
+                samples = [s for s in samples
+                           if s[0] <= end_time + self.time_tolerance]
+                self.samples = later
+                self.end_time = end_time
+
+        samples.sort(key=lambda sample: sample[0])
+        if samples and self.last_sim_time is not None:
+            # Samples of steps already published would go back in time.
+            n_samples = len(samples)
+            samples = [s for s in samples if s[0] > self.last_sim_time]
+            self.counts['late_samples'] += n_samples - len(samples)
+        return samples
@@ -0,0 +1,397 @@
+import select
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+import tesse_ros_bridge.utils
+from tesse_ros_bridge.trajectory import CircleTrajectory
+
+CAMERA_INFO_XML = """<TESSE_Agent_CameraInfo_v0.2>
+  <camera_info>
+    <name>%(name)s</name>
+    <id>%(id)d</id>
+    <parameters height='%(height)d' width='%(width)d' fov='%(fov).17g'/>
+    <position x='%(x).17g' y='%(y).17g' z='%(z).17g'/>
+    <rotation x='%(qx).17g' y='%(qy).17g' z='%(qz).17g' w='%(qw).17g'/>
+    <draw_distance near='%(near).17g' far='%(far).17g'/>
+  </camera_info>
+</TESSE_Agent_CameraInfo_v0.2>"""
+
+# Names of the simulator's cameras, by id.
+CAMERA_NAMES = {0: 'rgb_left', 1: 'rgb_right', 2: 'segmentation', 3: 'depth',
+                4: 'third_person'}
+
+# Responses, as decoded by `tesse.env.Env.request`: a tag, then lengths.
+# Metadata responses are followed by the metadata xml.
+_METADATA_HEADER = struct.Struct('<4sI')
+# Image responses: 'uImg', image payload and metadata lengths, then each
+# image with its header, rows bottom-up as Unity reads them, then metadata.
+_DATA_HEADER = struct.Struct('<4sII')
+# 'uImH', camera id, image data length, width, height, image type.
+_IMAGE_HEADER = struct.Struct('<4sIIII4s8x')
+
+# Widest horizontal shift of the synthetic image textures, in pixels.
+_TEXTURE_PERIOD = 64
+
+
+def tesse_protocol():
+    """ Get the request tags and enum values of tesse-interface.
+
+        Tags are taken from messages encoded by tesse-interface itself, so
+        the mock follows the protocol of the installed version. Imported
+        here so that `CAMERA_INFO_XML` can be used without tesse-interface.
+
+        Returns:
+            A dictionary of 'tags', mapping the 4-byte tag of each request
+            the mock handles to a kind of request, and of the 'depth' camera
+            id and 'single' channel value.
+    """
+    from tesse.msgs import Camera, Channels, Compression, DataRequest, \
+        CameraInformationRequest, MetadataRequest, \
+        SetCameraParametersRequest, SetCameraPositionRequest, \
+        SetCameraOrientationRequest, SceneRequest, SpawnObjectRequest, \
+        ObjectType, ObjectSpawnMethod, SetFrameRate, StepWithForce
+
+    cameras = [(Camera.RGB_LEFT, Compression.OFF, Channels.SINGLE)]
+    templates = [
+        ('data', DataRequest(True, cameras)),
+        ('data', DataRequest(False, cameras)),
+        ('camera_info', CameraInformationRequest(Camera.RGB_LEFT)),
+        ('metadata', MetadataRequest()),
+        ('camera_parameters', SetCameraParametersRequest(Camera.RGB_LEFT,
+            480, 720, 60.0, 0.05, 50.0)),
+        ('camera_position', SetCameraPositionRequest(Camera.RGB_LEFT,
+            0.0, 0.0, 0.0)),
+        ('camera_orientation', SetCameraOrientationRequest(Camera.RGB_LEFT,
+            0.0, 0.0, 0.0, 1.0)),
+        ('scene', SceneRequest(0)),
+        ('spawn', SpawnObjectRequest(ObjectType.CUBE,
+            ObjectSpawnMethod.RANDOM)),
+        ('frame_rate', SetFrameRate(20.0)),
+        ('step', StepWithForce(0, 0, 0)),
+    ]
+    return {'tags': dict((bytes(msg.encode()[:4]), kind)
+                         for kind, msg in templates),
+            'depth': Camera.DEPTH.value,
+            'single': Channels.SINGLE.value}
+
+
+class MockSimulator(object):
+    """ Stand-in for a TESSE Unity build, served on the simulator's ports.
+
+        Speaks the protocol of `tesse.env.Env`: messages arrive as UDP
+        datagrams on the position, metadata, image and step ports, and
+        requests are answered over a TCP connection back to the requester's
+        address, on the port the request arrived on. Agent metadata of a
+        scripted trajectory is streamed to `udp_port` like the simulator
+        does, as xml by default.
+
+        Images are synthetic textures at the resolution set for each camera
+        that move from frame to frame; compressed cameras get raw images.
+        Camera information reflects the camera parameters, positions and
+        orientations that were set. Scene and spawn requests are
+        acknowledged; other messages, e.g. forces, are ignored.
+
+        Sim time runs at `speedup_factor` times wall time, or, after
+        a SetFrameRate message, only advances by one frame per StepWithForce
+        message, which also sends the metadata of that step.
+    """
+
+    def __init__(self, width=720, height=480, fov=60.0, near=0.05, far=50.0,
+                 stereo_baseline=0.2, frame_rate=20.0, imu_rate=200.0,
+                 host='127.0.0.1', position_port=9000, metadata_port=9001,
+                 image_port=9002, step_port=9005, udp_host='127.0.0.1',
+                 udp_port=9004, encoding='xml', speedup_factor=1.0,
+                 trajectory=None, wall_clock=time.time):
+        """ Bind the simulator's ports; call `start` to serve them.
+
+            Args:
+                width: An integer, initial image width in pixels.
+                height: An integer, initial image height in pixels.
+                fov: A float, initial camera field of view in degrees.
+                near: A float, initial near draw distance in meters.
+                far: A float, initial far draw distance in meters.
+                stereo_baseline: A float, initial distance between the
+                    stereo cameras in meters.
+                frame_rate: A float, frames per second in step mode.
+                imu_rate: A float, metadata samples per second.
+                host: A string, address to serve on.
+                position_port: An integer, port of position messages.
+                metadata_port: An integer, port of metadata requests.
+                image_port: An integer, port of image requests.
+                step_port: An integer, port of step messages. Ports may be
+                    0 to bind any free port, see `ports`.
+                udp_host: A string, host to stream metadata to.
+                udp_port: An integer, port to stream metadata to.
+                encoding: A string, 'xml' or 'binary' metadata packets.
+                speedup_factor: A float, rate of sim time in wall time.
+                trajectory: An object with a `metadata(t)` method returning
+                    metadata dictionaries. Defaults to a CircleTrajectory.
+                wall_clock: A function returning the wall time in seconds.
+        """
+        assert(encoding in ['xml', 'binary'])
+        assert(imu_rate > 0.0 and frame_rate > 0.0)
+        self.frame_rate      = frame_rate
+        self.imu_rate        = imu_rate
+        self.udp_address     = (udp_host, udp_port)
+        self.speedup_factor  = speedup_factor
+        self.trajectory      = CircleTrajectory() if trajectory is None \
+            else trajectory
+        self.wall_clock      = wall_clock
+        self.encode = tesse_ros_bridge.utils.encode_metadata_xml \
+            if encoding == 'xml' else \
+            tesse_ros_bridge.utils.encode_metadata_binary
+        self.protocol = tesse_protocol()
+
+        # Parameters of each camera, by id, as last set.
+        self.camera_params = {}
+        for camera_id in CAMERA_NAMES:
+            x = 0.0
+            if camera_id in [0, 1]:
+                x = (camera_id - 0.5) * stereo_baseline
+            self.camera_params[camera_id] = {
+                'width': width, 'height': height, 'fov': fov, 'near': near,
+                'far': far, 'position': [x, 0.0, 0.0],
+                'orientation': [0.0, 0.0, 0.0, 1.0]}
+
+        # Messages waiting on several ports are served port by port in this
+        # order, e.g. steps before the requests for their images, which the
+        # bridge sends right after them.
+        self.sockets = []
+        for port in [position_port, step_port, metadata_port, image_port]:
+            server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            server.bind((host, port))
+            server.setblocking(False)
+            self.sockets.append(server)
+        self.ports = dict(zip(['position', 'step', 'metadata', 'image'],
+            [server.getsockname()[1] for server in self.sockets]))
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.lock = threading.Lock()
+        self.threads = []
+        self.running = False
+
+        # Index of the last metadata sample sent, and the step mode state:
+        # steps are counted from the sample at which step mode began.
+        self.sample = 0
+        self.step_mode = False
+        self.step_origin = 0
+        self.steps = 0
+        self.start_time = None
+
+        self.textures = {}
+        self.counts = {'samples': 0, 'frames': 0, 'requests': 0,
+                       'ignored': 0, 'response_errors': 0}
+
+    def start(self, start_time=None):
+        """ Start serving requests and streaming metadata.
+
+            Args:
+                start_time: A float, wall time at which sim time was 0, e.g.
+                    to share it with another process; defaults to now.
+        """
+        assert(not self.threads)
+        self.running = True
+        self.start_time = self.wall_clock() if start_time is None \
+            else start_time
+        for target, name in [(self._serve, 'mock_simulator_serve'),
+                             (self._stream, 'mock_simulator_udp')]:
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """ Stop serving and streaming, and close the ports. """
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        for server in self.sockets + [self.socket]:
+            server.close()
+
+    def time(self):
+        """ Get the simulator time of the last metadata sample sent. """
+        return self.sample / float(self.imu_rate)
+
+    def step(self):
+        """ Advance by one frame in step mode, sending its metadata. """
+        with self.lock:
+            self.steps += 1
+            last_sample = self.step_origin + int(round(
+                self.steps * self.imu_rate / self.frame_rate))
+            while self.sample < last_sample:
+                self._send_sample()
+
+    def stats(self):
+        """ Get counts of metadata 'samples' sent, image 'frames' rendered,
+            'requests' received, messages 'ignored' and 'response_errors'.
+        """
+        with self.lock:
+            return dict(self.counts)
+
+    def _serve(self):
+        """ Server thread: handle messages until stopped. """
+        while self.running:
+            ready, _, _ = select.select(self.sockets, [], [], 0.1)
+            for server in self.sockets:
+                if server not in ready:
+                    continue
+                port = server.getsockname()[1]
+                while True:
+                    try:
+                        data, address = server.recvfrom(65536)
+                    except socket.error:
+                        break  # Drained.
+                    try:
+                        self._handle(data, (address[0], port))
+                    except Exception as error:
+                        with self.lock:
+                            self.counts['response_errors'] += 1
+                        print("MOCK_SIMULATOR: error answering %r: %s" %
+                              (data[:4], error))
+
+    def _handle(self, data, address):
+        """ Handle one message, answering requests at `address`. """
+        kind = self.protocol['tags'].get(bytes(data[:4]))
+        payload = data[4:]
+        if kind is None:
+            with self.lock:
+                self.counts['ignored'] += 1
+            return
+        if kind == 'frame_rate':
+            with self.lock:
+                if not self.step_mode:
+                    self.step_mode = True
+                    self.step_origin = self.sample
+                    self.steps = 0
+            return
+        if kind == 'step':
+            self.step()
+            return
+
+        if kind == 'data':
+            response = self._data_response(payload)
+        elif kind == 'camera_info':
+            camera_id, = struct.unpack_from('<i', payload)
+            response = self._metadata_response(b'cami',
+                                               self._camera_info(camera_id))
+        else:
+            if kind == 'camera_parameters':
+                camera_id, height, width, fov, near, far = \
+                    struct.unpack_from('<iiifff', payload)
+                self.camera_params[camera_id].update(width=width,
+                    height=height, fov=fov, near=near, far=far)
+            elif kind == 'camera_position':
+                values = struct.unpack_from('<ifff', payload)
+                self.camera_params[values[0]]['position'] = list(values[1:])
+            elif kind == 'camera_orientation':
+                values = struct.unpack_from('<iffff', payload)
+                self.camera_params[values[0]]['orientation'] = \
+                    list(values[1:])
+            # Metadata, parameter, scene and spawn requests get metadata.
+            response = self._metadata_response(b'meta', self._metadata_xml())
+
+        with self.lock:
+            self.counts['requests'] += 1
+        connection = socket.create_connection(address, timeout=1.0)
+        try:
+            for part in response:
+                connection.sendall(part)
+        finally:
+            connection.close()
+
+    def _stream(self):
+        """ UDP thread: send metadata at `imu_rate` outside of step mode. """
+        # Short enough to notice `stop` at slow sim time rates.
+        period = min(1.0 / (self.imu_rate * self.speedup_factor), 0.1)
+        while self.running:
+            if not self.step_mode:
+                with self.lock:
+                    due = int((self.wall_clock() - self.start_time) *
+                              self.speedup_factor * self.imu_rate)
+                    while self.sample < due and not self.step_mode:
+                        self._send_sample()
+            time.sleep(period)
+
+    def _send_sample(self):
+        """ Send the next metadata sample. Called with `lock` held. """
+        self.sample += 1
+        packet = self.encode(self.trajectory.metadata(self.time()))
+        try:
+            self.socket.sendto(packet, self.udp_address)
+        except socket.error:
+            pass  # Like UDP, drop what can't be sent.
+        self.counts['samples'] += 1
+
+    def _metadata_xml(self):
+        with self.lock:
+            t = self.time()
+        metadata = tesse_ros_bridge.utils.encode_metadata_xml(
+            self.trajectory.metadata(t))
+        return metadata if isinstance(metadata, bytes) \
+            else metadata.encode('ascii')
+
+    def _metadata_response(self, tag, metadata):
+        if not isinstance(metadata, bytes):
+            metadata = metadata.encode('ascii')
+        return [_METADATA_HEADER.pack(tag, len(metadata)), metadata]
+
+    def _data_response(self, payload):
+        """ Render the cameras of a DataRequest, given as (camera,
+            compression, channels) triples of integers.
+        """
+        fields = struct.unpack('<%di' % (len(payload) // 4), payload)
+        cameras = list(zip(fields[0::3], fields[2::3]))
+        metadata = self._metadata_xml()
+        with self.lock:
+            self.counts['frames'] += 1
+            offset = self.counts['frames'] % _TEXTURE_PERIOD
+
+        parts = []
+        for camera_id, channels in cameras:
+            image, image_type = self._image(camera_id, channels, offset)
+            data = np.ascontiguousarray(image[::-1]).tobytes()
+            parts.append(_IMAGE_HEADER.pack(b'uImH', camera_id, len(data),
+                image.shape[1], image.shape[0], image_type))
+            parts.append(data)
+        images_length = sum(len(part) for part in parts)
+        return [_DATA_HEADER.pack(b'uImg', images_length, len(metadata))] + \
+            parts + [metadata]
+
+    def _image(self, camera_id, channels, offset):
+        """ Render an image of a camera, and get its image type. """
+        params = self.camera_params[camera_id]
+        width, height = params['width'], params['height']
+        depth = camera_id == self.protocol['depth']
+        single = channels == self.protocol['single']
+        image_type = b'xFLT' if depth else b'xGRY' if single else b'xRGB'
+
+        key = (camera_id, image_type, width, height)
+        texture = self.textures.get(key)
+        if texture is None:
+            rng = np.random.RandomState(camera_id)
+            shape = (height, width + _TEXTURE_PERIOD)
+            if depth:
+                # Normalized by the far draw distance, as Unity does.
+                texture = rng.uniform(0.01, 1.0, shape).astype(np.float32)
+            elif single:
+                texture = rng.randint(0, 256, shape).astype(np.uint8)
+            else:
+                texture = rng.randint(0, 256, shape + (3,)).astype(np.uint8)
+            self.textures[key] = texture
+        return texture[:, offset:offset + width], image_type
+
+    def _camera_info(self, camera_id):
+        params = self.camera_params[camera_id]
+        x, y, z = params['position']
+        qx, qy, qz, qw = params['orientation']
+        return CAMERA_INFO_XML % {
+            'name': CAMERA_NAMES[camera_id], 'id': camera_id,
+            'height': params['height'], 'width': params['width'],
+            'fov': params['fov'], 'x': x, 'y': y, 'z': z, 'qx': qx,
+            'qy': qy, 'qz': qz, 'qw': qw, 'near': params['near'],
+            'far': params['far']}
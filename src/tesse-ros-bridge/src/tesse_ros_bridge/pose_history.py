@@ -0,0 +1,143 @@
+import threading
+
+import numpy as np
+
+
+class PoseHistory(object):
+    """ Ring buffer of recent ground-truth poses, looked up by time.
+
+        Holds the time, position, quaternion (x, y, z, w) and velocity of
+        the last `capacity` samples in preallocated arrays. Each sample is
+        written twice, `capacity` rows apart, so the samples currently held
+        are always one contiguous, time-ordered slice: adding is O(1) and
+        looking up a time is a binary search over the slice, O(log n).
+
+        Lookups between two samples interpolate linearly for position and
+        velocity, and by SLERP for orientation. Times outside the held range
+        are not extrapolated.
+    """
+
+    def __init__(self, capacity=2000):
+        """ Set up an empty history.
+
+            Args:
+                capacity: An integer, number of samples held.
+        """
+        assert(capacity > 1)
+        self.capacity = capacity
+
+        self.lock = threading.Lock()
+        self.times        = np.zeros(2 * capacity)
+        self.positions    = np.zeros((2 * capacity, 3))
+        self.quaternions  = np.zeros((2 * capacity, 4))
+        self.velocities   = np.zeros((2 * capacity, 3))
+        self.start = 0
+        self.size  = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, time, position, quaternion, velocity):
+        """ Add a sample, replacing the oldest one if full.
+
+            Args:
+                time: A float, the sample's time in seconds. Samples must be
+                    added in increasing time.
+                position: A 3-vector.
+                quaternion: A 4-vector, in (x, y, z, w) order.
+                velocity: A 3-vector.
+        """
+        with self.lock:
+            if self.size:
+                assert(time > self.times[self.start + self.size - 1])
+            if self.size == self.capacity:
+                self.start = (self.start + 1) % self.capacity
+            else:
+                self.size += 1
+            i = (self.start + self.size - 1) % self.capacity
+            for row in (i, i + self.capacity):
+                self.times[row]       = time
+                self.positions[row]   = position
+                self.quaternions[row] = quaternion
+                self.velocities[row]  = velocity
+
+    def time_range(self):
+        """ Get the (oldest, newest) times held, or None if empty. """
+        with self.lock:
+            if not self.size:
+                return None
+            return (self.times[self.start],
+                    self.times[self.start + self.size - 1])
+
+    def lookup(self, times):
+        """ Get the interpolated poses at some times.
+
+            Args:
+                times: A sequence of floats, times in seconds, in any order.
+
+            Returns:
+                A tuple of a boolean array, True where the time was within
+                the held range, and arrays of the positions (n x 3),
+                quaternions (n x 4) and velocities (n x 3) at each time;
+                rows of times out of range are zero.
+        """
+        times = np.asarray(times, dtype=float).reshape(-1)
+        n = len(times)
+        positions   = np.zeros((n, 3))
+        quaternions = np.zeros((n, 4))
+        velocities  = np.zeros((n, 3))
+        with self.lock:
+            held = slice(self.start, self.start + self.size)
+            held_times = self.times[held]
+            valid = np.zeros(n, dtype=bool)
+            if self.size:
+                valid = (times >= held_times[0]) & (times <= held_times[-1])
+            if not valid.any():
+                return valid, positions, quaternions, velocities
+
+            query = times[valid]
+            # Index of the sample at or after each time, and the one before.
+            after = np.clip(np.searchsorted(held_times, query), 1,
+                            max(self.size - 1, 1))
+            before = after - 1
+            if self.size == 1:
+                after = before
+            span = held_times[after] - held_times[before]
+            alpha = np.where(span > 0.0, (query - held_times[before]) /
+                             np.where(span > 0.0, span, 1.0), 0.0)[:, None]
+
+            p = self.positions[held]
+            v = self.velocities[held]
+            q = self.quaternions[held]
+            positions[valid]   = (1.0 - alpha) * p[before] + alpha * p[after]
+            velocities[valid]  = (1.0 - alpha) * v[before] + alpha * v[after]
+            quaternions[valid] = slerp(q[before], q[after], alpha)
+        return valid, positions, quaternions, velocities
+
+
+def slerp(q0, q1, alpha):
+    """ Spherically interpolate between rows of unit quaternions.
+
+        Args:
+            q0: An n x 4 numpy array of quaternions, at alpha 0.
+            q1: An n x 4 numpy array of quaternions, at alpha 1.
+            alpha: An n x 1 numpy array of interpolation fractions.
+
+        Returns:
+            An n x 4 numpy array of unit quaternions, on the shortest arc
+            from each row of `q0` to the same row of `q1`.
+    """
+    dot = np.sum(q0 * q1, axis=1, keepdims=True)
+    # q and -q are the same rotation; take the shorter way around.
+    q1 = np.where(dot < 0.0, -q1, q1)
+    dot = np.abs(dot)
+
+    theta = np.arccos(np.clip(dot, -1.0, 1.0))
+    sin_theta = np.sin(theta)
+    # Nearly equal quaternions fall back to linear interpolation.
+    close = sin_theta < 1e-6
+    safe = np.where(close, 1.0, sin_theta)
+    w0 = np.where(close, 1.0 - alpha, np.sin((1.0 - alpha) * theta) / safe)
+    w1 = np.where(close, alpha, np.sin(alpha * theta) / safe)
+    q = w0 * q0 + w1 * q1
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
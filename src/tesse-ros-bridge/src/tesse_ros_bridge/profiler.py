@@ -0,0 +1,160 @@
+import collections
+import os
+import sys
+import threading
+import time
+
+
+class Profile(object):
+    """ Stack samples of all threads, as taken by `SamplingProfiler`. """
+
+    def __init__(self):
+        # Counts of sampled stacks, each a tuple of the thread name and the
+        # (filename, first line, function name) of its frames, outermost
+        # first.
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.duration = 0.0
+
+    def add(self, thread_name, stack):
+        self.stacks[(thread_name,) + tuple(stack)] += 1
+
+    def write_collapsed(self, path):
+        """ Write the stacks in the collapsed format of flamegraph.pl and
+            speedscope: one `thread;outer;...;inner count` line per stack.
+
+            Args:
+                path: A string, path of the file to write.
+        """
+        with open(path, 'w') as profile_file:
+            for stack, count in sorted(self.stacks.items()):
+                profile_file.write("%s %d\n" % (';'.join(
+                    [stack[0]] + [_label(frame) for frame in stack[1:]]),
+                    count))
+
+    def top_functions(self, n=20):
+        """ Get the functions found in the most samples.
+
+            Args:
+                n: An integer, number of functions to return.
+
+            Returns:
+                A list of (label, self samples, total samples) tuples, sorted
+                by self samples, where self samples are those with the
+                function innermost and total samples those with it anywhere
+                on the stack.
+        """
+        self_counts = collections.Counter()
+        total_counts = collections.Counter()
+        for stack, count in self.stacks.items():
+            if len(stack) > 1:
+                self_counts[stack[-1]] += count
+            for frame in set(stack[1:]):
+                total_counts[frame] += count
+        functions = sorted(total_counts, key=lambda frame:
+                           (-self_counts[frame], -total_counts[frame]))
+        return [(_label(frame), self_counts[frame], total_counts[frame])
+                for frame in functions[:n]]
+
+    def thread_samples(self):
+        """ Get the number of samples of each thread, by thread name. """
+        counts = collections.Counter()
+        for stack, count in self.stacks.items():
+            counts[stack[0]] += count
+        return dict(counts)
+
+    def summary(self, n=20):
+        """ Format the top functions and the samples per thread as text. """
+        lines = ["%d samples in %.1f s" % (self.samples, self.duration),
+                 "%7s %7s  %s" % ("self%", "total%", "function")]
+        scale = 100.0 / max(self.samples, 1)
+        for label, self_count, total_count in self.top_functions(n):
+            lines.append("%6.1f%% %6.1f%%  %s" % (scale * self_count,
+                                                  scale * total_count, label))
+        lines.append("threads:")
+        for name, count in sorted(self.thread_samples().items()):
+            lines.append("  %-24s %d" % (name, count))
+        return '\n'.join(lines)
+
+
+def _label(frame):
+    filename, line, name = frame
+    return "%s (%s:%d)" % (name, os.path.basename(filename), line)
+
+
+class SamplingProfiler(object):
+    """ Profiles every thread of the running process by sampling stacks.
+
+        Each `interval`, the Python stack of every other thread is read with
+        `sys._current_frames`, which is cheap enough to run against a node
+        under production load, needs no restart, and covers threads that
+        were started before profiling began. Samples are of wall time:
+        threads blocked in I/O or sleeping are sampled at their waiting
+        call.
+    """
+
+    def __init__(self, interval=0.005, clock=time.time, sleep=time.sleep):
+        """ Set up the profiler.
+
+            Args:
+                interval: A float, seconds between samples.
+                clock: A function returning the wall time in seconds.
+                sleep: A function sleeping for a number of seconds.
+        """
+        assert(interval > 0.0)
+        self.interval = interval
+        self.clock    = clock
+        self.sleep    = sleep
+        self.lock     = threading.Lock()
+
+    def run(self, duration, interval=None, is_shutdown=None):
+        """ Sample all other threads for `duration` seconds, on this thread.
+
+            Args:
+                duration: A float, seconds to profile for.
+                interval: An optional float, seconds between samples of
+                    this profile instead of `interval`.
+                is_shutdown: An optional function returning True to stop.
+
+            Returns:
+                A Profile.
+
+            Raises:
+                RuntimeError: if a profile is already running.
+        """
+        if not self.lock.acquire(False):
+            raise RuntimeError("A profile is already running")
+        try:
+            interval = interval or self.interval
+            profile = Profile()
+            own_thread = threading.current_thread().ident
+            start = self.clock()
+            next_sample = start
+            while self.clock() < start + duration:
+                if is_shutdown is not None and is_shutdown():
+                    break
+                self._sample(profile, own_thread)
+                next_sample += interval
+                delay = next_sample - self.clock()
+                if delay > 0.0:
+                    self.sleep(delay)
+            profile.duration = self.clock() - start
+            return profile
+        finally:
+            self.lock.release()
+
+    def _sample(self, profile, own_thread):
+        names = dict((thread.ident, thread.name)
+                     for thread in threading.enumerate())
+        for ident, frame in sys._current_frames().items():
+            if ident == own_thread:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno,
+                              code.co_name))
+                frame = frame.f_back
+            stack.reverse()
+            profile.add(names.get(ident, str(ident)), stack)
+        profile.samples += 1
@@ -0,0 +1,373 @@
+import json
+import os
+import threading
+import traceback
+
+import numpy as np
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+MANIFEST_FILENAME = 'manifest.json'
+RECORDING_VERSION = 1
+
+
+class Recorder(object):
+    """ Records streams of fixed-size records into memory-mappable files.
+
+        A stream is a sequence of records with named columns, e.g. a camera
+        stream with 'stamp' and 'image' columns, where every value of a
+        column has the same dtype and shape. Each column is stored as a flat
+        binary file of back-to-back values, so a file of images is a block
+        of fixed-size frames and a file of IMU samples is a columnar array.
+        Files are split into chunks of at most `max_chunk_bytes` per stream.
+
+        Files are laid out as `<directory>/<stream>/<column>.<chunk>.bin`,
+        with dtypes, shapes and record counts in `manifest.json`. The
+        manifest is rewritten whenever a chunk is completed and on `stop`.
+        Open recordings with `Recording`.
+
+        `record` only queues the values; a writer thread writes them to disk,
+        so the recording threads never wait on file I/O unless the writer
+        falls `queue_size` records behind. Records arriving once `stop` has
+        begun are dropped and counted.
+    """
+
+    def __init__(self, directory, max_chunk_bytes=1 << 30, queue_size=1024):
+        """ Set up the recorder; call `start` to run it.
+
+            Args:
+                directory: A string, path of the directory to record into.
+                    It is created if needed and must not hold a recording.
+                max_chunk_bytes: An integer, size in bytes from which the
+                    files of a stream are split into a new chunk.
+                queue_size: An integer, number of records that may wait
+                    for the writer before `record` blocks.
+        """
+        assert(max_chunk_bytes > 0)
+        assert(queue_size > 0)
+        if os.path.exists(os.path.join(directory, MANIFEST_FILENAME)):
+            raise ValueError("%s already holds a recording" % directory)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.directory       = directory
+        self.max_chunk_bytes = max_chunk_bytes
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.stopped = False
+
+        # Column layout of each stream, fixed by its first record.
+        self.layouts = {}
+        self.layouts_lock = threading.Lock()
+
+        # Writer thread state.
+        self.streams = {}
+        self.lock = threading.Lock()
+        self.counts = {'records': 0, 'bytes': 0, 'chunks': 0,
+                       'write_errors': 0, 'dropped': 0}
+
+    def start(self):
+        """ Start the writer thread. """
+        assert(self.thread is None)
+        self.thread = threading.Thread(target=self._write,
+                                       name='recorder_write')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """ Write all queued records, close the files and the manifest.
+
+            Later records are dropped, so recording threads that are still
+            running never block on the full queue.
+        """
+        self.stopped = True
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+        # Records queued after the end marker by threads racing `stop`.
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self._count('dropped')
+
+        for stream in self.streams.values():
+            stream.close()
+        self._write_manifest()
+
+    def record(self, name, columns, copy=True):
+        """ Queue a record of a stream for writing.
+
+            The first record of a stream fixes the dtype and shape of its
+            columns; later records must match them.
+
+            Args:
+                name: A string, the stream name.
+                columns: A dictionary from column names to numpy arrays or
+                    scalars.
+                copy: If False, arrays are handed to the writer thread as is
+                    and must not be modified afterwards. By default they are
+                    copied, so reused buffers may be passed.
+
+            Raises:
+                ValueError: if the columns don't match the stream's layout.
+        """
+        if self.stopped:
+            self._count('dropped')
+            return
+        values = {}
+        for column, value in columns.items():
+            values[column] = np.array(value, order='C') if copy \
+                else np.require(value, requirements='C')
+
+        layout = self.layouts.get(name)
+        if layout is None:
+            with self.layouts_lock:
+                layout = self.layouts.setdefault(name, dict(
+                    (column, (value.dtype, value.shape))
+                    for column, value in values.items()))
+        if len(values) != len(layout) or any(
+                column not in layout or
+                (value.dtype, value.shape) != layout[column]
+                for column, value in values.items()):
+            raise ValueError("record does not match the layout of stream "
+                             "%s" % name)
+
+        # Wait for room, unless stopped meanwhile.
+        while True:
+            try:
+                self.queue.put((name, values), timeout=0.1)
+                return
+            except queue.Full:
+                if self.stopped:
+                    self._count('dropped')
+                    return
+
+    def stats(self):
+        """ Get the writer's progress.
+
+            Returns:
+                A dictionary with 'records', 'bytes' and 'chunks' written,
+                'write_errors', records 'dropped' because they arrived after
+                `stop`, and 'queued' records.
+        """
+        with self.lock:
+            stats = dict(self.counts)
+        stats['queued'] = self.queue.qsize()
+        return stats
+
+    def _write(self):
+        """ Writer thread: write queued records until stopped. """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            name, values = item
+            try:
+                stream = self.streams.get(name)
+                if stream is None:
+                    stream = _StreamWriter(self.directory, name,
+                                           self.layouts[name])
+                    self.streams[name] = stream
+                    self._count('chunks')
+                elif stream.chunk_bytes + stream.record_bytes > \
+                        self.max_chunk_bytes and stream.chunk_records > 0:
+                    stream.next_chunk()
+                    self._count('chunks')
+                    self._write_manifest()
+
+                stream.write(values)
+                self._count('records')
+                self._count('bytes', stream.record_bytes)
+            except Exception:
+                self._count('write_errors')
+                print("TESSE_ROS_NODE: recorder write error on %s:\n%s" %
+                      (name, traceback.format_exc()))
+
+    def _write_manifest(self):
+        """ Atomically replace the manifest with the current state. """
+        manifest = {'version': RECORDING_VERSION, 'streams': {}}
+        for name, stream in self.streams.items():
+            manifest['streams'][name] = stream.manifest()
+
+        path = os.path.join(self.directory, MANIFEST_FILENAME)
+        with open(path + '.tmp', 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+        os.rename(path + '.tmp', path)
+
+    def _count(self, key, value=1):
+        with self.lock:
+            self.counts[key] += value
+
+
+class _StreamWriter(object):
+    """ Files of the current chunk of one stream. Used by the writer thread. """
+
+    def __init__(self, directory, name, layout):
+        self.directory = os.path.join(directory, name)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.layout = layout
+        self.record_bytes = sum(dtype.itemsize * int(np.prod(shape))
+                                for dtype, shape in layout.values())
+
+        self.chunks = [0]
+        self.chunk_bytes = 0
+        self.files = {}
+        self._open()
+
+    @property
+    def chunk_records(self):
+        return self.chunks[-1]
+
+    def write(self, values):
+        for column, value in values.items():
+            self.files[column].write(value.data)
+        self.chunks[-1] += 1
+        self.chunk_bytes += self.record_bytes
+
+    def next_chunk(self):
+        self.close()
+        self.chunks.append(0)
+        self.chunk_bytes = 0
+        self._open()
+
+    def close(self):
+        for column_file in self.files.values():
+            column_file.close()
+        self.files = {}
+
+    def manifest(self):
+        return {
+            'columns': dict((column, {'dtype': dtype.str,
+                                      'shape': list(shape)})
+                            for column, (dtype, shape) in self.layout.items()),
+            'chunks': list(self.chunks),
+        }
+
+    def _open(self):
+        chunk = len(self.chunks) - 1
+        for column in self.layout:
+            self.files[column] = open(
+                column_path(self.directory, column, chunk), 'wb')
+
+
+def column_path(stream_directory, column, chunk):
+    """ Path of the file holding one chunk of a column. """
+    return os.path.join(stream_directory, '%s.%04d.bin' % (column, chunk))
+
+
+class Recording(object):
+    """ A recording made by `Recorder`, opened lazily.
+
+        Only the manifest is read on construction. Column files are memory
+        mapped on first access, so opening a recording is cheap regardless
+        of its size and reading a few records only touches their pages.
+    """
+
+    def __init__(self, directory):
+        """ Open a recording.
+
+            Args:
+                directory: A string, path of the recording directory.
+        """
+        with open(os.path.join(directory, MANIFEST_FILENAME)) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest['version'] != RECORDING_VERSION:
+            raise ValueError("unsupported recording version %s" %
+                             manifest['version'])
+
+        self.directory = directory
+        self.streams = dict(
+            (name, RecordedStream(os.path.join(directory, name), stream))
+            for name, stream in manifest['streams'].items())
+
+    def __getitem__(self, name):
+        return self.streams[name]
+
+    def __contains__(self, name):
+        return name in self.streams
+
+
+class RecordedStream(object):
+    """ One stream of a recording, see `Recording`. """
+
+    def __init__(self, directory, manifest):
+        self.directory = directory
+        self.columns = dict(
+            (column, (np.dtype(str(spec['dtype'])), tuple(spec['shape'])))
+            for column, spec in manifest['columns'].items())
+        self.chunk_sizes = list(manifest['chunks'])
+        self.offsets = np.cumsum([0] + self.chunk_sizes)
+        self._chunks = {}
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, index):
+        """ Get one record as a dictionary from column names to values. """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("record index out of range")
+        chunk = int(np.searchsorted(self.offsets, index, side='right')) - 1
+        return dict((column, self.chunks(column)[chunk][index -
+                                                        self.offsets[chunk]])
+                    for column in self.columns)
+
+    def chunks(self, column):
+        """ Get the memory-mapped chunks of a column.
+
+            Args:
+                column: A string, the column name.
+
+            Returns:
+                A list of read-only numpy arrays of shape (N,) + shape, one
+                per chunk.
+        """
+        chunks = self._chunks.get(column)
+        if chunks is None:
+            dtype, shape = self.columns[column]
+            chunks = []
+            for chunk, size in enumerate(self.chunk_sizes):
+                if size == 0:
+                    chunks.append(np.empty((0,) + shape, dtype=dtype))
+                    continue
+                chunks.append(np.memmap(
+                    column_path(self.directory, column, chunk), dtype=dtype,
+                    mode='r', shape=(size,) + shape))
+            self._chunks[column] = chunks
+        return chunks
+
+    def read(self, column, start=0, stop=None):
+        """ Read a range of values of a column into memory.
+
+            Args:
+                column: A string, the column name.
+                start: An integer, index of the first record.
+                stop: An integer, index after the last record. Defaults to
+                    the end of the stream.
+
+            Returns:
+                A numpy array of shape (stop - start,) + shape.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        dtype, shape = self.columns[column]
+        parts = []
+        for chunk, values in enumerate(self.chunks(column)):
+            begin = self.offsets[chunk]
+            end = self.offsets[chunk + 1]
+            if end <= start or begin >= stop:
+                continue
+            parts.append(values[max(start - begin, 0):min(stop, end) - begin])
+        if not parts:
+            return np.empty((0,) + shape, dtype=dtype)
+        return np.concatenate(parts)
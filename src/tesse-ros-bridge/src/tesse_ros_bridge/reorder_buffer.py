@@ -0,0 +1,127 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class ReorderBuffer(object):
+    """ Time-ordered jitter buffer for the UDP metadata stream.
+
+        Samples are released in increasing sim time. A sample that follows
+        the last released one within 1.5 periods is released as soon as it
+        arrives, so an in-order stream passes straight through. A sample
+        after a hole is held for up to `latency` wall seconds, waiting for
+        the missing samples to arrive out of order; if they don't, it is
+        released by the next `add` or `poll` and the hole counted as a gap.
+
+        Duplicates, and samples arriving after a later one was released, are
+        dropped and counted. At most `max_size` samples are held; beyond
+        that the oldest are released regardless of holes.
+    """
+
+    def __init__(self, period, latency=0.01, max_size=64,
+                 wall_clock=time.time):
+        """ Set up an empty buffer.
+
+            Args:
+                period: A float, nominal sim seconds between samples.
+                latency: A float, wall seconds a sample may be held.
+                max_size: An integer, number of samples that may be held.
+                wall_clock: A function returning the wall time in seconds.
+        """
+        assert(period > 0.0 and latency >= 0.0 and max_size > 0)
+        self.period     = period
+        self.latency    = latency
+        self.max_size   = max_size
+        self.wall_clock = wall_clock
+
+        self.lock = threading.Lock()
+        self.heap = []
+        self.held_times = set()
+        self.order = itertools.count()
+        self.last_time = None
+        self.max_time = None
+        self.counts = {'received': 0, 'released': 0, 'reordered': 0,
+                       'duplicates': 0, 'stale': 0, 'gaps': 0, 'missing': 0,
+                       'overflows': 0}
+
+    def add(self, sim_time, sample):
+        """ Add a sample and get the samples that are ready.
+
+            Args:
+                sim_time: A float, the sample's sim time.
+                sample: The sample, e.g. a metadata dictionary.
+
+            Returns:
+                A list of the released samples, in increasing sim time.
+        """
+        with self.lock:
+            self.counts['received'] += 1
+            if sim_time in self.held_times or sim_time == self.last_time:
+                self.counts['duplicates'] += 1
+            elif self.last_time is not None and sim_time < self.last_time:
+                self.counts['stale'] += 1
+            else:
+                if self.max_time is not None and sim_time < self.max_time:
+                    self.counts['reordered'] += 1
+                else:
+                    self.max_time = sim_time
+                heapq.heappush(self.heap, (sim_time, next(self.order),
+                                           self.wall_clock(), sample))
+                self.held_times.add(sim_time)
+            return self._release(False)
+
+    def poll(self):
+        """ Release the held samples that have waited `latency`, without
+            adding one. Call it periodically, so that a sample after a hole
+            isn't held until the next sample arrives.
+
+            Returns:
+                A list of the released samples, in increasing sim time.
+        """
+        with self.lock:
+            return self._release(False)
+
+    def flush(self):
+        """ Release all held samples, e.g. at the end of a stream.
+
+            Returns:
+                A list of the released samples, in increasing sim time.
+        """
+        with self.lock:
+            return self._release(True)
+
+    def stats(self):
+        """ Get counts of samples 'received', 'released', released after
+            arriving out of order ('reordered'), dropped as 'duplicates' or
+            as 'stale' (older than a released sample), of 'gaps' and the
+            samples 'missing' in them, of 'overflows' (samples released
+            early because the buffer was full), and the number 'held'.
+        """
+        with self.lock:
+            return dict(self.counts, held=len(self.heap))
+
+    def _release(self, flush):
+        released = []
+        now = self.wall_clock()
+        while self.heap:
+            sim_time, _, arrival, sample = self.heap[0]
+            follows = self.last_time is None or \
+                sim_time - self.last_time <= 1.5 * self.period
+            overflow = len(self.heap) > self.max_size
+            if not (flush or follows or overflow or
+                    now - arrival >= self.latency):
+                break
+
+            heapq.heappop(self.heap)
+            self.held_times.discard(sim_time)
+            if not follows:
+                self.counts['gaps'] += 1
+                self.counts['missing'] += max(int(round(
+                    (sim_time - self.last_time) / self.period)) - 1, 0)
+            if overflow and not follows:
+                self.counts['overflows'] += 1
+            self.last_time = sim_time
+            self.counts['released'] += 1
+            released.append(sample)
+        return released
@@ -0,0 +1,127 @@
+import math
+import threading
+import time
+
+
+class SimClock(object):
+    """ Simulated time derived from the metadata stream.
+
+        Every metadata sample received from the simulator anchors the clock
+        to its sim time. Between samples, time is extrapolated from the local
+        wall clock at an estimated rate: nominally 1 / speedup_factor, then
+        continuously corrected for drift between the simulator and this host.
+        Extrapolation stops `max_extrapolation` seconds past the last sample,
+        so a paused or stepped simulator is never run ahead of, and the
+        published time never goes backwards.
+
+        All times returned are in published (ROS) seconds, i.e. sim time
+        divided by `speedup_factor`.
+    """
+
+    def __init__(self, speedup_factor=1.0, max_extrapolation=0.1,
+                 drift_gain=0.01, wall_clock=time.time):
+        """ Set up the clock.
+
+            Args:
+                speedup_factor: A float, sim time is divided by this before
+                    being published.
+                max_extrapolation: A float, longest time in seconds the
+                    clock runs past the last received sample.
+                drift_gain: A float in (0, 1], gain of the filter estimating
+                    the rate of the simulator clock against the wall clock.
+                wall_clock: A function returning the wall time in seconds.
+        """
+        assert(speedup_factor > 0.0)
+        assert(0.0 < drift_gain <= 1.0)
+        self.speedup_factor    = speedup_factor
+        self.max_extrapolation = max_extrapolation
+        self.drift_gain        = drift_gain
+        self.wall_clock        = wall_clock
+
+        self.rate           = 1.0 / speedup_factor
+        self.anchor_time    = None
+        self.anchor_wall    = None
+        self.last_published = None
+
+        # Prediction error at each sample: extrapolated minus received time.
+        self.n_errors        = 0
+        self.sum_error       = 0.0
+        self.sum_sq_error    = 0.0
+        self.max_abs_error   = 0.0
+
+        self.lock = threading.Lock()
+
+    def update(self, sim_time, wall_time=None):
+        """ Anchor the clock to a newly received metadata sample.
+
+            Args:
+                sim_time: A float, simulator time of the sample.
+                wall_time: An optional float, wall time at which the sample
+                    arrived. Defaults to now.
+        """
+        if wall_time is None:
+            wall_time = self.wall_clock()
+        stamp = sim_time / self.speedup_factor
+
+        with self.lock:
+            if self.anchor_time is not None:
+                error = self._extrapolate(wall_time) - stamp
+                self.n_errors += 1
+                self.sum_error += error
+                self.sum_sq_error += error * error
+                self.max_abs_error = max(self.max_abs_error, abs(error))
+
+                d_wall = wall_time - self.anchor_wall
+                d_stamp = stamp - self.anchor_time
+                if d_wall > 0.0 and d_stamp > 0.0:
+                    self.rate += self.drift_gain * (d_stamp / d_wall - self.rate)
+
+            self.anchor_time = stamp
+            self.anchor_wall = wall_time
+
+    def now(self, wall_time=None):
+        """ Current simulated time, in published seconds.
+
+            Args:
+                wall_time: An optional float, wall time to evaluate the clock
+                    at. Defaults to now.
+
+            Returns:
+                A float, or None if no sample has been received yet.
+        """
+        if wall_time is None:
+            wall_time = self.wall_clock()
+
+        with self.lock:
+            if self.anchor_time is None:
+                return None
+
+            stamp = self._extrapolate(wall_time)
+            if self.last_published is not None:
+                stamp = max(stamp, self.last_published)
+            self.last_published = stamp
+            return stamp
+
+    def stats(self):
+        """ Clock-error statistics, in published seconds.
+
+            Returns:
+                A dictionary with the number of samples compared ('samples'),
+                the 'mean', 'rms' and 'max_abs' error of the extrapolated
+                time at the arrival of each sample, and the current estimated
+                'rate' of published time per wall second.
+        """
+        with self.lock:
+            n = self.n_errors
+            return {
+                'samples': n,
+                'mean': self.sum_error / n if n else 0.0,
+                'rms': math.sqrt(self.sum_sq_error / n) if n else 0.0,
+                'max_abs': self.max_abs_error,
+                'rate': self.rate,
+            }
+
+    def _extrapolate(self, wall_time):
+        """ Extrapolate from the anchor, bounded by `max_extrapolation`. """
+        elapsed = max(0.0, wall_time - self.anchor_wall) * self.rate
+        return self.anchor_time + min(elapsed, self.max_extrapolation)
@@ -1,23 +1,46 @@
 #!/usr/bin/env python
 
+import os
+import tempfile
+import threading
+import time
 import numpy as np
 #import cv2
+from multiprocessing.pool import ThreadPool
 import rospy
-import tf
 import tf2_ros
 from std_msgs.msg import Header, String
 from sensor_msgs.msg import Image as ImageMsg
-from sensor_msgs.msg import Imu, CameraInfo
+from sensor_msgs.msg import Imu, CameraInfo, CompressedImage
 from nav_msgs.msg import Odometry
 from geometry_msgs.msg import Pose, PoseStamped, Point, \
-     PointStamped, TransformStamped, Twist, Quaternion
+     PointStamped, TransformStamped, Twist, Quaternion, Vector3
 from rosgraph_msgs.msg import Clock
-from cv_bridge import CvBridge, CvBridgeError
+from tf2_msgs.msg import TFMessage
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
 
 import tesse_ros_bridge.utils
+from tesse_ros_bridge.sim_clock import SimClock
+from tesse_ros_bridge.image_pipeline import ImagePipeline
+from tesse_ros_bridge.camera_scheduler import CameraScheduler
+from tesse_ros_bridge.lockstep import LockstepDriver
+from tesse_ros_bridge.recorder import Recorder
+from tesse_ros_bridge.timing import StageTimings
+from tesse_ros_bridge.imu_monitor import ImuMonitor
+from tesse_ros_bridge.profiler import SamplingProfiler
+from tesse_ros_bridge.udp_receiver import UdpReceiver, UDP_POLICIES
+from tesse_ros_bridge.reorder_buffer import ReorderBuffer
+from tesse_ros_bridge.tf_batcher import TfBatcher
+from tesse_ros_bridge.pose_history import PoseHistory
+from tesse_ros_bridge.camera_info_cache import CameraInfoCache, \
+     camera_info_key
+from tesse_ros_bridge.capture import CaptureWriter, Replayer, read_capture, \
+     read_camera_info, CAPTURE_METADATA, CAPTURE_FRAME
 
 from tesse_ros_bridge.srv import SceneRequestService, \
-     ObjectSpawnRequestService
+     ObjectSpawnRequestService, TimingSnapshotService, \
+     TimingSnapshotServiceResponse, ProfileService, ProfileServiceResponse, \
+     PoseHistoryService, PoseHistoryServiceResponse
 from tesse_ros_bridge import brh_T_blh
 
 from tesse.msgs import *
@@ -36,6 +59,26 @@ class TesseROSWrapper:
         self.udp_port      = rospy.get_param("~udp_port", 19004)
         self.step_port     = rospy.get_param("~step_port", 19005)
 
+        # Metadata packets are received in batches of all queued packets.
+        # `udp_policy` is "all" to process every packet of a batch in order,
+        # or "latest" to only process the newest one; `udp_rcvbuf` is the
+        # socket buffer size in bytes, which holds the backlog of a stall.
+        self.udp_policy    = rospy.get_param("~udp_policy", "all")
+        assert(self.udp_policy in UDP_POLICIES)
+        self.udp_rcvbuf    = rospy.get_param("~udp_rcvbuf", 4194304)
+
+        # Packets are re-sequenced by sim time, waiting up to
+        # `reorder_latency` seconds for late ones; duplicates and packets
+        # older than published ones are dropped. After a gap of more than
+        # `max_metadata_gap` sim seconds, differencing restarts instead of
+        # spanning the gap.
+        self.reorder_latency  = rospy.get_param("~reorder_latency", 0.01)
+        assert(self.reorder_latency >= 0.0)
+        if self.udp_policy == "latest":
+            # Its holes are deliberate; waiting for them only adds latency.
+            self.reorder_latency = 0.0
+        self.max_metadata_gap = rospy.get_param("~max_metadata_gap", 0.05)
+
         # Set data to publish
         # `publish_mono_stereo` is true to publish one channel stereo images
         # Otherwise, publish as bgr8
@@ -60,12 +103,108 @@ class TesseROSWrapper:
         self.near_draw_dist  = rospy.get_param("~near_draw_dist", 0.05)
         self.far_draw_dist   = rospy.get_param("~far_draw_dist", 50)
 
+        # Depth images are published as 32FC1 meters or 16UC1 millimeters,
+        # in which case depth beyond `depth_max_range` is marked invalid (0).
+        self.depth_encoding  = rospy.get_param("~depth_encoding", "32FC1")
+        assert(self.depth_encoding in tesse_ros_bridge.utils.DEPTH_ENCODINGS)
+        self.depth_max_range = rospy.get_param("~depth_max_range",
+                                               self.far_draw_dist)
+        self.depth_converter = tesse_ros_bridge.utils.DepthImageConverter(
+            self.far_draw_dist, self.depth_encoding, self.depth_max_range)
+
         # Simulator speed parameters:
         self.speedup_factor = rospy.get_param("~speedup_factor", 1.0)
         assert(self.speedup_factor > 0.0)  # We are  dividing by this so > 0
         self.frame_rate     = rospy.get_param("~frame_rate", 20.0)
         self.imu_rate       = rospy.get_param("~imu_rate", 200.0)
 
+        # Per-camera rates; `frame_rate` is the fastest any camera can run.
+        stereo_rate       = rospy.get_param("~stereo_rate", self.frame_rate)
+        segmentation_rate = rospy.get_param("~segmentation_rate", self.frame_rate)
+        depth_rate        = rospy.get_param("~depth_rate", self.frame_rate)
+
+        # Clock parameters:
+        # `clock_mode` is "stream" to derive /clock from the UDP metadata,
+        # or "poll" to busy-poll the simulator's metadata port instead.
+        self.clock_mode         = rospy.get_param("~clock_mode", "stream")
+        assert(self.clock_mode in ["stream", "poll"])
+        self.clock_publish_rate = rospy.get_param("~clock_publish_rate", 200.0)
+        assert(self.clock_publish_rate > 0.0)
+        self.clock_stats_period = rospy.get_param("~clock_stats_period", 10.0)
+
+        # Image acquisition parameters:
+        # If `pipelined_images`, the next image request to the simulator is
+        # in flight while the previous frame is converted and published.
+        self.pipelined_images = rospy.get_param("~pipelined_images", True)
+        self.image_queue_size = rospy.get_param("~image_queue_size", 2)
+        assert(self.image_queue_size > 0)
+
+        # If `compressed_images`, stereo images are requested compressed and
+        # published on `.../compressed` topics by `image_workers` threads.
+        # tesse-interface hands over decoded arrays, so this costs a decode
+        # in the interface plus a re-encode here (with OpenCV), the latter
+        # only while the compressed topic has subscribers.
+        # Segmentation and depth are always requested lossless.
+        self.compressed_images = rospy.get_param("~compressed_images", False)
+        self.compressed_format = rospy.get_param("~compressed_format", "jpeg")
+        assert(self.compressed_format in tesse_ros_bridge.utils.COMPRESSED_FORMATS)
+        image_workers          = rospy.get_param("~image_workers", 2)
+        assert(image_workers > 0)
+
+        # If `lazy_cameras`, cameras whose image topics have no subscribers
+        # are left out of requests, and their CameraInfo is not published.
+        # Not applied in step mode, where every step publishes all cameras.
+        self.lazy_cameras = rospy.get_param("~lazy_cameras", False)
+
+        # Recording parameters:
+        # If `record_dir` is set, raw images and processed metadata are
+        # recorded there, in files split every `record_chunk_size` MB.
+        # Open recordings with `tesse_ros_bridge.recorder.Recording`.
+        self.record_dir        = rospy.get_param("~record_dir", "")
+        self.record_chunk_size = rospy.get_param("~record_chunk_size", 1024)
+        assert(self.record_chunk_size > 0)
+
+        # Capture and replay parameters:
+        # If `capture_file` is set, raw metadata packets and image responses
+        # are captured there with their arrival times. If `replay_capture` is
+        # set, the node doesn't connect to the simulator and instead replays
+        # that capture through the same processing and publishing code, at
+        # `replay_speed` times the captured rate (0 for as fast as possible).
+        # Camera parameters must match those of the capture.
+        self.capture_file   = rospy.get_param("~capture_file", "")
+        self.replay_capture = rospy.get_param("~replay_capture", "")
+        self.replay_speed   = rospy.get_param("~replay_speed", 1.0)
+        assert(self.replay_speed >= 0.0)
+        assert(not (self.capture_file and self.replay_capture))
+
+        # Diagnostics parameters:
+        # Stages of the metadata, image and clock callbacks are timed over
+        # their last `timing_window` runs; their percentiles are published
+        # on /diagnostics every `diagnostics_period` seconds (0 to disable)
+        # and available from the `timing_snapshot` service.
+        self.diagnostics_period = rospy.get_param("~diagnostics_period", 1.0)
+        self.timings = StageTimings(
+            window=rospy.get_param("~timing_window", 1024))
+
+        # Kernel drops of the UDP receiver at the last diagnostics.
+        self.last_kernel_drops = 0
+
+        # Serves the `profile` service; runs only while it is called.
+        self.profiler = SamplingProfiler()
+
+        # The last `pose_history_length` sim seconds of ground truth, looked
+        # up by the `pose_history` service.
+        self.pose_history = PoseHistory(max(int(
+            rospy.get_param("~pose_history_length", 10.0) * self.imu_rate), 2))
+
+        # The regularity of the IMU stream over its last 10 seconds is
+        # published with the diagnostics, as a warning if the standard
+        # deviation of its wall inter-arrival times exceeds
+        # `imu_jitter_threshold` seconds.
+        self.imu_monitor = ImuMonitor(self.imu_rate, self.speedup_factor,
+            window=max(int(10 * self.imu_rate), 2),
+            jitter_threshold=rospy.get_param("~imu_jitter_threshold", 0.002))
+
         # Output parameters:
         self.world_frame_id     = rospy.get_param("~world_frame_id", "world")
         self.body_frame_id      = rospy.get_param("~body_frame_id", "base_link_gt")
@@ -73,6 +212,14 @@ class TesseROSWrapper:
         self.right_cam_frame_id = rospy.get_param("~right_cam_frame_id", "right_cam")
         assert(self.left_cam_frame_id != self.right_cam_frame_id)
 
+        # The ground-truth transform is published on /tf at up to `tf_rate`
+        # transforms per second of ROS time (0 for every metadata sample),
+        # batched into one message every `tf_batch_period` wall seconds (0
+        # to publish each transform as it arrives).
+        self.tf_rate         = rospy.get_param("~tf_rate", 0.0)
+        self.tf_batch_period = rospy.get_param("~tf_batch_period", 0.0)
+        assert(self.tf_rate >= 0.0 and self.tf_batch_period >= 0.0)
+
         self.env = Env(simulation_ip=self.client_ip,
                        own_ip=self.self_ip,
                        position_port=self.position_port,
@@ -80,43 +227,63 @@ class TesseROSWrapper:
                        image_port=self.image_port,
                        step_port=self.step_port)
 
-        # To send images via ROS network and convert from/to ROS
-        self.cv_bridge = CvBridge()
-
         # publish left and right cameras as mono8 or bgr8, depending on the given param
+        # Each camera has its image and CameraInfo publishers and its rate at
+        # the same index as in `cameras`.
         n_stereo_channels = Channels.SINGLE if publish_mono_stereo else Channels.THREE
-        self.cameras=[(Camera.RGB_LEFT,  Compression.OFF, n_stereo_channels, self.left_cam_frame_id),
-                      (Camera.RGB_RIGHT, Compression.OFF, n_stereo_channels, self.right_cam_frame_id)]
+        stereo_compression = Compression.ON if self.compressed_images else Compression.OFF
+        self.cameras=[(Camera.RGB_LEFT,  stereo_compression, n_stereo_channels, self.left_cam_frame_id),
+                      (Camera.RGB_RIGHT, stereo_compression, n_stereo_channels, self.right_cam_frame_id)]
+
+        self.camera_rates = [stereo_rate, stereo_rate]
+
+        # Names of the camera streams in recordings.
+        self.camera_names = ["left_cam", "right_cam"]
 
         self.img_pubs = [rospy.Publisher("left_cam/rgb/image_raw", ImageMsg, queue_size=10),
                          rospy.Publisher("right_cam/rgb/image_raw", ImageMsg, queue_size=10)]
 
+        self.cam_info_pubs = [rospy.Publisher("left_cam/camera_info", CameraInfo, queue_size=10),
+                              rospy.Publisher("right_cam/camera_info", CameraInfo, queue_size=10)]
+
+        # Compressed image publishers, None for uncompressed cameras.
+        self.compressed_pubs = [None, None]
+        if self.compressed_images:
+            self.compressed_pubs = [rospy.Publisher("left_cam/rgb/image_raw/compressed", CompressedImage, queue_size=10),
+                                    rospy.Publisher("right_cam/rgb/image_raw/compressed", CompressedImage, queue_size=10)]
+            self.image_workers = ThreadPool(image_workers)
+
         # setup optional publishers
         if publish_segmentation:
             self.cameras.append((Camera.SEGMENTATION, Compression.OFF, Channels.THREE,  self.left_cam_frame_id))
+            self.camera_rates.append(segmentation_rate)
+            self.camera_names.append("seg_cam")
 #            self.img_pubs.append(rospy.Publisher("segmentation/image_raw", ImageMsg, queue_size=10))
-	    self.img_pubs.append(rospy.Publisher("seg_cam/rgb/image_raw", ImageMsg, queue_size=10))
+            self.img_pubs.append(rospy.Publisher("seg_cam/rgb/image_raw", ImageMsg, queue_size=10))
+            self.cam_info_pubs.append(rospy.Publisher("seg_cam/camera_info", CameraInfo, queue_size=10))
+            self.compressed_pubs.append(None)
 
         if publish_depth:
             self.cameras.append((Camera.DEPTH, Compression.OFF, Channels.THREE,  self.left_cam_frame_id))
+            self.camera_rates.append(depth_rate)
+            self.camera_names.append("depth_cam")
 #            self.img_pubs.append(rospy.Publisher("depth/image_raw", ImageMsg, queue_size=10))
             self.img_pubs.append(rospy.Publisher("depth_cam/mono/image_raw", ImageMsg, queue_size=10))
+            self.cam_info_pubs.append(rospy.Publisher("depth_cam/camera_info", CameraInfo, queue_size=10))
+            self.compressed_pubs.append(None)
 
-        if self.publish_metadata:
-            self.metadata_pub = rospy.Publisher("metadata", String)
+        assert(len(self.img_pubs) == len(self.cameras))
+        assert(len(self.cam_info_pubs) == len(self.cameras))
+        assert(len(self.compressed_pubs) == len(self.cameras))
 
-        # Camera information members.
-        # TODO(marcus): reformat like img_pubs
-#        self.cam_info_pubs = [rospy.Publisher("left_cam/camera_info",     CameraInfo, queue_size=10),
-#                              rospy.Publisher("right_cam/camera_info",    CameraInfo, queue_size=10),
-#                              rospy.Publisher("segmentation/camera_info", CameraInfo, queue_size=10),
-#                              rospy.Publisher("depth/camera_info",        CameraInfo, queue_size=10)]
+        # Request only the cameras that are due at each frame.
+        self.camera_scheduler = CameraScheduler(self.camera_rates,
+                                                self.frame_rate)
 
-        self.cam_info_pubs = [rospy.Publisher("left_cam/camera_info",     CameraInfo, queue_size=10),
-                              rospy.Publisher("right_cam/camera_info",    CameraInfo, queue_size=10),
-                              rospy.Publisher("seg_cam/camera_info", CameraInfo, queue_size=10),
-                              rospy.Publisher("depth_cam/camera_info",        CameraInfo, queue_size=10)]
+        if self.publish_metadata:
+            self.metadata_pub = rospy.Publisher("metadata", String)
 
+        # Camera information members, in the same order as `cameras`.
         self.cam_info_msgs = []
 
         # If the clock updates faster than images can be queried in
@@ -128,45 +295,101 @@ class TesseROSWrapper:
         # Setup ROS publishers
         self.imu_pub  = rospy.Publisher("imu", Imu, queue_size=10)
         self.odom_pub = rospy.Publisher("odom", Odometry, queue_size=10)
+        self.diagnostics_pub = rospy.Publisher("/diagnostics", DiagnosticArray,
+                                               queue_size=10)
 
         # Setup ROS services.
         self.setup_ros_services()
 
-        # Transform broadcasters.
-        self.tf_broadcaster = tf.TransformBroadcaster()
+        # Transform publishers.
+        self.tf_pub = rospy.Publisher("/tf", TFMessage, queue_size=100)
+        self.tf_batcher = TfBatcher(self.tf_rate)
         # Don't call static_tf_broadcaster.sendTransform multiple times.
         # Rather call it once with multiple static tfs! Check issue #40
         self.static_tf_broadcaster = tf2_ros.StaticTransformBroadcaster()
 
-        # Required states for finite difference calculations.
-        self.prev_time      = 0.0
-        self.prev_vel_brh   = [0.0, 0.0, 0.0]
-        self.prev_enu_R_brh = np.identity(3)
+        # Holds the required states for finite difference calculations.
+        self.metadata_processor = tesse_ros_bridge.utils.MetadataProcessor()
+        self.reorder_buffer = ReorderBuffer(1.0 / self.imu_rate,
+                                            latency=self.reorder_latency)
+        # Samples skipped as out of order, and restarts of differencing.
+        self.metadata_counts = {'out_of_order': 0, 'resets': 0}
+
+        # Setup the recorder; its writer thread runs until shutdown.
+        self.recorder = None
+        if self.record_dir:
+            self.recorder = Recorder(self.record_dir,
+                max_chunk_bytes=int(self.record_chunk_size * 1024 * 1024))
+            self.recorder.start()
+
+        # Setup the capture; closed on shutdown, after its producers stop.
+        self.capture = None
+        if self.capture_file:
+            self.capture = CaptureWriter(self.capture_file)
+
+        # Camera information responses are cached in `camera_info_cache`
+        # (empty to disable), keyed by the camera parameters. If all cameras
+        # are cached, a single request checks that the simulator still has
+        # them set instead of setting and querying every camera again.
+        self.camera_info_cache = CameraInfoCache(rospy.get_param(
+            "~camera_info_cache", os.path.join(os.environ.get("ROS_HOME",
+                os.path.expanduser("~/.ros")), "tesse_camera_info.json"))
+            or None)
 
         # Setup camera parameters and extrinsics in the simulator per spec.
         self.setup_cameras()
 
-        # Setup collision
-        enable_collision = rospy.get_param("~enable_collision", 0)
-        self.setup_collision(enable_collision)
-
-        # Change scene
-        initial_scene = rospy.get_param("~initial_scene", 2)
-        rospy.wait_for_service('scene_change_request')
-        self.change_scene(initial_scene)
-        print(initial_scene)
-
-        # Setup UdpListener.
-        self.udp_listener = UdpListener(port=self.udp_port, rate=self.imu_rate)
-        self.udp_listener.subscribe('udp_subscriber', self.udp_cb)
+        self.udp_receiver = None
+        self.image_pipeline = None
+        if not self.replay_capture:
+            # Setup collision
+            enable_collision = rospy.get_param("~enable_collision", 0)
+            self.setup_collision(enable_collision)
+
+            # Change scene
+            initial_scene = rospy.get_param("~initial_scene", 2)
+            rospy.wait_for_service('scene_change_request')
+            self.change_scene(initial_scene)
+            print(initial_scene)
+
+            # Setup UdpReceiver.
+            # Samples held by `reorder_buffer` are released within
+            # `reorder_latency` even if the stream pauses.
+            self.udp_receiver = UdpReceiver(self.udp_port,
+                rcvbuf=self.udp_rcvbuf, policy=self.udp_policy,
+                timeout=min(max(self.reorder_latency, 0.001), 0.1),
+                on_timeout=self.release_metadata)
+            self.udp_receiver.subscribe('udp_subscriber', self.udp_cb)
+            if self.udp_receiver.rcvbuf < self.udp_rcvbuf:
+                rospy.logwarn("TESSE_ROS_NODE: UDP receive buffer capped at "
+                    "%d bytes by net.core.rmem_max" % self.udp_receiver.rcvbuf)
 
         # Simulated time requires that we constantly publish to '/clock'.
         self.clock_pub = rospy.Publisher("/clock", Clock, queue_size=10)
+        self.sim_clock = SimClock(self.speedup_factor)
 
         # Setup simulator step mode
-        step_mode_enabled = rospy.get_param("~enable_step_mode", False)
-        if step_mode_enabled:
+        # In step mode, `lockstep_driver` advances the simulator one frame at
+        # a time and publishes each step's metadata and images in order,
+        # as fast as possible. Every camera is requested on every step.
+        self.step_mode_enabled = rospy.get_param("~enable_step_mode", False)
+        self.lockstep_driver = None
+        if self.step_mode_enabled and not self.replay_capture:
+            # Steps wait for all of their samples.
+            assert(self.udp_policy == "all")
+            if any(rate != self.frame_rate for rate in self.camera_rates):
+                rospy.logwarn("TESSE_ROS_NODE: step mode requests every "
+                    "camera at frame_rate, ignoring per-camera rates")
             self.env.send(SetFrameRate(self.frame_rate))
+            samples_per_step = int(round(self.imu_rate / self.frame_rate))
+            self.lockstep_driver = LockstepDriver(self.step_simulator,
+                self.request_images, self.publish_clocked_sample,
+                self.publish_images, self.frame_time, 1.0 / self.frame_rate,
+                max(samples_per_step, 1),
+                timeout=rospy.get_param("~step_timeout", 1.0),
+                time_tolerance=0.5 / self.imu_rate)
+
+        rospy.on_shutdown(self.shutdown)
 
         print("TESSE_ROS_NODE: Initialization complete.")
 
@@ -177,34 +400,105 @@ class TesseROSWrapper:
             cannot simply call `rospy.spin()` as this will wait for messages
             to go to /clock first, and will freeze the node.
         """
-        rospy.Timer(rospy.Duration(1.0 / self.frame_rate), self.image_cb)
-        self.udp_listener.start()
+        if self.diagnostics_period > 0:
+            diagnostics_thread = threading.Thread(
+                target=self.diagnostics_loop, name='diagnostics')
+            diagnostics_thread.daemon = True
+            diagnostics_thread.start()
+
+        if self.tf_batch_period > 0:
+            tf_thread = threading.Thread(target=self.tf_loop, name='tf')
+            tf_thread.daemon = True
+            tf_thread.start()
+
+        if self.replay_capture:
+            self.replay()
+            return
+
+        self.udp_receiver.start()
+
+        if self.step_mode_enabled:
+            self.lockstep_loop()
+            return
+
+        if self.pipelined_images:
+            self.image_pipeline = ImagePipeline(self.request_images,
+                self.publish_images, pace=rospy.Rate(self.frame_rate).sleep,
+                queue_size=self.image_queue_size,
+                on_drop=lambda frame: self.camera_scheduler.requeue(frame[0]))
+            self.image_pipeline.start()
+        else:
+            rospy.Timer(rospy.Duration(1.0 / self.frame_rate), self.image_cb)
 
         # rospy.spin()
 
-        while not rospy.is_shutdown():
-            self.clock_cb(None)
+        if self.clock_mode == "poll":
+            while not rospy.is_shutdown():
+                self.clock_cb(None)
+        else:
+            self.stream_clock_loop()
 
     def udp_cb(self, data):
         """ Callback for UDP metadata at high rates.
 
-            Parses raw metadata from the simulator, processes it into the
-            proper reference frame, and publishes it as odometry, imu and
-            transform information to ROS.
+            Parses raw metadata from the simulator and publishes it with
+            `publish_metadata_sample`, in sim time order as re-sequenced by
+            `reorder_buffer`. In step mode, the sample is buffered by
+            `lockstep_driver` until its step is published instead.
+
+            Args:
+                data: A string or bytestring containing the metadata from the
+                    simulator, either in xml format or as a packed binary
+                    record (see `tesse_ros_bridge.utils.decode_metadata`).
+        """
+        t = self.timings.now()
+        if self.capture is not None:
+            self.capture.write_metadata(data)
+            t = self.timings.lap('udp_cb/capture', t)
+
+        metadata = tesse_ros_bridge.utils.decode_metadata(data)
+        self.timings.lap('udp_cb/decode', t)
+        if self.lockstep_driver is not None:
+            self.lockstep_driver.add_sample(metadata['time'], metadata)
+        else:
+            for sample in self.reorder_buffer.add(metadata['time'], metadata):
+                self.publish_metadata_sample(sample)
+
+    def release_metadata(self):
+        """ Publish the samples held by `reorder_buffer` past their latency.
+
+            Called by `udp_receiver` while no metadata arrives, on the same
+            thread as `udp_cb`.
+        """
+        for sample in self.reorder_buffer.poll():
+            self.publish_metadata_sample(sample)
+
+    def publish_metadata_sample(self, metadata):
+        """ Publish one sample of the metadata stream.
+
+            Processes the metadata into the proper reference frame, and
+            publishes it as odometry, imu and transform information to ROS.
+            Samples not newer than the last one are skipped, and after a
+            gap of more than `max_metadata_gap` the finite-difference state
+            is seeded from the sample itself.
 
             Args:
-                data: A string or bytestring in xml format containing the
-                    metadata from the simulator.
+                metadata: A dictionary of parsed metadata, as returned by
+                    `tesse_ros_bridge.utils.decode_metadata`.
         """
-        # Parse metadata and process for proper use.
-        metadata = tesse_ros_bridge.utils.parse_metadata(data)
-        metadata_processed = tesse_ros_bridge.utils.process_metadata(metadata,
-            self.prev_time, self.prev_vel_brh, self.prev_enu_R_brh)
+        t = self.timings.now()
+
+        dt = metadata['time'] - self.metadata_processor.prev_time
+        if dt <= 0.0:
+            self.metadata_counts['out_of_order'] += 1
+            return
+        if dt > self.max_metadata_gap:
+            self.metadata_processor.seed(metadata, 1.0 / self.imu_rate)
+            self.metadata_counts['resets'] += 1
 
-        assert(self.prev_time < metadata_processed['time'])
-        self.prev_time      = metadata_processed['time']
-        self.prev_vel_brh   = metadata_processed['velocity']
-        self.prev_enu_R_brh = metadata_processed['transform'][:3,:3]
+        self.sim_clock.update(metadata['time'])
+        metadata_processed = self.metadata_processor.process(metadata)
+        t = self.timings.lap('udp_cb/process', t)
 
         timestamp = rospy.Time.from_sec(
             metadata_processed['time'] / self.speedup_factor)
@@ -217,98 +511,604 @@ class TesseROSWrapper:
         imu = tesse_ros_bridge.utils.metadata_to_imu(metadata_processed,
             timestamp, self.body_frame_id)
         self.imu_pub.publish(imu)
+        self.imu_monitor.add(metadata['time'], time.time())
+        if self.recorder is not None:
+            # As published: gravity is subtracted from the acceleration.
+            self.recorder.record("imu", {
+                'stamp': timestamp.to_sec(),
+                'linear_acceleration': [imu.linear_acceleration.x,
+                                        imu.linear_acceleration.y,
+                                        imu.linear_acceleration.z],
+                'angular_velocity': [imu.angular_velocity.x,
+                                     imu.angular_velocity.y,
+                                     imu.angular_velocity.z]})
+        t = self.timings.lap('udp_cb/imu', t)
         odom = tesse_ros_bridge.utils.metadata_to_odom(metadata_processed,
             timestamp, self.world_frame_id, self.body_frame_id)
         self.odom_pub.publish(odom)
+        t = self.timings.lap('udp_cb/odom', t)
+
+        self.pose_history.add(timestamp.to_sec(),
+                              metadata_processed['position'],
+                              metadata_processed['quaternion'],
+                              metadata_processed['velocity'])
+        t = self.timings.lap('udp_cb/pose_history', t)
 
         # Publish agent ground truth transform.
         self.publish_tf(metadata_processed['transform'], timestamp)
+        t = self.timings.lap('udp_cb/tf', t)
+
+        if self.recorder is not None:
+            self.recorder.record("metadata", {
+                'stamp':            timestamp.to_sec(),
+                'position':         metadata_processed['position'],
+                'quaternion':       metadata_processed['quaternion'],
+                'velocity':         metadata_processed['velocity'],
+                'angular_velocity': metadata_processed['ang_vel'],
+                'acceleration':     metadata_processed['acceleration'],
+                'collision_status': bool(metadata_processed['collision_status'])})
+            self.timings.lap('udp_cb/record', t)
 
     def image_cb(self, event):
         """ Publish images from simulator to ROS.
 
-            Left and right images are published in the mono8 encoding.
-            Depth images are pre-processed s.t. pixel values directly give
-            point depth, in meters.
-            Segmentation images are published in the rgb8 encoding.
+            Requests and publishes one frame serially. Used on a rospy.Timer
+            when `pipelined_images` is false; otherwise `image_pipeline`
+            calls `request_images` and `publish_images` on separate threads.
 
             Args:
                 event: A rospy.Timer event object, which is not used in this
                     method. You may supply `None`.
         """
         try:
-            # Get camera data.
-            data_response = self.env.request(DataRequest(True, self.cameras))
+            frame = self.request_images()
+            if frame is not None:
+                self.publish_images(frame)
+        except Exception as error:
+                print "TESSE_ROS_NODE: image_cb error: ", error
 
-            # Process metadata to publish transform.
-            metadata = tesse_ros_bridge.utils.parse_metadata(
-                data_response.metadata)
+    def request_images(self):
+        """ Request images and metadata for the cameras due at this frame.
 
-            timestamp = rospy.Time.from_sec(
-                metadata['time'] / self.speedup_factor)
+            In step mode, every camera is requested. Otherwise, advances
+            `camera_scheduler` by one frame, and if `lazy_cameras`, due
+            cameras without subscribers are not requested, unless recording;
+            subscriptions are checked on every frame.
 
-            if timestamp == self.last_image_timestamp:
-                rospy.loginfo("Skipping duplicate images at timestamp %s" % self.last_image_timestamp)
-                return
+            Returns:
+                A tuple of the indices in `cameras` of the requested cameras
+                and the DataResponse from the simulator, or None if no camera
+                is due.
+        """
+        if self.lockstep_driver is not None:
+            camera_indices = list(range(len(self.cameras)))
+        else:
+            camera_indices = self.camera_scheduler.tick()
+            if self.lazy_cameras and self.recorder is None:
+                camera_indices = [i for i in camera_indices
+                                  if self.camera_subscribed(i)]
+        if not camera_indices:
+            return None
+
+        cameras = [self.cameras[i] for i in camera_indices]
+        t = self.timings.now()
+        data_response = self.env.request(DataRequest(True, cameras))
+        t = self.timings.lap('image_cb/request', t)
+        if self.capture is not None:
+            self.capture.write_frame(camera_indices, data_response)
+            self.timings.lap('image_cb/capture', t)
+        return camera_indices, data_response
+
+    def frame_time(self, frame):
+        """ Get the sim time of a frame returned by `request_images`. """
+        return tesse_ros_bridge.utils.parse_metadata(frame[1].metadata)['time']
+
+    def camera_subscribed(self, i):
+        """ Check whether any node subscribes to the images of a camera.
 
-            # self.clock_pub.publish(timestamp)
+            Args:
+                i: An integer, the index of the camera in `cameras`.
+
+            Returns:
+                True if the raw or compressed image topic of the camera has
+                subscribers.
+        """
+        if self.img_pubs[i].get_num_connections() > 0:
+            return True
+        return self.compressed_pubs[i] is not None and \
+            self.compressed_pubs[i].get_num_connections() > 0
 
-            # Process each image.
-            for i in range(len(self.cameras)):
-                if self.cameras[i][0] == Camera.DEPTH:
-                    img_msg = self.cv_bridge.cv2_to_imgmsg(
-                        data_response.images[i] * self.far_draw_dist,
-                            'passthrough')
-                elif self.cameras[i][2] == Channels.SINGLE:
-                    img_msg = self.cv_bridge.cv2_to_imgmsg(
-                        data_response.images[i], 'mono8')
-                elif self.cameras[i][2] == Channels.THREE:
-                    img_msg = self.cv_bridge.cv2_to_imgmsg(
-                        data_response.images[i], 'rgb8') # [:,:,::-1]
+    def publish_images(self, frame):
+        """ Publish images from a simulator response to ROS.
 
-                # Sanity check resolutions.
-                assert(img_msg.width == self.cam_info_msgs[i].width)
-                assert(img_msg.height == self.cam_info_msgs[i].height)
+            Left and right images are published in the mono8 encoding.
+            Depth images are pre-processed s.t. pixel values directly give
+            point depth, in meters (32FC1) or millimeters (16UC1) depending
+            on `depth_encoding`.
+            Segmentation images are published in the rgb8 encoding.
+            Compressed images are handed to `image_workers`, and this method
+            returns once all of them are published.
 
-                # Publish images to appropriate topic.
-                img_msg.header.frame_id = self.cameras[i][3]
-                img_msg.header.stamp = timestamp
-                self.img_pubs[i].publish(img_msg)
+            Args:
+                frame: A tuple of camera indices and DataResponse, as
+                    returned by `request_images`.
 
-                # Publish associated CameraInfo message.
-                self.cam_info_msgs[i].header.stamp = timestamp
-                self.cam_info_pubs[i].publish(self.cam_info_msgs[i])
+            Returns:
+                False if the images were skipped as a duplicate of the last
+                published timestamp, True otherwise.
+        """
+        camera_indices, data_response = frame
 
-            self.publish_tf(
-                tesse_ros_bridge.utils.get_enu_T_brh(metadata),
-                    timestamp)
+        # Process metadata to publish transform.
+        start = self.timings.now()
+        metadata = tesse_ros_bridge.utils.parse_metadata(
+            data_response.metadata)
+        self.timings.lap('image_cb/parse_metadata', start)
 
-            if self.publish_metadata:
-                self.metadata_pub.publish(data_response.metadata)
+        timestamp = rospy.Time.from_sec(
+            metadata['time'] / self.speedup_factor)
 
-            self.last_image_timestamp = timestamp
+        if timestamp == self.last_image_timestamp:
+            rospy.loginfo("Skipping duplicate images at timestamp %s" % self.last_image_timestamp)
+            # Low-rate cameras due on this frame would otherwise wait a
+            # full period for their next one.
+            self.camera_scheduler.requeue(camera_indices)
+            return False
 
-        except Exception as error:
-                print "TESSE_ROS_NODE: image_cb error: ", error
+        # self.clock_pub.publish(timestamp)
+
+        # Process each image.
+        pending = []
+        for image, i in zip(data_response.images, camera_indices):
+            if self.cameras[i][1] == Compression.ON:
+                pending.append(self.image_workers.apply_async(
+                    self.publish_compressed_image, (i, image, timestamp)))
+            else:
+                self.publish_raw_image(i, image, timestamp)
+
+            # Publish associated CameraInfo message.
+            t = self.timings.now()
+            self.cam_info_msgs[i].header.stamp = timestamp
+            self.cam_info_pubs[i].publish(self.cam_info_msgs[i])
+            self.timings.lap('image_cb/camera_info', t)
+
+        # Raises any error from the workers.
+        t = self.timings.now()
+        for result in pending:
+            result.get()
+        if pending:
+            self.timings.lap('image_cb/compressed_wait', t)
+
+        # The transform at `timestamp` comes from the metadata stream, see
+        # `publish_metadata_sample`.
+
+        if self.publish_metadata:
+            self.metadata_pub.publish(data_response.metadata)
+
+        self.last_image_timestamp = timestamp
+
+        self.timings.lap('image_cb/total', start)
+        return True
+
+    def publish_raw_image(self, i, image, timestamp):
+        """ Publish an image on the raw topic of a camera, and record it.
+
+            Args:
+                i: An integer, the index of the camera in `cameras`.
+                image: A numpy array, the decoded image from the simulator.
+                timestamp: A rospy.Time instance for the image header.
+        """
+        # Messages reference the simulator's image buffers directly.
+        t = self.timings.now()
+        if self.cameras[i][0] == Camera.DEPTH:
+            image = self.depth_converter.convert(image)
+            t = self.timings.lap('image_cb/depth', t)
+            img_msg = tesse_ros_bridge.utils.make_image_msg(
+                image, self.depth_encoding)
+        elif self.cameras[i][2] == Channels.SINGLE:
+            img_msg = tesse_ros_bridge.utils.make_image_msg(
+                image, 'mono8')
+        elif self.cameras[i][2] == Channels.THREE:
+            img_msg = tesse_ros_bridge.utils.make_image_msg(
+                image, 'rgb8') # [:,:,::-1]
+        t = self.timings.lap('image_cb/make_msg', t)
+
+        # Sanity check resolutions.
+        assert(img_msg.width == self.cam_info_msgs[i].width)
+        assert(img_msg.height == self.cam_info_msgs[i].height)
+
+        # Publish images to appropriate topic.
+        img_msg.header.frame_id = self.cameras[i][3]
+        img_msg.header.stamp = timestamp
+        self.img_pubs[i].publish(img_msg)
+        t = self.timings.lap('image_cb/publish', t)
+
+        # Simulator images are not reused, but converted depth images are.
+        if self.recorder is not None:
+            self.recorder.record(self.camera_names[i],
+                {'stamp': timestamp.to_sec(), 'image': image},
+                copy=self.cameras[i][0] == Camera.DEPTH)
+            self.timings.lap('image_cb/record', t)
+
+    def publish_compressed_image(self, i, image, timestamp):
+        """ Publish an image of a compressed camera. Runs on `image_workers`.
+
+            tesse-interface decodes the simulator's payload into an array,
+            which is re-encoded in `compressed_format` for the compressed
+            topic, only while that topic has subscribers. The raw topic gets
+            the array while it has subscribers or when recording. A payload
+            that is still encoded is published on the compressed topic as is,
+            and decoded for the raw topic under the same conditions.
+
+            Args:
+                i: An integer, the index of the camera in `cameras`.
+                image: A bytestring holding the encoded image, or a numpy
+                    array holding the decoded image.
+                timestamp: A rospy.Time instance for the image headers.
+        """
+        encoded = not isinstance(image, np.ndarray)
+
+        t = self.timings.now()
+        if self.compressed_pubs[i].get_num_connections() > 0:
+            if encoded:
+                img_msg = tesse_ros_bridge.utils.make_compressed_image_msg(
+                    image)
+            else:
+                img_msg = tesse_ros_bridge.utils.make_compressed_image_msg(
+                    tesse_ros_bridge.utils.encode_compressed_image(
+                        image, self.compressed_format),
+                    self.compressed_format)
+            img_msg.header.frame_id = self.cameras[i][3]
+            img_msg.header.stamp = timestamp
+            self.compressed_pubs[i].publish(img_msg)
+            t = self.timings.lap('image_cb/compressed_publish', t)
+
+        if self.img_pubs[i].get_num_connections() > 0 or \
+                self.recorder is not None:
+            if encoded:
+                channels = 1 if self.cameras[i][2] == Channels.SINGLE else 3
+                image = tesse_ros_bridge.utils.decode_compressed_image(
+                    image, channels)
+                self.timings.lap('image_cb/decode', t)
+            self.publish_raw_image(i, image, timestamp)
+
+    def shutdown(self):
+        """ Stop the threads producing data before those consuming it.
+
+            The UDP receiver and the image pipeline stop first, so the
+            recorder and the capture see no more records once they stop.
+        """
+        if self.udp_receiver is not None:
+            self.stop_udp_receiver()
+        if self.image_pipeline is not None:
+            self.image_pipeline.stop()
+            self.log_image_pipeline_stats()
+        if self.recorder is not None:
+            self.stop_recorder()
+        if self.capture is not None:
+            self.close_capture()
+
+    def close_capture(self):
+        """ Finish writing the capture and log what was written. """
+        self.capture.close()
+        stats = self.capture.stats()
+        rospy.loginfo("TESSE_ROS_NODE: captured %d records (%.1f MB) to %s, "
+            "%d write errors, %d dropped after closing" % (
+            stats['records'], stats['bytes'] / 1e6, self.capture_file,
+            stats['write_errors'], stats['dropped']))
+
+    def stop_recorder(self):
+        """ Finish writing the recording and log what was written. """
+        self.recorder.stop()
+        stats = self.recorder.stats()
+        rospy.loginfo("TESSE_ROS_NODE: recorded %d records (%.1f MB) in %d "
+            "chunks to %s, %d write errors, %d dropped after stopping" % (
+            stats['records'], stats['bytes'] / 1e6, stats['chunks'],
+            self.record_dir, stats['write_errors'], stats['dropped']))
+
+    def step_simulator(self):
+        """ Advance the simulator by one frame in step mode. """
+        self.env.send(StepWithForce(0, 0, 0))
+
+    def publish_clocked_sample(self, metadata):
+        """ Publish /clock and one metadata sample in step and replay modes.
+
+            The lockstep driver and replays publish samples in order and
+            interleaved with images, so /clock never lags behind published
+            data. Replayed samples have been re-sequenced by
+            `reorder_buffer` like live ones.
+
+            Args:
+                metadata: A dictionary of parsed metadata.
+        """
+        self.clock_pub.publish(rospy.Time.from_sec(
+            metadata['time'] / self.speedup_factor))
+        self.publish_metadata_sample(metadata)
+
+    def lockstep_loop(self):
+        """ Advances the simulator in lockstep until shutdown.
+
+            The achieved realtime factor is logged every `clock_stats_period`
+            seconds and on shutdown.
+        """
+        next_stats = time.time() + self.clock_stats_period
+        while not rospy.is_shutdown():
+            try:
+                self.lockstep_driver.advance()
+            except Exception as error:
+                print "TESSE_ROS_NODE: lockstep error: ", error
+
+            if self.clock_stats_period > 0 and time.time() >= next_stats:
+                self.log_lockstep_stats()
+                next_stats += self.clock_stats_period
+
+        self.log_lockstep_stats()
+
+    def replay(self):
+        """ Replays `replay_capture` until it ends or shutdown.
+
+            Captured metadata packets go through `reorder_buffer` and
+            `publish_clocked_sample`, and captured frames through
+            `publish_images`, timed as captured and scaled by `replay_speed`.
+            Logs throughput and timing per stage.
+        """
+        replayer = Replayer({CAPTURE_METADATA: self.replay_metadata,
+                             CAPTURE_FRAME:    self.publish_images},
+                            speed=self.replay_speed)
+        stats = replayer.run(read_capture(self.replay_capture),
+                             rospy.is_shutdown)
+        for sample in self.reorder_buffer.flush():
+            self.publish_clocked_sample(sample)
+
+        rospy.loginfo("TESSE_ROS_NODE: replayed %.3f s of capture in %.3f s,"
+            " at most %.3f s late" % (stats['capture_time'],
+            stats['wall_time'], stats['max_lag']))
+        for kind, name in [(CAPTURE_METADATA, "metadata"),
+                           (CAPTURE_FRAME, "images")]:
+            stage = stats['stages'][kind]
+            rospy.loginfo("TESSE_ROS_NODE: replay %s: %d records (%d errors)"
+                ", %.1f/s, %.1f%% busy, mean %.3f ms, p50 %.3f ms, p99 %.3f "
+                "ms, max %.3f ms" % (name, stage['count'], stage['errors'],
+                stage['rate'], 100.0 * stage['busy'], 1e3 * stage['mean'],
+                1e3 * stage['p50'], 1e3 * stage['p99'], 1e3 * stage['max']))
+
+    def replay_metadata(self, data):
+        """ Publish a captured metadata packet, re-sequenced like the live
+            packets of `udp_cb`.
+
+            Args:
+                data: A bytestring, the packet as captured by `udp_cb`.
+        """
+        metadata = tesse_ros_bridge.utils.decode_metadata(data)
+        for sample in self.reorder_buffer.add(metadata['time'], metadata):
+            self.publish_clocked_sample(sample)
+
+    def log_lockstep_stats(self):
+        """ Log the progress of the lockstep driver. """
+        stats = self.lockstep_driver.stats()
+        rospy.loginfo("TESSE_ROS_NODE: step mode: %d steps (%d timed out), "
+            "%d samples (%d missing, %d late), %d frames, %.3f s sim time in "
+            "%.3f s, realtime factor %.2f" % (stats['steps'],
+            stats['timeouts'], stats['samples'], stats['missing_samples'],
+            stats['late_samples'], stats['frames'], stats['sim_time'],
+            stats['wall_time'], stats['realtime_factor']))
+
+    def stop_udp_receiver(self):
+        """ Stop receiving metadata and log the receiver's statistics. """
+        self.udp_receiver.stop()
+        stats = self.udp_receiver.stats()
+        rospy.loginfo("TESSE_ROS_NODE: udp receiver: %d received in %d "
+            "batches (max %d), %d delivered, %d discarded, %s kernel drops, "
+            "%d callback errors" % (stats['received'], stats['batches'],
+            stats['max_batch'], stats['delivered'], stats['discarded'],
+            stats['kernel_drops'], stats['callback_errors']))
+
+    def log_image_pipeline_stats(self):
+        """ Log the frame accounting of the image pipeline. """
+        stats = self.image_pipeline.stats()
+        rospy.loginfo("TESSE_ROS_NODE: image pipeline: %d fetched, %d "
+            "published, %d duplicates skipped, %d dropped, %d fetch errors, "
+            "%d publish errors" % (stats['fetched'], stats['published'],
+            stats['skipped'], stats['dropped'], stats['fetch_errors'],
+            stats['publish_errors']))
+
+    def stream_clock_loop(self):
+        """ Publishes simulated clock time derived from the metadata stream.
+
+            Publishes the time of `sim_clock`, which `udp_cb` anchors to every
+            metadata sample and which is extrapolated in between, at
+            `clock_publish_rate`. Clock-error statistics are logged every
+            `clock_stats_period` seconds. Runs on wall time, since ROS timers
+            would themselves wait for /clock.
+        """
+        period = 1.0 / self.clock_publish_rate
+        next_stats = time.time() + self.clock_stats_period
+        last_sim_time = None
+
+        while not rospy.is_shutdown():
+            sim_time = self.sim_clock.now()
+            if sim_time is not None and sim_time != last_sim_time:
+                t = self.timings.now()
+                self.clock_pub.publish(rospy.Time.from_sec(sim_time))
+                self.timings.lap('clock_cb/publish', t)
+                last_sim_time = sim_time
+
+            if self.clock_stats_period > 0 and time.time() >= next_stats:
+                stats = self.sim_clock.stats()
+                rospy.loginfo("TESSE_ROS_NODE: clock error over %d samples: "
+                    "mean %.6f s, rms %.6f s, max %.6f s, rate %.6f" %
+                    (stats['samples'], stats['mean'], stats['rms'],
+                     stats['max_abs'], stats['rate']))
+                next_stats += self.clock_stats_period
+
+            time.sleep(period)
+
+    def tf_loop(self):
+        """ Publishes the batched transforms every `tf_batch_period` seconds.
+
+            Runs on its own thread, on wall time like `diagnostics_loop`.
+        """
+        while not rospy.is_shutdown():
+            time.sleep(self.tf_batch_period)
+            self.flush_tf()
+
+    def diagnostics_loop(self):
+        """ Publishes stage timings every `diagnostics_period` seconds.
+
+            Runs on its own thread, on wall time like `stream_clock_loop`.
+        """
+        while not rospy.is_shutdown():
+            time.sleep(self.diagnostics_period)
+            try:
+                self.publish_diagnostics()
+            except Exception as error:
+                print "TESSE_ROS_NODE: diagnostics error: ", error
+
+    def publish_diagnostics(self):
+        """ Publish the timings of every stage on /diagnostics.
+
+            Each stage gets a DiagnosticStatus named after it, with its
+            count and its mean, p50, p95, p99 and max durations in
+            milliseconds.
+        """
+        diagnostics = DiagnosticArray()
+        diagnostics.header.stamp = rospy.Time.now()
+        for stage, stats in sorted(self.timings.snapshot().items()):
+            status = DiagnosticStatus()
+            status.level = DiagnosticStatus.OK
+            status.name = "tesse_ros_bridge: " + stage
+            status.hardware_id = rospy.get_name()
+            status.message = "p99 %.3f ms" % (1e3 * stats['p99'])
+            status.values = [KeyValue("count", str(stats['count']))] + \
+                [KeyValue(key + " (ms)", "%.3f" % (1e3 * stats[key]))
+                 for key in ['mean', 'p50', 'p95', 'p99', 'max']]
+            diagnostics.status.append(status)
+        diagnostics.status.append(self.imu_diagnostics())
+        diagnostics.status.append(self.metadata_diagnostics())
+        diagnostics.status.append(self.tf_diagnostics())
+        if not self.replay_capture:
+            diagnostics.status.append(self.udp_diagnostics())
+        self.diagnostics_pub.publish(diagnostics)
+
+    def metadata_diagnostics(self):
+        """ Summarize the ordering of the metadata stream, see
+            `reorder_buffer`.
+
+            Returns:
+                A DiagnosticStatus.
+        """
+        stats = self.reorder_buffer.stats()
+        stats.update(self.metadata_counts)
+        status = DiagnosticStatus()
+        status.name = "tesse_ros_bridge: metadata order"
+        status.hardware_id = rospy.get_name()
+        status.level = DiagnosticStatus.OK
+        status.message = "%d reordered, %d dropped, %d gaps" % (
+            stats['reordered'], stats['duplicates'] + stats['stale'],
+            stats['gaps'])
+        status.values = [KeyValue(key, str(value))
+                         for key, value in sorted(stats.items())]
+        return status
+
+    def tf_diagnostics(self):
+        """ Summarize the transforms published on /tf, see `tf_batcher`.
+
+            Returns:
+                A DiagnosticStatus.
+        """
+        stats = self.tf_batcher.stats()
+        status = DiagnosticStatus()
+        status.name = "tesse_ros_bridge: tf"
+        status.hardware_id = rospy.get_name()
+        status.level = DiagnosticStatus.OK
+        status.message = "%d transforms in %d messages" % (
+            stats['published'], stats['batches'])
+        status.values = [KeyValue(key, str(value))
+                         for key, value in sorted(stats.items())]
+        return status
+
+    def udp_diagnostics(self):
+        """ Summarize the metadata receiver, see `udp_receiver`.
+
+            Returns:
+                A DiagnosticStatus, with level WARN if the kernel dropped
+                packets since the last call.
+        """
+        stats = self.udp_receiver.stats()
+        status = DiagnosticStatus()
+        status.name = "tesse_ros_bridge: udp receiver"
+        status.hardware_id = rospy.get_name()
+        status.level = DiagnosticStatus.OK
+        status.message = "%d packets, %s kernel drops" % (stats['received'],
+                                                          stats['kernel_drops'])
+        kernel_drops = stats['kernel_drops'] or 0
+        if kernel_drops > self.last_kernel_drops:
+            status.level = DiagnosticStatus.WARN
+            status.message = "%d packets dropped by the kernel, raise " \
+                "udp_rcvbuf" % (kernel_drops - self.last_kernel_drops)
+        self.last_kernel_drops = kernel_drops
+        status.values = [KeyValue(key, str(value))
+                         for key, value in sorted(stats.items())]
+        return status
+
+    def imu_diagnostics(self):
+        """ Summarize the timing of the IMU stream, see `imu_monitor`.
+
+            Duplicate and out-of-order samples never reach the monitor;
+            they are counted as dropped by `reorder_buffer` and
+            `publish_metadata_sample`.
+
+            Returns:
+                A DiagnosticStatus, with level WARN if the IMU jitter exceeds
+                `imu_jitter_threshold`, which is also logged.
+        """
+        stats = self.imu_monitor.stats()
+        reorder_stats = self.reorder_buffer.stats()
+        stats['duplicates'] = reorder_stats['duplicates']
+        stats['out_of_order'] = reorder_stats['stale'] + \
+            self.metadata_counts['out_of_order']
+        status = DiagnosticStatus()
+        status.name = "tesse_ros_bridge: imu timing"
+        status.hardware_id = rospy.get_name()
+        status.message = "jitter %.3f ms, %.1f Hz" % (1e3 * stats['jitter'],
+                                                      stats['rate'])
+        status.level = DiagnosticStatus.OK
+        if stats['jitter_exceeded']:
+            status.level = DiagnosticStatus.WARN
+            status.message = "IMU jitter %.3f ms over threshold" % \
+                (1e3 * stats['jitter'])
+            rospy.logwarn("TESSE_ROS_NODE: %s" % status.message)
+
+        status.values = [KeyValue(key, str(stats[key])) for key in
+            ['samples', 'gaps', 'missing', 'duplicates', 'out_of_order']]
+        status.values.append(KeyValue("rate (Hz)", "%.2f" % stats['rate']))
+        for group in ['sim_period', 'wall_period', 'delay']:
+            for key, value in sorted(stats[group].items()):
+                status.values.append(KeyValue("%s %s (ms)" % (group, key),
+                                              "%.3f" % (1e3 * value)))
+        return status
 
     def clock_cb(self, event):
         """ Publishes simulated clock time.
 
             Gets current metadata from the simulator over the low-rate metadata
             port. Publishes the timestamp, optionally modified by the
-            specified speedup_factor.
+            specified speedup_factor. Only used when `clock_mode` is "poll".
 
             Args:
                 event: A rospy.Timer event object, which is not used in this
                     method. You may supply `None`.
         """
         try:
+            t = self.timings.now()
             metadata = tesse_ros_bridge.utils.parse_metadata(self.env.request(
                 MetadataRequest()).metadata)
+            t = self.timings.lap('clock_cb/request', t)
 
             sim_time = rospy.Time.from_sec(
                 metadata['time'] / self.speedup_factor)
             self.clock_pub.publish(sim_time)
+            self.timings.lap('clock_cb/publish', t)
         except Exception as error:
             print "TESSE_ROS_NODE: clock_cb error: ", error
 
@@ -316,11 +1116,159 @@ class TesseROSWrapper:
         """ Initializes image-related members.
 
             Sends camera parameter, position and rotation data to the simulator
-            to properly reset them as specified in the node arguments.
+            to properly reset them as specified in the node arguments, unless
+            replaying a capture.
             Calculates and sends static transforms for the left and
             right cameras relative to the body frame.
-            Also constructs the CameraInfo messages for left and right cameras,
-            to be published with every frame.
+            Also constructs the CameraInfo messages of every camera, to be
+            published with every frame.
+        """
+        # TODO(marcus): add SetCameraOrientationRequest option.
+        # TODO(Toni): this is hardcoded!! what if don't want IMU in the middle?
+        # Also how is this set using x? what if it is y, z?
+        left_cam_position  = Point(x = -self.stereo_baseline / 2,
+                                   y = 0.0,
+                                   z = 0.0)
+        right_cam_position = Point(x = self.stereo_baseline / 2,
+                                   y = 0.0,
+                                   z = 0.0)
+        cameras_orientation = Quaternion(x=0.0,
+                                         y=0.0,
+                                         z=0.0,
+                                         w=1.0)
+
+        # Depth and segmentation cameras are placed with the left camera.
+        cam_positions = dict((camera[0], left_cam_position)
+                             for camera in self.cameras)
+        cam_positions[Camera.RGB_RIGHT] = right_cam_position
+        cam_data = self.acquire_camera_data(cam_positions, cameras_orientation)
+
+        # Left cam static tf.
+        static_tf_cam_left                       = TransformStamped()
+        static_tf_cam_left.header.frame_id       = self.body_frame_id
+        static_tf_cam_left.header.stamp          = rospy.Time.now()
+        static_tf_cam_left.transform.translation = left_cam_position
+        static_tf_cam_left.transform.rotation    = cameras_orientation
+        static_tf_cam_left.child_frame_id        = self.left_cam_frame_id
+
+        # Right cam static tf.
+        static_tf_cam_right                       = TransformStamped()
+        static_tf_cam_right.header.frame_id       = self.body_frame_id
+        static_tf_cam_right.header.stamp          = rospy.Time.now()
+        static_tf_cam_right.transform.translation = right_cam_position
+        static_tf_cam_right.transform.rotation    = cameras_orientation
+        static_tf_cam_right.child_frame_id        = self.right_cam_frame_id
+
+        # Send static tfs over the ROS network
+        self.static_tf_broadcaster.sendTransform([static_tf_cam_right, static_tf_cam_left])
+
+        # Camera_info publishing for VIO.
+        for camera_id, data in cam_data.items():
+            assert(data['parameters']['height'] == self.camera_height)
+            assert(data['parameters']['width']  == self.camera_width)
+
+        cam_info_msg_left, cam_info_msg_right = \
+            tesse_ros_bridge.utils.generate_camera_info(
+                cam_data[Camera.RGB_LEFT], cam_data[Camera.RGB_RIGHT])
+        cam_info_msgs = {Camera.RGB_LEFT:  cam_info_msg_left,
+                         Camera.RGB_RIGHT: cam_info_msg_right}
+        # Other cameras from their own data, in the frame of their images.
+        for camera in self.cameras:
+            if camera[0] not in cam_info_msgs:
+                cam_info_msgs[camera[0]] = \
+                    tesse_ros_bridge.utils.generate_mono_camera_info(
+                        cam_data[camera[0]], camera[3])
+        self.cam_info_msgs = [cam_info_msgs[camera[0]] for camera in self.cameras]
+
+    def acquire_camera_data(self, cam_positions, cameras_orientation):
+        """ Gets the parsed camera information of every camera.
+
+            Replays read it from their capture. Otherwise, if the responses
+            for the current camera parameters are all in `camera_info_cache`,
+            one request for the left camera verifies that the simulator still
+            has them set, and the cached responses are used. If not, the
+            parameters are sent and every camera is queried, updating the
+            cache.
+
+            Args:
+                cam_positions: A dictionary of the Point position of each
+                    camera in the body frame, by Camera.
+                cameras_orientation: A Quaternion, orientation of all
+                    cameras in the body frame.
+
+            Returns:
+                A dictionary of the data of each camera, as returned by
+                `tesse_ros_bridge.utils.parse_cam_data`, by Camera.
+        """
+        camera_ids = [camera[0] for camera in self.cameras]
+        if self.replay_capture:
+            # Captures may only hold the stereo cameras; others were placed
+            # and configured like the left one.
+            captured = read_camera_info(self.replay_capture)
+            return dict((camera_id, tesse_ros_bridge.utils.parse_cam_data(
+                captured.get(camera_id, captured[Camera.RGB_LEFT])))
+                for camera_id in camera_ids)
+
+        orientation = [cameras_orientation.x, cameras_orientation.y,
+                       cameras_orientation.z, cameras_orientation.w]
+        keys = dict((camera_id, camera_info_key(camera_id.value,
+            self.camera_width, self.camera_height, self.camera_fov,
+            self.near_draw_dist, self.far_draw_dist,
+            [cam_positions[camera_id].x, cam_positions[camera_id].y,
+             cam_positions[camera_id].z], orientation))
+            for camera_id in camera_ids)
+        cached = dict((camera_id, self.camera_info_cache.get(keys[camera_id]))
+                      for camera_id in camera_ids)
+
+        if None not in cached.values():
+            print("TESSE_ROS_NODE: Verifying cached camera data...")
+            left = self.request_camera_information(Camera.RGB_LEFT)
+            if left is not None and \
+                    tesse_ros_bridge.utils.parse_cam_data(left) == \
+                    tesse_ros_bridge.utils.parse_cam_data(
+                        cached[Camera.RGB_LEFT]):
+                if self.capture is not None:
+                    for camera_id in camera_ids:
+                        if camera_id != Camera.RGB_LEFT:
+                            self.capture.write_camera_info(camera_id,
+                                                           cached[camera_id])
+                return dict((camera_id, tesse_ros_bridge.utils.parse_cam_data(
+                    cached[camera_id])) for camera_id in camera_ids)
+            print("TESSE_ROS_NODE: Cached camera data is stale.")
+
+        self.send_camera_parameters(cam_positions[Camera.RGB_LEFT],
+                                    cam_positions[Camera.RGB_RIGHT],
+                                    cameras_orientation)
+        cam_data = {}
+        for camera_id in camera_ids:
+            metadata = None
+            while metadata is None:
+                print("TESSE_ROS_NODE: Acquiring camera data: ", camera_id)
+                metadata = self.request_camera_information(camera_id)
+            cam_data[camera_id] = tesse_ros_bridge.utils.parse_cam_data(
+                metadata)
+            assert(cam_data[camera_id]['id'] == camera_id.value)
+            self.camera_info_cache.put(keys[camera_id], metadata)
+
+        try:
+            self.camera_info_cache.save()
+        except (IOError, OSError) as error:
+            rospy.logwarn("TESSE_ROS_NODE: could not save camera info cache: "
+                          "%s" % error)
+        return cam_data
+
+    def send_camera_parameters(self, left_cam_position, right_cam_position,
+                               cameras_orientation):
+        """ Sends camera intrinsics and extrinsics to the simulator.
+
+            Args:
+                left_cam_position: A Point, position of the left camera in
+                    the body frame. Depth and segmentation cameras are
+                    placed there too.
+                right_cam_position: A Point, position of the right camera
+                    in the body frame.
+                cameras_orientation: A Quaternion, orientation of all
+                    cameras in the body frame.
         """
         # Set camera parameters once for the entire simulation.
         # Set all cameras to have same intrinsics:
@@ -340,20 +1288,6 @@ class TesseROSWrapper:
                         self.far_draw_dist
                         ))
 
-        # TODO(marcus): add SetCameraOrientationRequest option.
-        # TODO(Toni): this is hardcoded!! what if don't want IMU in the middle?
-        # Also how is this set using x? what if it is y, z?
-        left_cam_position  = Point(x = -self.stereo_baseline / 2,
-                                   y = 0.0,
-                                   z = 0.0)
-        right_cam_position = Point(x = self.stereo_baseline / 2,
-                                   y = 0.0,
-                                   z = 0.0)
-        cameras_orientation = Quaternion(x=0.0,
-                                         y=0.0,
-                                         z=0.0,
-                                         w=1.0)
-
         resp = None
         while resp is None:
             print "TESSE_ROS_NODE: Setting position of left camera..."
@@ -408,66 +1342,26 @@ class TesseROSWrapper:
                             cameras_orientation.w,
                             ))
 
-        # Left cam static tf.
-        static_tf_cam_left                       = TransformStamped()
-        static_tf_cam_left.header.frame_id       = self.body_frame_id
-        static_tf_cam_left.header.stamp          = rospy.Time.now()
-        static_tf_cam_left.transform.translation = left_cam_position
-        static_tf_cam_left.transform.rotation    = cameras_orientation
-        static_tf_cam_left.child_frame_id        = self.left_cam_frame_id
 
-        # Right cam static tf.
-        static_tf_cam_right                       = TransformStamped()
-        static_tf_cam_right.header.frame_id       = self.body_frame_id
-        static_tf_cam_right.header.stamp          = rospy.Time.now()
-        static_tf_cam_right.transform.translation = right_cam_position
-        static_tf_cam_right.transform.rotation    = cameras_orientation
-        static_tf_cam_right.child_frame_id        = self.right_cam_frame_id
+    def request_camera_information(self, camera_id):
+        """ Requests the camera information metadata of a camera.
 
-        # Send static tfs over the ROS network
-        self.static_tf_broadcaster.sendTransform([static_tf_cam_right, static_tf_cam_left])
+            Captured if `capture_file` is set; read from the capture instead
+            of the simulator when replaying.
 
-        # Camera_info publishing for VIO.
-        left_cam_data = None
-        while left_cam_data is None:
-            print("TESSE_ROS_NODE: Acquiring left camera data...")
-            left_cam_data = tesse_ros_bridge.utils.parse_cam_data(
-                self.env.request(
-                    CameraInformationRequest(Camera.RGB_LEFT)).metadata)
-            assert(left_cam_data['id'] == 0)
-            assert(left_cam_data['parameters']['height'] > 0)
-            assert(left_cam_data['parameters']['width'] > 0)
-
-        right_cam_data = None
-        while right_cam_data is None:
-            print("TESSE_ROS_NODE: Acquiring right camera data...")
-            right_cam_data = tesse_ros_bridge.utils.parse_cam_data(
-                self.env.request(
-                    CameraInformationRequest(Camera.RGB_RIGHT)).metadata)
-            assert(right_cam_data['id'] == 1)
-            assert(left_cam_data['parameters']['height'] > 0)
-            assert(left_cam_data['parameters']['width'] > 0)
-
-        assert(left_cam_data['parameters']['height'] == self.camera_height)
-        assert(left_cam_data['parameters']['width']  == self.camera_width)
-        assert(right_cam_data['parameters']['height'] == self.camera_height)
-        assert(right_cam_data['parameters']['width']  == self.camera_width)
+            Args:
+                camera_id: A Camera, the camera to request.
 
-        cam_info_msg_left, cam_info_msg_right = \
-            tesse_ros_bridge.utils.generate_camera_info(
-                left_cam_data, right_cam_data)
-        
-        # TODO(Toni) we should extend the above to get camera info for depth and segmentation!
-        # for now, just copy paste from left cam...
-        cam_info_msg_segmentation = cam_info_msg_left
-        cam_info_msg_depth = cam_info_msg_left
-
-        # TODO(Toni): do a check here by requesting all camera info and checking that it is
-        # as the one requested!
-        self.cam_info_msgs = [cam_info_msg_left,
-                              cam_info_msg_right,
-                              cam_info_msg_segmentation,
-                              cam_info_msg_depth]
+            Returns:
+                A string, the camera information metadata.
+        """
+        if self.replay_capture:
+            return read_camera_info(self.replay_capture)[camera_id]
+
+        metadata = self.env.request(CameraInformationRequest(camera_id)).metadata
+        if self.capture is not None:
+            self.capture.write_camera_info(camera_id, metadata)
+        return metadata
 
     def setup_ros_services(self):
         """ Setup ROS services related to the simulator.
@@ -475,6 +1369,9 @@ class TesseROSWrapper:
             These services include:
                 scene_change_request: change the scene_id of the simulator
                 object_spawn_request: spawn a prefab object into the scene
+                timing_snapshot: get the current stage timings
+                profile: profile all threads of the node for a while
+                pose_history: get ground-truth poses at past timestamps
         """
         self.scene_request_service = rospy.Service("scene_change_request",
                                                     SceneRequestService,
@@ -488,6 +1385,17 @@ class TesseROSWrapper:
         self.spawn_object = rospy.ServiceProxy('object_spawn_request',
                                                ObjectSpawnRequestService)
 
+        self.timing_snapshot_service = rospy.Service("timing_snapshot",
+                                                     TimingSnapshotService,
+                                                     self.rosservice_timing_snapshot)
+
+        self.profile_service = rospy.Service("profile", ProfileService,
+                                             self.rosservice_profile)
+
+        self.pose_history_service = rospy.Service("pose_history",
+                                                  PoseHistoryService,
+                                                  self.rosservice_pose_history)
+
     def setup_collision(self, enable_collision):
         """ Enable/Disable collisions in Simulator. """
         print("TESSE_ROS_NODE: Setup collisions to:", enable_collision)
@@ -534,21 +1442,105 @@ class TesseROSWrapper:
         
         return False
 
+    def rosservice_timing_snapshot(self, req):
+        """ Get the stage timings, in seconds, as a ROS service. """
+        snapshot = self.timings.snapshot(reset=req.reset)
+        stages = sorted(snapshot)
+        return TimingSnapshotServiceResponse(stages,
+            [snapshot[stage]['count'] for stage in stages],
+            [snapshot[stage]['mean'] for stage in stages],
+            [snapshot[stage]['p50'] for stage in stages],
+            [snapshot[stage]['p95'] for stage in stages],
+            [snapshot[stage]['p99'] for stage in stages],
+            [snapshot[stage]['max'] for stage in stages])
+
+    def rosservice_profile(self, req):
+        """ Profile the running node by sampling as a ROS service.
+
+            Samples the stacks of all threads for `req.duration` seconds,
+            writes them to `req.path` in the collapsed stack format and
+            returns a summary of the top functions. Blocks the calling
+            service thread meanwhile.
+        """
+        path = req.path or os.path.join(tempfile.gettempdir(),
+            "tesse_ros_bridge_%d_%d.collapsed" % (os.getpid(), time.time()))
+        if req.duration <= 0:
+            return ProfileServiceResponse(False, "", "duration must be > 0")
+
+        try:
+            profile = self.profiler.run(req.duration, req.interval,
+                                        rospy.is_shutdown)
+            profile.write_collapsed(path)
+        except Exception as e:
+            print("Profile Error: ", e)
+            return ProfileServiceResponse(False, "", str(e))
+
+        summary = profile.summary(req.top or 20)
+        rospy.loginfo("TESSE_ROS_NODE: wrote profile to %s\n%s" %
+                      (path, summary))
+        return ProfileServiceResponse(True, path, summary)
+
+    def rosservice_pose_history(self, req):
+        """ Get the ground-truth poses at many timestamps as a ROS service.
+
+            Poses between two metadata samples are interpolated. Stamps
+            outside the history are returned as invalid, with empty poses.
+        """
+        valid, positions, quaternions, velocities = self.pose_history.lookup(
+            [stamp.to_sec() for stamp in req.stamps])
+
+        poses = []
+        for stamp, position, quaternion in zip(req.stamps, positions,
+                                               quaternions):
+            pose = PoseStamped()
+            pose.header.stamp    = stamp
+            pose.header.frame_id = self.world_frame_id
+            pose.pose.position   = Point(*position)
+            pose.pose.orientation = Quaternion(*quaternion)
+            poses.append(pose)
+        return PoseHistoryServiceResponse([bool(v) for v in valid], poses,
+            [Vector3(*velocity) for velocity in velocities])
+
     def publish_tf(self, cur_tf, timestamp):
         """ Publish the ground-truth transform to the TF tree.
 
+            The transform goes through `tf_batcher`, which drops it if it is
+            not newer than the last one or is within the `tf_rate` limit.
+            Unless `tf_batch_period` is set, it is published right away.
+
             Args:
                 cur_tf: A 4x4 numpy matrix containing the transformation from
                     the body frame of the agent to ENU.
                 timestamp: A rospy.Time instance representing the current
                     time in the simulator.
         """
-        # Publish current transform to tf tree.
         trans = tesse_ros_bridge.utils.get_translation_part(cur_tf)
         quat = tesse_ros_bridge.utils.get_quaternion(cur_tf)
-        self.tf_broadcaster.sendTransform(trans, quat, timestamp,
-                                          self.body_frame_id,
-                                          self.world_frame_id)
+
+        transform                         = TransformStamped()
+        transform.header.frame_id         = self.world_frame_id
+        transform.header.stamp            = timestamp
+        transform.child_frame_id          = self.body_frame_id
+        transform.transform.translation.x = trans[0]
+        transform.transform.translation.y = trans[1]
+        transform.transform.translation.z = trans[2]
+        transform.transform.rotation.x    = quat[0]
+        transform.transform.rotation.y    = quat[1]
+        transform.transform.rotation.z    = quat[2]
+        transform.transform.rotation.w    = quat[3]
+
+        if self.tf_batcher.add(self.world_frame_id, self.body_frame_id,
+                               timestamp.to_sec(), transform) \
+                and self.tf_batch_period <= 0:
+            self.flush_tf()
+
+    def flush_tf(self):
+        """ Publish the transforms accepted by `tf_batcher` as one message on
+            /tf, if there are any.
+        """
+        transforms = self.tf_batcher.take()
+        if transforms:
+            self.tf_pub.publish(TFMessage(transforms))
 
 
 if __name__ == '__main__':
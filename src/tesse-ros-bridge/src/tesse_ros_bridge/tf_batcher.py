@@ -0,0 +1,101 @@
+import itertools
+import threading
+
+
+class TfBatcher(object):
+    """ Collects dynamic transforms into time-ordered batches for /tf.
+
+        Each (parent, child) frame pair is its own stream. A transform is
+        dropped if its stamp is not later than the last one accepted for its
+        pair, so the same transform reaching the batcher from several
+        callbacks is published once. With a `rate`, a transform is also
+        dropped if it is less than one period after the last one accepted
+        for its pair, which caps the stream at `rate` transforms per second
+        of stamp time whatever the rate of its source.
+
+        Accepted transforms are held until `take`, so a caller can publish
+        everything accepted since its last call as one TFMessage.
+    """
+
+    def __init__(self, rate=0.0, max_pending=1000):
+        """ Set up an empty batcher.
+
+            Args:
+                rate: A float, maximum transforms per second of stamp time
+                    for each frame pair; 0 for no limit.
+                max_pending: An integer, number of transforms held until
+                    `take`; beyond that the oldest are discarded.
+        """
+        assert(rate >= 0.0 and max_pending > 0)
+        # Stamps within 0.1% of a period count as a full period, so that a
+        # source at an exact multiple of `rate` isn't decimated unevenly by
+        # rounding.
+        self.min_interval = 0.999 / rate if rate > 0.0 else 0.0
+        self.max_pending  = max_pending
+
+        self.lock = threading.Lock()
+        self.pending = []
+        self.order = itertools.count()
+        self.last_stamps = {}
+        self.counts = {'accepted': 0, 'published': 0, 'batches': 0,
+                       'duplicates': 0, 'stale': 0, 'decimated': 0,
+                       'discarded': 0}
+
+    def add(self, parent, child, stamp, transform):
+        """ Add a transform.
+
+            Args:
+                parent: A string, the parent frame id.
+                child: A string, the child frame id.
+                stamp: A float, the transform's stamp in seconds.
+                transform: The transform, e.g. a TransformStamped.
+
+            Returns:
+                True if the transform was accepted, False if dropped.
+        """
+        key = (parent, child)
+        with self.lock:
+            last = self.last_stamps.get(key)
+            if last is not None:
+                if stamp == last:
+                    self.counts['duplicates'] += 1
+                    return False
+                if stamp < last:
+                    self.counts['stale'] += 1
+                    return False
+                if stamp - last < self.min_interval:
+                    self.counts['decimated'] += 1
+                    return False
+            self.last_stamps[key] = stamp
+            self.pending.append((stamp, next(self.order), transform))
+            self.counts['accepted'] += 1
+            if len(self.pending) > self.max_pending:
+                self.pending.sort()
+                del self.pending[0]
+                self.counts['discarded'] += 1
+            return True
+
+    def take(self):
+        """ Get the transforms accepted since the last call.
+
+            Returns:
+                A list of transforms, in increasing stamp order; empty if
+                there are none.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, []
+            if pending:
+                self.counts['published'] += len(pending)
+                self.counts['batches'] += 1
+        pending.sort()
+        return [transform for _, _, transform in pending]
+
+    def stats(self):
+        """ Get counts of transforms 'accepted', 'published' and of the
+            'batches' they were published in, of transforms dropped as
+            'duplicates', as 'stale' (older than an accepted transform of the
+            same frames), as 'decimated' by the rate limit, or 'discarded'
+            because too many were pending, and the number 'pending'.
+        """
+        with self.lock:
+            return dict(self.counts, pending=len(self.pending))
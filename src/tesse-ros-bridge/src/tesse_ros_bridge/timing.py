@@ -0,0 +1,102 @@
+import threading
+from timeit import default_timer
+
+import numpy as np
+
+
+class _Stage(object):
+    """ Ring buffer of the recent durations of one stage. """
+    __slots__ = ['durations', 'count']
+
+    def __init__(self, window):
+        self.durations = [0.0] * window
+        self.count = 0
+
+
+class StageTimings(object):
+    """ Rolling duration statistics of named processing stages.
+
+        Stages are timed by chaining laps, which costs one clock read and
+        one list store per stage:
+
+            t = timings.now()
+            metadata = decode(data)
+            t = timings.lap('udp_cb/decode', t)
+            processed = process(metadata)
+            t = timings.lap('udp_cb/process', t)
+
+        Each stage keeps the durations of its last `window` laps, from which
+        `snapshot` computes percentiles on demand. Thread safe.
+    """
+
+    def __init__(self, window=1024, clock=default_timer):
+        """ Set up empty timings.
+
+            Args:
+                window: An integer, number of recent laps per stage that
+                    statistics are computed over.
+                clock: A function returning a monotonic time in seconds.
+        """
+        assert(window > 0)
+        self.window = window
+        self.now    = clock
+        self.lock   = threading.Lock()
+        self.stages = {}
+
+    def record(self, stage, duration):
+        """ Record one duration of a stage.
+
+            Args:
+                stage: A string, name of the stage.
+                duration: A float, duration in seconds.
+        """
+        with self.lock:
+            timing = self.stages.get(stage)
+            if timing is None:
+                timing = self.stages[stage] = _Stage(self.window)
+            timing.durations[timing.count % self.window] = duration
+            timing.count += 1
+
+    def lap(self, stage, start):
+        """ Record the time since `start` as a duration of a stage.
+
+            Args:
+                stage: A string, name of the stage.
+                start: A float, time from `now` when the stage began.
+
+            Returns:
+                A float, the current time, at which the next stage begins.
+        """
+        end = self.now()
+        self.record(stage, end - start)
+        return end
+
+    def snapshot(self, reset=False):
+        """ Get the statistics of every stage.
+
+            Args:
+                reset: A boolean, whether to clear all stages afterwards.
+
+            Returns:
+                A dictionary from stage names to dictionaries with 'count',
+                the number of laps recorded since start or the last reset,
+                and 'mean', 'p50', 'p95', 'p99' and 'max' durations in
+                seconds over the stage's window.
+        """
+        with self.lock:
+            recent = dict((stage, (timing.count, list(timing.durations[
+                :min(timing.count, self.window)])))
+                for stage, timing in self.stages.items())
+            if reset:
+                self.stages = {}
+
+        snapshot = {}
+        for stage, (count, durations) in recent.items():
+            durations = np.array(durations)
+            p50, p95, p99 = np.percentile(durations, [50, 95, 99])
+            snapshot[stage] = {'count': count,
+                               'mean': float(durations.mean()),
+                               'p50': float(p50), 'p95': float(p95),
+                               'p99': float(p99),
+                               'max': float(durations.max())}
+        return snapshot
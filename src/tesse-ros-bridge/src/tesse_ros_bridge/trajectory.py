@@ -0,0 +1,93 @@
+import numpy as np
+
+
+class CircleTrajectory(object):
+    """ Scripted agent motion used to synthesize Unity metadata offline.
+
+        The agent drives around a horizontal circle in the Unity world frame
+        (left-handed, y up), always facing along its velocity, while bobbing
+        vertically and varying its speed. All quantities are analytic, so
+        samples can be generated at any time and rate without integrating.
+    """
+
+    def __init__(self, radius=5.0, speed=1.5, center=(0.0, 2.5, 0.0),
+                 bob_amplitude=0.05, bob_frequency=1.0, speed_variation=0.3):
+        """ Describe the trajectory.
+
+            Args:
+                radius: A float, radius of the circle in meters.
+                speed: A float, mean tangential speed in meters per second.
+                center: A 3-tuple, center of the circle in the Unity frame.
+                bob_amplitude: A float, amplitude of the vertical motion in
+                    meters.
+                bob_frequency: A float, frequency of the vertical motion in
+                    Hz.
+                speed_variation: A float in [0, 1), relative amplitude of the
+                    periodic speed change.
+        """
+        assert(radius > 0.0)
+        assert(0.0 <= speed_variation < 1.0)
+        self.radius          = radius
+        self.speed           = speed
+        self.center          = np.array(center, dtype=np.float64)
+        self.bob_amplitude   = bob_amplitude
+        self.bob_omega       = 2.0 * np.pi * bob_frequency
+        self.speed_variation = speed_variation
+
+    def metadata(self, t, collision_status=False):
+        """ Sample the trajectory as a raw Unity metadata dictionary.
+
+            Args:
+                t: A float, simulator time in seconds.
+                collision_status: A bool for the 'collision_status' field.
+
+            Returns:
+                A dictionary with the same members as `parse_metadata`.
+                Velocities and accelerations are in the left-handed body
+                frame, as sent by Unity.
+        """
+        w = self.speed / self.radius
+        k = self.speed_variation
+
+        # Heading angle phi(t) and its derivatives, with periodic speed.
+        phi = w * t + k * np.sin(w * t)
+        phi_dot = w * (1.0 + k * np.cos(w * t))
+        phi_ddot = -k * w * w * np.sin(w * t)
+
+        b = self.bob_amplitude
+        o = self.bob_omega
+
+        position = self.center + np.array([self.radius * np.cos(phi),
+                                           b * np.sin(o * t),
+                                           self.radius * np.sin(phi)])
+        vel_unity = np.array([-self.radius * np.sin(phi) * phi_dot,
+                              b * o * np.cos(o * t),
+                              self.radius * np.cos(phi) * phi_dot])
+        acc_unity = np.array([
+            -self.radius * (np.cos(phi) * phi_dot**2 + np.sin(phi) * phi_ddot),
+            -b * o * o * np.sin(o * t),
+            self.radius * (-np.sin(phi) * phi_dot**2 + np.cos(phi) * phi_ddot)])
+
+        # Face along the horizontal velocity: body +z is forward in Unity.
+        yaw = -phi
+        quaternion = [0.0, np.sin(yaw / 2.0), 0.0, np.cos(yaw / 2.0)]
+        c, s = np.cos(yaw), np.sin(yaw)
+        unity_R_body = np.array([[c, 0.0, s],
+                                 [0.0, 1.0, 0.0],
+                                 [-s, 0.0, c]])
+
+        metadata = {}
+        metadata['position'] = position.tolist()
+        metadata['quaternion'] = [float(q) for q in quaternion]
+        metadata['velocity'] = unity_R_body.T.dot(vel_unity).tolist()
+        metadata['ang_vel'] = [0.0, -phi_dot, 0.0]
+        metadata['acceleration'] = unity_R_body.T.dot(acc_unity).tolist()
+        metadata['ang_accel'] = [0.0, -phi_ddot, 0.0]
+        metadata['time'] = float(t)
+        metadata['collision_status'] = collision_status
+
+        return metadata
+
+    def metadata_sequence(self, n, rate, start_time=0.0):
+        """ Sample `n` consecutive metadata dictionaries at `rate` Hz. """
+        return [self.metadata(start_time + i / float(rate)) for i in range(n)]
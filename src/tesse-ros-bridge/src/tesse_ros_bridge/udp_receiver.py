@@ -0,0 +1,178 @@
+import errno
+import os
+import select
+import socket
+import threading
+import traceback
+
+UDP_POLICIES = ['all', 'latest']
+
+
+class UdpReceiver(object):
+    """ Receives UDP datagrams on a thread, draining the socket per wakeup.
+
+        Stands in for `tesse.utils.UdpListener`, which handles one datagram
+        per wakeup at a fixed rate. Here the thread sleeps in `select` until
+        data arrives, then reads every queued datagram without blocking and
+        hands the batch to the subscribers: all of it in order with the
+        'all' policy, or only the newest datagram with the 'latest' policy.
+        After a stall, 'all' catches up on the backlog while 'latest' skips
+        straight to fresh data.
+
+        Datagrams the kernel dropped because the socket buffer was full are
+        read from /proc/net/udp on Linux; the ones skipped by the 'latest'
+        policy are counted as discarded.
+    """
+
+    def __init__(self, port, host='', rcvbuf=4 << 20, policy='all',
+                 buffer_size=65535, max_batch=1024, timeout=0.1,
+                 on_timeout=None, name='udp_receiver'):
+        """ Bind the socket; call `start` to receive.
+
+            Args:
+                port: An integer, port to receive on; 0 picks a free port.
+                host: A string, address to bind to; all interfaces if empty.
+                rcvbuf: An integer, socket receive buffer size in bytes. The
+                    kernel caps it at net.core.rmem_max, see `stats`.
+                policy: A string, 'all' or 'latest'.
+                buffer_size: An integer, maximum datagram size in bytes.
+                max_batch: An integer, maximum datagrams read per wakeup.
+                timeout: A float, seconds between checks for `stop`.
+                on_timeout: An optional function called on the receiver
+                    thread whenever `timeout` passes without a datagram.
+                name: A string used to name the thread.
+        """
+        assert(policy in UDP_POLICIES)
+        assert(max_batch > 0)
+        self.policy      = policy
+        self.buffer_size = buffer_size
+        self.max_batch   = max_batch
+        self.timeout     = timeout
+        self.on_timeout  = on_timeout
+        self.name        = name
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.socket.bind((host, port))
+        self.port = self.socket.getsockname()[1]
+        self.rcvbuf = self.socket.getsockopt(socket.SOL_SOCKET,
+                                             socket.SO_RCVBUF)
+        self.inode = os.fstat(self.socket.fileno()).st_ino
+        self.last_kernel_drops = None
+
+        self.callbacks = {}
+        self.thread = None
+        self.running = False
+        self.lock = threading.Lock()
+        self.counts = {'received': 0, 'delivered': 0, 'discarded': 0,
+                       'batches': 0, 'max_batch': 0, 'callback_errors': 0}
+
+    def subscribe(self, name, callback):
+        """ Call `callback` with each delivered datagram, like
+            `UdpListener.subscribe`.
+
+            Args:
+                name: A string, name of the subscription.
+                callback: A function taking a datagram bytestring.
+        """
+        self.callbacks[name] = callback
+
+    def start(self):
+        """ Start receiving. """
+        assert(self.thread is None)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """ Stop receiving and close the socket. """
+        if self.thread is not None:
+            self.running = False
+            self.thread.join()
+            self.thread = None
+        self.kernel_drops()  # Keep the final count.
+        self.socket.close()
+
+    def stats(self):
+        """ Get the receiver statistics.
+
+            Returns:
+                A dictionary with the numbers of datagrams 'received',
+                'delivered' to subscribers and 'discarded' by the 'latest'
+                policy, the number of 'batches' read and the size of the
+                largest one ('max_batch'), 'callback_errors', the
+                'kernel_drops' of the socket (None where unavailable) and the
+                effective 'rcvbuf' size in bytes.
+        """
+        with self.lock:
+            stats = dict(self.counts)
+        stats['kernel_drops'] = self.kernel_drops()
+        stats['rcvbuf'] = self.rcvbuf
+        return stats
+
+    def kernel_drops(self):
+        """ Get the datagrams the kernel dropped for this socket, from the
+            `drops` column of /proc/net/udp, or None where unavailable. Once
+            stopped, the count at `stop` is returned.
+        """
+        try:
+            with open('/proc/net/udp') as udp_file:
+                lines = udp_file.readlines()
+        except IOError:
+            return None
+        inode = str(self.inode)
+        for line in lines[1:]:
+            fields = line.split()
+            if len(fields) > 12 and fields[9] == inode:
+                self.last_kernel_drops = int(fields[12])
+                break
+        return self.last_kernel_drops
+
+    def _run(self):
+        while self.running:
+            readable, _, _ = select.select([self.socket], [], [],
+                                           self.timeout)
+            if readable:
+                self._deliver(self._drain())
+            elif self.on_timeout is not None:
+                try:
+                    self.on_timeout()
+                except Exception:
+                    with self.lock:
+                        self.counts['callback_errors'] += 1
+                    print("TESSE_ROS_NODE: udp timeout callback error:\n%s" %
+                          traceback.format_exc())
+
+    def _drain(self):
+        """ Read the queued datagrams, without blocking. """
+        batch = []
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.socket.recv(self.buffer_size,
+                                              socket.MSG_DONTWAIT))
+            except socket.error as error:
+                if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+        return batch
+
+    def _deliver(self, batch):
+        delivered = batch[-1:] if self.policy == 'latest' else batch
+        errors = 0
+        for data in delivered:
+            for callback in list(self.callbacks.values()):
+                try:
+                    callback(data)
+                except Exception:
+                    errors += 1
+                    print("TESSE_ROS_NODE: udp callback error:\n%s" %
+                          traceback.format_exc())
+        with self.lock:
+            self.counts['received'] += len(batch)
+            self.counts['delivered'] += len(delivered)
+            self.counts['discarded'] += len(batch) - len(delivered)
+            self.counts['batches'] += 1
+            self.counts['max_batch'] = max(self.counts['max_batch'],
+                                           len(batch))
+            self.counts['callback_errors'] += errors
@@ -1,18 +1,146 @@
 import xml.etree.ElementTree as ET
 import numpy as np
 import copy
+import math
+import re
+import struct
 
 from scipy.spatial.transform import Rotation
 
 from sensor_msgs.msg import CameraInfo, Imu
+from sensor_msgs.msg import Image as ImageMsg
+from sensor_msgs.msg import CompressedImage
 from nav_msgs.msg import Odometry
 import tf.transformations
 
 from tesse_ros_bridge import enu_T_unity, brh_T_blh, blh_T_brh, gravity_enu
 
+# Element layout of every agent metadata schema we know how to read without
+# building an ElementTree. Elements are listed in the order Unity writes them,
+# each with the dictionary key it fills and the attributes it carries
+# (None for elements whose value is their text).
+METADATA_SCHEMAS = {
+    'TESSE_Agent_Metadata_v0.3': [
+        ('position', 'position', ('x', 'y', 'z')),
+        ('quaternion', 'quaternion', ('x', 'y', 'z', 'w')),
+        ('velocity', 'velocity', ('x_dot', 'y_dot', 'z_dot')),
+        ('angular_velocity', 'ang_vel',
+            ('x_ang_dot', 'y_ang_dot', 'z_ang_dot')),
+        ('acceleration', 'acceleration', ('x_ddot', 'y_ddot', 'z_ddot')),
+        ('angular_acceleration', 'ang_accel',
+            ('x_ang_ddot', 'y_ang_ddot', 'z_ang_ddot')),
+        ('time', 'time', None),
+        ('collision', 'collision_status', ('status',)),
+    ],
+}
+
+
+class MetadataSchemaParser(object):
+    """ Reads agent metadata of one known schema straight out of the string.
+
+        The schema layout is compiled once into a single regular expression
+        that captures every attribute value, so parsing a packet costs one
+        regex match and one `float` per field instead of a full ElementTree.
+        Both text and byte strings are accepted.
+    """
+
+    def __init__(self, version, layout):
+        """ Compile the parser for a schema.
+
+            Args:
+                version: A string with the root tag of the schema, e.g.
+                    'TESSE_Agent_Metadata_v0.3'.
+                layout: A list of (element, key, attributes) tuples as in
+                    `METADATA_SCHEMAS`.
+        """
+        self.version = version
+        self.layout = layout
+
+        # Each field is (key, first group, end group, is_text) in the match.
+        self._fields = []
+        group = 0
+
+        value = r"""=['"]([^'"]*)['"]"""
+        pattern = r'\s*(?:<\?xml[^>]*\?>\s*)?<' + re.escape(version) + r'>\s*'
+        for element, key, attributes in layout:
+            n_groups = 1 if attributes is None else len(attributes)
+            self._fields.append((key, group, group + n_groups,
+                                 attributes is None))
+            group += n_groups
+
+            if attributes is None:
+                pattern += r'<' + element + r'>\s*([^<\s]*)\s*</' + \
+                    element + r'>\s*'
+            else:
+                pattern += r'<' + element
+                for attribute in attributes:
+                    pattern += r'\s+' + attribute + value
+                pattern += r'[^>]*>\s*'
+        pattern += r'</' + re.escape(version) + r'>'
+
+        self._text_regex = re.compile(pattern)
+        self._bytes_regex = re.compile(pattern.encode('ascii'))
+
+    def parse(self, data):
+        """ Parse metadata of this schema.
+
+            Args:
+                data: A string or bytestring with the xml metadata.
+
+            Returns:
+                A dictionary as returned by `parse_metadata`, or None if the
+                data does not follow this schema's exact layout.
+        """
+        regex = self._bytes_regex if isinstance(data, bytes) \
+            else self._text_regex
+        match = regex.match(data)
+        if match is None:
+            return None
+
+        values = match.groups()
+        dict = {}
+        for key, start, stop, is_text in self._fields:
+            if key == 'collision_status':
+                dict[key] = False if values[start] in ('false', b'false') \
+                    else True
+            elif is_text:
+                dict[key] = float(values[start])
+            else:
+                dict[key] = [float(v) for v in values[start:stop]]
+
+        return dict
+
+
+# Parsers are built once, at import, for every known schema version.
+metadata_parsers = [MetadataSchemaParser(version, layout)
+                    for version, layout in METADATA_SCHEMAS.items()]
+
+
 def parse_metadata(data):
     """ Parse Unity agent metadata into a useful dictionary.
 
+        Known schema versions are read by their precompiled
+        `MetadataSchemaParser`. Anything else (unknown versions, reordered
+        attributes, extra elements) falls back to `parse_metadata_etree`.
+
+        Args:
+            data: A string or bytestring representing the xml metadata from
+                Unity.
+
+        Returns:
+            See `parse_metadata_etree`.
+    """
+    for parser in metadata_parsers:
+        dict = parser.parse(data)
+        if dict is not None:
+            return dict
+
+    return parse_metadata_etree(data)
+
+
+def parse_metadata_etree(data):
+    """ Parse Unity agent metadata into a useful dictionary with ElementTree.
+
         Args:
             data: A decoded string representing the xml metadata from Unity.
 
@@ -58,6 +186,111 @@ def parse_metadata(data):
     return dict
 
 
+# Packed binary agent metadata record, a compact alternative to the xml text.
+# Every record starts with METADATA_BINARY_MAGIC so both encodings can share
+# the same UDP port; all fields are little-endian and unaligned.
+METADATA_BINARY_MAGIC = b'TSM1'
+
+metadata_binary_dtype = np.dtype([
+    ('magic',            'S4'),
+    ('position',         '<f8', (3,)),
+    ('quaternion',       '<f8', (4,)),
+    ('velocity',         '<f8', (3,)),
+    ('ang_vel',          '<f8', (3,)),
+    ('acceleration',     '<f8', (3,)),
+    ('ang_accel',        '<f8', (3,)),
+    ('time',             '<f8'),
+    ('collision_status', 'u1'),
+])
+
+
+def decode_metadata(data):
+    """ Decode agent metadata in either wire encoding.
+
+        Packed binary records are recognized by METADATA_BINARY_MAGIC;
+        anything else is treated as xml and given to `parse_metadata`.
+
+        Args:
+            data: A string or bytestring received from the simulator.
+
+        Returns:
+            See `parse_metadata`.
+    """
+    if data[:4] == METADATA_BINARY_MAGIC:
+        return decode_metadata_binary(data)
+    return parse_metadata(data)
+
+
+def decode_metadata_binary(data):
+    """ Decode a packed binary metadata record into a dictionary.
+
+        Args:
+            data: A bytestring holding one `metadata_binary_dtype` record.
+
+        Returns:
+            See `parse_metadata`.
+    """
+    record = np.frombuffer(data, dtype=metadata_binary_dtype, count=1)[0]
+    assert(record['magic'] == METADATA_BINARY_MAGIC)
+
+    dict = {}
+    dict['position'] = record['position'].tolist()
+    dict['quaternion'] = record['quaternion'].tolist()
+    dict['velocity'] = record['velocity'].tolist()
+    dict['ang_vel'] = record['ang_vel'].tolist()
+    dict['acceleration'] = record['acceleration'].tolist()
+    dict['ang_accel'] = record['ang_accel'].tolist()
+    dict['time'] = float(record['time'])
+    dict['collision_status'] = bool(record['collision_status'])
+
+    return dict
+
+
+def encode_metadata_binary(metadata):
+    """ Encode a metadata dictionary as a packed binary record.
+
+        Args:
+            metadata: A dictionary with the members of `parse_metadata`.
+
+        Returns:
+            A bytestring of `metadata_binary_dtype.itemsize` bytes.
+    """
+    record = np.zeros(1, dtype=metadata_binary_dtype)
+    record['magic'] = METADATA_BINARY_MAGIC
+    for key in ['position', 'quaternion', 'velocity', 'ang_vel',
+                'acceleration', 'ang_accel', 'time', 'collision_status']:
+        record[key] = metadata[key]
+    return record.tobytes()
+
+
+def encode_metadata_xml(metadata):
+    """ Encode a metadata dictionary as TESSE_Agent_Metadata_v0.3 xml.
+
+        This mirrors the text Unity sends, so that `parse_metadata` reads it
+        back exactly.
+
+        Args:
+            metadata: A dictionary with the members of `parse_metadata`.
+
+        Returns:
+            A bytestring with the xml metadata.
+    """
+    lines = ['<TESSE_Agent_Metadata_v0.3>']
+    for element, key, attributes in \
+            METADATA_SCHEMAS['TESSE_Agent_Metadata_v0.3']:
+        if key == 'collision_status':
+            lines.append("  <collision status='%s' name=''/>" %
+                         ('true' if metadata[key] else 'false'))
+        elif attributes is None:
+            lines.append("  <%s>%.17g</%s>" % (element, metadata[key], element))
+        else:
+            lines.append("  <%s %s/>" % (element, ' '.join(
+                "%s='%.17g'" % (attribute, value)
+                for attribute, value in zip(attributes, metadata[key]))))
+    lines.append('</TESSE_Agent_Metadata_v0.3>')
+    return '\n'.join(lines).encode('ascii')
+
+
 def parse_cam_data(data):
     """ Parse CameraInformationRequest data into a useful dictionary
 
@@ -181,6 +414,236 @@ def metadata_to_imu(processed_metadata, timestamp, frame_id):
     return imu
 
 
+# Numpy dtype and number of channels of each image encoding we publish.
+IMAGE_ENCODINGS = {
+    'mono8':  (np.uint8, 1),
+    'rgb8':   (np.uint8, 3),
+    'bgr8':   (np.uint8, 3),
+    'mono16': (np.uint16, 1),
+    '16UC1':  (np.uint16, 1),
+    '32FC1':  (np.float32, 1),
+}
+
+_struct_I = struct.Struct('<I')
+
+
+class ImageBufferMsg(ImageMsg):
+    """ A sensor_msgs/Image whose pixels stay in the source numpy buffer.
+
+        `data` holds a flat byte view of the image array rather than a copy
+        of it. On publish, the header fields are serialized by the regular
+        sensor_msgs/Image code and the pixels are then written straight from
+        that view into rospy's send buffer, so each frame is copied once
+        instead of twice (`tostring` in CvBridge, then serialization).
+
+        The wire format is identical to sensor_msgs/Image. The source array
+        must not be modified until `publish` returns.
+    """
+
+    def serialize(self, buff):
+        data = self.data
+        self.data = b''
+        try:
+            ImageMsg.serialize(self, buff)
+        finally:
+            self.data = data
+
+        # Overwrite the empty data length written above and append the pixels.
+        buff.seek(-4, 1)
+        buff.write(_struct_I.pack(len(data)))
+        buff.write(data)
+
+
+def make_image_msg(image, encoding):
+    """ Build an Image message around a numpy image without copying it.
+
+        Equivalent to `CvBridge.cv2_to_imgmsg(image, encoding)`, down to the
+        serialized bytes, for the encodings in IMAGE_ENCODINGS.
+
+        Args:
+            image: An HxW or HxWxC numpy array.
+            encoding: A string, one of the keys of IMAGE_ENCODINGS.
+
+        Returns:
+            An ImageBufferMsg instance without header.
+    """
+    dtype, channels = IMAGE_ENCODINGS[encoding]
+    image_channels = 1 if image.ndim < 3 else image.shape[2]
+    if image.dtype.type is not dtype or image_channels != channels:
+        raise ValueError("encoding specified as %s, but image has "
+                         "incompatible type %s with %d channels" %
+                         (encoding, image.dtype, image_channels))
+
+    # A view for contiguous images; only strided images are copied.
+    pixels = np.ascontiguousarray(image).reshape(-1).view(np.uint8)
+
+    img_msg = ImageBufferMsg()
+    img_msg.height = image.shape[0]
+    img_msg.width = image.shape[1]
+    img_msg.encoding = encoding
+    img_msg.is_bigendian = 1 if image.dtype.byteorder == '>' else 0
+    img_msg.step = pixels.nbytes // img_msg.height
+    img_msg.data = pixels.data
+    return img_msg
+
+
+# File extensions cv2 uses to encode each CompressedImage format.
+COMPRESSED_FORMATS = {'jpeg': '.jpg', 'png': '.png'}
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def compressed_image_format(payload):
+    """ Identify the format of an encoded image from its leading bytes.
+
+        Args:
+            payload: A bytestring holding a PNG or JPEG encoded image.
+
+        Returns:
+            A string, 'png' or 'jpeg'.
+    """
+    return 'png' if payload[:8] == _PNG_SIGNATURE else 'jpeg'
+
+
+def make_compressed_image_msg(payload, format=None):
+    """ Build a CompressedImage message around an encoded image.
+
+        The payload is forwarded as is; nothing is decoded or re-encoded.
+
+        Args:
+            payload: A bytestring holding an encoded image.
+            format: A string, the CompressedImage format. Detected from the
+                payload if None.
+
+        Returns:
+            A CompressedImage message without header.
+    """
+    msg = CompressedImage()
+    msg.format = compressed_image_format(payload) if format is None \
+        else format
+    msg.data = payload
+    return msg
+
+
+def encode_compressed_image(image, format='jpeg'):
+    """ Encode an rgb8 or mono8 image for a CompressedImage message.
+
+        Args:
+            image: An HxW or HxWx3 uint8 numpy array, in RGB order.
+            format: A string, one of the keys of COMPRESSED_FORMATS.
+
+        Returns:
+            A bytestring holding the encoded image.
+    """
+    # OpenCV is only needed with `compressed_images`.
+    import cv2
+    if image.ndim == 3:
+        image = image[:, :, ::-1]  # cv2 expects BGR order.
+    success, buffer = cv2.imencode(COMPRESSED_FORMATS[format], image)
+    if not success:
+        raise ValueError("could not encode image as %s" % format)
+    return buffer.tobytes()
+
+
+def decode_compressed_image(payload, channels):
+    """ Decode a PNG or JPEG encoded image.
+
+        Args:
+            payload: A bytestring holding the encoded image.
+            channels: An integer, 1 to decode as mono8 or 3 to decode as
+                rgb8.
+
+        Returns:
+            An HxW or HxWx3 uint8 numpy array, in RGB order.
+    """
+    import cv2
+    flags = cv2.IMREAD_GRAYSCALE if channels == 1 else cv2.IMREAD_COLOR
+    image = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), flags)
+    if image is None:
+        raise ValueError("could not decode compressed image")
+    if channels == 3:
+        cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+    return image
+
+
+# Depth encodings, following REP-118: 32FC1 in meters, 16UC1 in millimeters
+# with 0 marking pixels without a valid depth.
+DEPTH_ENCODINGS = ['32FC1', '16UC1']
+MAX_DEPTH_RANGE_16UC1 = np.iinfo(np.uint16).max / 1000.0
+
+
+class DepthImageConverter(object):
+    """ Converts normalized simulator depth to metric depth images.
+
+        The simulator gives depth as a fraction of the far draw distance.
+        Results are written into buffers owned by the converter and reused
+        for every frame of the same size, so no image-sized array is
+        allocated per frame. The returned array is overwritten by the next
+        call to `convert`.
+    """
+
+    def __init__(self, far_draw_dist, encoding='32FC1', max_range=None):
+        """ Set up the conversion.
+
+            Args:
+                far_draw_dist: A float, the simulator's far draw distance in
+                    meters.
+                encoding: A string, one of DEPTH_ENCODINGS.
+                max_range: An optional float, depth in meters beyond which
+                    16UC1 pixels are invalid (0). Defaults to
+                    `far_draw_dist`, and is clamped to MAX_DEPTH_RANGE_16UC1.
+                    Pixels at the far plane, with no return, are always
+                    invalid in 16UC1, per REP-118.
+        """
+        assert(far_draw_dist > 0.0)
+        assert(encoding in DEPTH_ENCODINGS)
+        self.far_draw_dist = far_draw_dist
+        self.encoding = encoding
+
+        if max_range is None:
+            max_range = far_draw_dist
+        assert(max_range > 0.0)
+        self.max_range = min(max_range, MAX_DEPTH_RANGE_16UC1) \
+            if encoding == '16UC1' else max_range
+
+        self._buffer = None
+        self._scratch = None
+
+    def convert(self, depth):
+        """ Convert one normalized depth image.
+
+            Args:
+                depth: An HxW numpy array of depth as a fraction of the far
+                    draw distance.
+
+            Returns:
+                An HxW numpy array, float32 meters for 32FC1 or uint16
+                millimeters for 16UC1.
+        """
+        if self.encoding == '32FC1':
+            self._buffer = self._reuse(self._buffer, depth.shape, np.float32)
+            return np.multiply(depth, self.far_draw_dist, out=self._buffer)
+
+        self._scratch = self._reuse(self._scratch, depth.shape, np.float32)
+        self._buffer = self._reuse(self._buffer, depth.shape, np.uint16)
+
+        millimeters = np.multiply(depth, self.far_draw_dist * 1000.0,
+                                  out=self._scratch)
+        np.rint(millimeters, out=millimeters)
+        millimeters[millimeters > self.max_range * 1000.0] = 0.0
+        millimeters[millimeters < 0.0] = 0.0
+        millimeters[depth >= 1.0] = 0.0
+        np.copyto(self._buffer, millimeters, casting='unsafe')
+        return self._buffer
+
+    @staticmethod
+    def _reuse(buffer, shape, dtype):
+        """ Return `buffer` if it fits, otherwise a new one that does. """
+        if buffer is None or buffer.shape != shape:
+            buffer = np.empty(shape, dtype=dtype)
+        return buffer
+
+
 def vfov_from_hfov(hfov, width, height):
     """ Returns horiziontal FOV based on provided vertical FOV and dimensions.
 
@@ -339,6 +802,39 @@ def generate_camera_info(left_cam_data, right_cam_data):
     return (cam_info_msg_left, cam_info_msg_right)
 
 
+def generate_mono_camera_info(cam_data, frame_id):
+    """ Generates the CameraInfo message of a single camera, e.g. depth or
+        segmentation, from its own parsed data.
+
+        Intrinsics are computed as in `generate_camera_info`; the projection
+        has no baseline.
+
+        Args:
+            cam_data: A dictionary containing parsed data for the camera.
+            frame_id: A string, the frame id of the message.
+
+        Returns:
+            The camera's CameraInfo message.
+    """
+    width  = cam_data['parameters']['width']
+    height = cam_data['parameters']['height']
+    fov_vertical = cam_data['parameters']['fov']
+    assert(height > 0)
+    assert(width > 0)
+
+    fov_horizontal = hfov_from_vfov(fov_vertical, width, height)
+    fx = fx_from_hfov(fov_horizontal, width)
+    fy = fy_from_vfov(fov_vertical, height)
+    assert(fx == fy)
+
+    cx = width  / 2
+    cy = height / 2
+    assert(cx == width  // 2)
+    assert(cy == height // 2)
+
+    return make_camera_info_msg(frame_id, width, height, fx, fy, cx, cy, 0, 0)
+
+
 # TODO(Toni): unit-test this!
 def make_camera_info_msg(frame_id, width, height, fx, fy, cx, cy, Tx, Ty):
     """ Create a CameraInfo ROS message from parameters.
@@ -626,3 +1122,430 @@ def get_quaternion(transform):
     R = copy.deepcopy(transform)
     R[:,3] = np.array([0,0,0,1])
     return tf.transformations.quaternion_from_matrix(R)
+
+# Constants for the closed-form SO(3) kernels below.
+_EPS = np.finfo(float).eps * 4.0
+_IDENTITY_3 = np.identity(3)
+
+def quaternion_to_rotation_mat(quaternion, out=None):
+    """ Closed-form equivalent of `tf.transformations.quaternion_matrix`.
+
+        Args:
+            quaternion: A 4-sequence in [x,y,z,w] order; need not be unit.
+            out: An optional 3x3 numpy array to write the result into.
+
+        Returns:
+            A 3x3 numpy array containing the rotation matrix.
+    """
+    if out is None:
+        out = np.empty((3,3))
+
+    x, y, z, w = quaternion
+    n = x*x + y*y + z*z + w*w
+    if n < _EPS:
+        out[...] = _IDENTITY_3
+        return out
+
+    s = 2.0 / n
+    out[0] = (1.0 - s*(y*y + z*z), s*(x*y - z*w), s*(x*z + y*w))
+    out[1] = (s*(x*y + z*w), 1.0 - s*(x*x + z*z), s*(y*z - x*w))
+    out[2] = (s*(x*z - y*w), s*(y*z + x*w), 1.0 - s*(x*x + y*y))
+    return out
+
+def rotation_mat_to_quaternion(R, out=None):
+    """ Closed-form equivalent of `tf.transformations.quaternion_from_matrix`.
+
+        Follows the same branches so that the sign of the result is
+        identical to `get_quaternion`.
+
+        Args:
+            R: A 3x3 numpy array containing a rotation matrix.
+            out: An optional numpy array of 4 elements to write into.
+
+        Returns:
+            A numpy array containing the quaternion in [x,y,z,w] order.
+    """
+    if out is None:
+        out = np.empty(4)
+
+    out[:] = _quaternion_from_rows(R.tolist())
+    return out
+
+def _quaternion_from_rows(M):
+    """ Quaternion [x,y,z,w] as a tuple, from a rotation matrix as lists. """
+    t = M[0][0] + M[1][1] + M[2][2] + 1.0
+    q = [0.0, 0.0, 0.0, 0.0]
+    if t > 1.0:
+        q[3] = t
+        q[2] = M[1][0] - M[0][1]
+        q[1] = M[0][2] - M[2][0]
+        q[0] = M[2][1] - M[1][2]
+    else:
+        i, j, k = 0, 1, 2
+        if M[1][1] > M[0][0]:
+            i, j, k = 1, 2, 0
+        if M[2][2] > M[i][i]:
+            i, j, k = 2, 0, 1
+        t = M[i][i] - (M[j][j] + M[k][k]) + 1.0
+        q[i] = t
+        q[j] = M[i][j] + M[j][i]
+        q[k] = M[k][i] + M[i][k]
+        q[3] = M[k][j] - M[j][k]
+
+    scale = 0.5 / math.sqrt(t)
+    return (q[0] * scale, q[1] * scale, q[2] * scale, q[3] * scale)
+
+def so3_logmap(R, out=None):
+    """ Closed-form rotation vector (axis-angle) of a rotation matrix.
+
+        Equivalent to `Rotation.from_quat(get_quaternion(T)).as_rotvec()`,
+        including its small-angle series, without building any objects.
+
+        Args:
+            R: A 3x3 numpy array containing a rotation matrix.
+            out: An optional numpy array of 3 elements to write into.
+
+        Returns:
+            A numpy array containing the rotation vector.
+    """
+    if out is None:
+        out = np.empty(3)
+
+    x, y, z, w = _quaternion_from_rows(R.tolist())
+    if w < 0.0:
+        x, y, z, w = -x, -y, -z, -w
+    n = math.sqrt(x*x + y*y + z*z + w*w)
+    x, y, z, w = x / n, y / n, z / n, w / n
+
+    angle = 2.0 * math.atan2(math.sqrt(x*x + y*y + z*z), w)
+    if angle <= 1e-3:
+        angle2 = angle * angle
+        scale = 2.0 + angle2 / 12.0 + 7.0 * angle2 * angle2 / 2880.0
+    else:
+        scale = angle / math.sin(angle / 2.0)
+
+    out[:] = (scale * x, scale * y, scale * z)
+    return out
+
+
+class MetadataProcessor(object):
+    """ Stateful, allocation-free equivalent of `process_metadata`.
+
+        Owns the finite-difference state (`prev_time`, `prev_vel_brh`,
+        `prev_enu_R_brh`) that callers of `process_metadata` have to carry
+        themselves, and writes every result into preallocated arrays using
+        the closed-form kernels above.
+
+        The dictionary returned by `process` and the arrays in it are reused
+        by the next call: copy anything that must outlive it.
+    """
+
+    def __init__(self):
+        self.processed = {}
+        self.enu_T_brh    = np.identity(4)
+        self.enu_R_brh    = np.identity(3)
+        self.position     = np.zeros(3)
+        self.quaternion   = np.zeros(4)
+        self.vel_brh      = np.zeros(3)
+        self.ang_vel_brh  = np.zeros(3)
+        self.acc_brh      = np.zeros(3)
+
+        self.prev_vel_brh   = np.zeros(3)
+        self.prev_enu_R_brh = np.identity(3)
+
+        # Frame changes and scratch buffers.
+        self._enu_R_unity = enu_T_unity[:3,:3].astype(np.float64)
+        self._blh_R_brh   = blh_T_brh[:3,:3].astype(np.float64)
+        self._brh_R_blh   = brh_T_blh[:3,:3].astype(np.float64)
+        self._unity_R_blh = np.empty((3,3))
+        self._enu_R_blh   = np.empty((3,3))
+        self._pos_unity   = np.empty(3)
+        self._rel_R       = np.empty((3,3))
+        self._vel_blh     = np.empty(3)
+        self._vel_enu     = np.empty(3)
+        self._acc_enu     = np.empty(3)
+
+        self.reset()
+
+    def reset(self, prev_time=0.0, prev_vel_brh=None, prev_enu_R_brh=None):
+        """ Reset the finite-difference state.
+
+            Args:
+                prev_time: A float, time of the fictitious previous sample.
+                prev_vel_brh: An optional 3-vector, previous velocity in the
+                    body-right-handed frame. Defaults to zero.
+                prev_enu_R_brh: An optional 3x3 rotation matrix from the
+                    previous body frame to ENU. Defaults to identity.
+        """
+        self.prev_time = prev_time
+        self.prev_vel_brh[:] = 0.0 if prev_vel_brh is None else prev_vel_brh
+        self.prev_enu_R_brh[...] = _IDENTITY_3 if prev_enu_R_brh is None \
+            else prev_enu_R_brh
+
+    def seed(self, metadata, dt):
+        """ Reset the finite-difference state to a sample's own state.
+
+            As if a sample `dt` earlier had the same pose and velocity, so
+            processing `metadata` next yields zero angular velocity and
+            acceleration. Used after a gap in the stream, instead of
+            differencing across it.
+
+            Args:
+                metadata: A dictionary containing metadata from the Unity
+                    simulator, as returned by `parse_metadata`.
+                dt: A positive float, time of the fictitious previous
+                    sample before `metadata`.
+        """
+        self.reset(prev_time=metadata['time'] - dt)
+        self.process(metadata)
+        self.prev_time = metadata['time'] - dt
+
+    def process(self, metadata):
+        """ Process one metadata sample and advance the state.
+
+            Args:
+                metadata: A dictionary containing metadata from the Unity
+                    simulator, as returned by `parse_metadata`.
+
+            Returns:
+                A dictionary with the same members as `process_metadata`.
+        """
+        dt = metadata['time'] - self.prev_time
+        assert(dt > 0.0)
+
+        # Pose: enu_T_brh = enu_T_unity * unity_T_blh * blh_T_brh.
+        quaternion_to_rotation_mat(metadata['quaternion'],
+                                   out=self._unity_R_blh)
+        np.dot(self._enu_R_unity, self._unity_R_blh, out=self._enu_R_blh)
+        np.dot(self._enu_R_blh, self._blh_R_brh, out=self.enu_R_brh)
+        self._pos_unity[:] = metadata['position']
+        np.dot(self._enu_R_unity, self._pos_unity, out=self.position)
+        self.enu_T_brh[:3,:3] = self.enu_R_brh
+        self.enu_T_brh[:3,3] = self.position
+        rotation_mat_to_quaternion(self.enu_R_brh, out=self.quaternion)
+
+        # Velocity in the right-handed body frame.
+        self._vel_blh[:] = metadata['velocity']
+        np.dot(self._brh_R_blh, self._vel_blh, out=self.vel_brh)
+
+        # Angular velocity from the logmap of the relative rotation.
+        np.dot(self.prev_enu_R_brh.T, self.enu_R_brh, out=self._rel_R)
+        so3_logmap(self._rel_R, out=self.ang_vel_brh)
+        self.ang_vel_brh /= dt
+
+        # Acceleration by finite difference of ENU velocities.
+        np.dot(self.enu_R_brh, self.vel_brh, out=self._vel_enu)
+        np.dot(self.prev_enu_R_brh, self.prev_vel_brh, out=self._acc_enu)
+        np.subtract(self._vel_enu, self._acc_enu, out=self._acc_enu)
+        self._acc_enu /= dt
+        np.dot(self.enu_R_brh.T, self._acc_enu, out=self.acc_brh)
+
+        # Advance the finite-difference state.
+        self.prev_time = metadata['time']
+        self.prev_vel_brh[:] = self.vel_brh
+        self.prev_enu_R_brh[...] = self.enu_R_brh
+
+        processed_dict = self.processed
+        processed_dict['position'] = self.position
+        processed_dict['quaternion'] = self.quaternion
+        processed_dict['velocity'] = self.vel_brh
+        processed_dict['ang_vel'] = self.ang_vel_brh
+        processed_dict['acceleration'] = self.acc_brh
+        processed_dict['time'] = metadata['time']
+        processed_dict['collision_status'] = metadata['collision_status']
+        processed_dict['transform'] = self.enu_T_brh
+
+        return processed_dict
+
+def quaternions_to_rotation_mats(quaternions):
+    """ Vectorized `quaternion_to_rotation_mat`.
+
+        Args:
+            quaternions: An Nx4 array of quaternions in [x,y,z,w] order.
+
+        Returns:
+            An Nx3x3 numpy array of rotation matrices.
+    """
+    q = np.asarray(quaternions, dtype=np.float64)
+    n = np.einsum('ij,ij->i', q, q)
+    valid = n >= _EPS
+    q = q * np.sqrt(2.0 / np.where(valid, n, 1.0))[:,None]
+    x, y, z, w = q[:,0], q[:,1], q[:,2], q[:,3]
+
+    R = np.empty((len(q), 3, 3))
+    R[:,0,0] = 1.0 - (y*y + z*z)
+    R[:,0,1] = x*y - z*w
+    R[:,0,2] = x*z + y*w
+    R[:,1,0] = x*y + z*w
+    R[:,1,1] = 1.0 - (x*x + z*z)
+    R[:,1,2] = y*z - x*w
+    R[:,2,0] = x*z - y*w
+    R[:,2,1] = y*z + x*w
+    R[:,2,2] = 1.0 - (x*x + y*y)
+    R[~valid] = _IDENTITY_3
+    return R
+
+def rotation_mats_to_quaternions(R):
+    """ Vectorized `rotation_mat_to_quaternion`, with the same branches.
+
+        Args:
+            R: An Nx3x3 array of rotation matrices.
+
+        Returns:
+            An Nx4 numpy array of quaternions in [x,y,z,w] order.
+    """
+    R = np.asarray(R, dtype=np.float64)
+    N = len(R)
+    t = np.trace(R, axis1=1, axis2=2) + 1.0
+    q = np.empty((N, 4))
+
+    # Branch for t > 1.
+    q[:,3] = t
+    q[:,2] = R[:,1,0] - R[:,0,1]
+    q[:,1] = R[:,0,2] - R[:,2,0]
+    q[:,0] = R[:,2,1] - R[:,1,2]
+
+    # Branch for t <= 1, pivoting on the largest diagonal element.
+    other = np.nonzero(t <= 1.0)[0]
+    if len(other):
+        M = R[other]
+        m = np.arange(len(other))
+        i = np.where(M[:,1,1] > M[:,0,0], 1, 0)
+        i = np.where(M[:,2,2] > M[m,i,i], 2, i)
+        j = (i + 1) % 3
+        k = (i + 2) % 3
+        t_other = M[m,i,i] - (M[m,j,j] + M[m,k,k]) + 1.0
+        q_other = np.empty((len(other), 4))
+        q_other[m,i] = t_other
+        q_other[m,j] = M[m,i,j] + M[m,j,i]
+        q_other[m,k] = M[m,k,i] + M[m,i,k]
+        q_other[:,3] = M[m,k,j] - M[m,j,k]
+        q[other] = q_other
+        t[other] = t_other
+
+    q *= (0.5 / np.sqrt(t))[:,None]
+    return q
+
+def so3_logmaps(R):
+    """ Vectorized `so3_logmap`.
+
+        Args:
+            R: An Nx3x3 array of rotation matrices.
+
+        Returns:
+            An Nx3 numpy array of rotation vectors.
+    """
+    q = rotation_mats_to_quaternions(R)
+    q[q[:,3] < 0.0] *= -1.0
+    q /= np.sqrt(np.einsum('ij,ij->i', q, q))[:,None]
+
+    norm_v = np.sqrt(np.einsum('ij,ij->i', q[:,:3], q[:,:3]))
+    angle = 2.0 * np.arctan2(norm_v, q[:,3])
+    small = angle <= 1e-3
+    angle2 = angle * angle
+    scale = np.where(small,
+                     2.0 + angle2 / 12.0 + 7.0 * angle2 * angle2 / 2880.0,
+                     angle / np.where(small, 1.0, np.sin(angle / 2.0)))
+    return scale[:,None] * q[:,:3]
+
+def stack_metadata(metadata_list):
+    """ Stack a sequence of metadata dictionaries into column arrays.
+
+        Args:
+            metadata_list: A sequence of dictionaries as returned by
+                `parse_metadata`.
+
+        Returns:
+            A tuple of numpy arrays (times, positions, quaternions,
+            velocities) with shapes N, Nx3, Nx4 and Nx3, ready for
+            `process_metadata_batch`.
+    """
+    times       = np.array([m['time'] for m in metadata_list])
+    positions   = np.array([m['position'] for m in metadata_list])
+    quaternions = np.array([m['quaternion'] for m in metadata_list])
+    velocities  = np.array([m['velocity'] for m in metadata_list])
+    return times, positions, quaternions, velocities
+
+def process_metadata_batch(times, positions, quaternions, velocities,
+                           prev_time=0.0, prev_vel_brh=None,
+                           prev_enu_R_brh=None):
+    """ Vectorized `process_metadata` over a whole sequence of samples.
+
+        Sample i is differenced against sample i-1, and the first sample
+        against the given previous state, exactly as a `MetadataProcessor`
+        fed the same samples in order (and reset to that state) would do.
+
+        Args:
+            times: An array of N strictly increasing simulator times.
+            positions: An Nx3 array of Unity positions.
+            quaternions: An Nx4 array of Unity quaternions in [x,y,z,w].
+            velocities: An Nx3 array of velocities in the left-handed body
+                frame.
+            prev_time: A float, time of the sample before the first one.
+            prev_vel_brh: An optional 3-vector, velocity in the
+                body-right-handed frame before the first sample.
+                Defaults to zero.
+            prev_enu_R_brh: An optional 3x3 rotation matrix, body-to-ENU
+                rotation before the first sample. Defaults to identity.
+
+        Returns:
+            A dictionary of arrays with a leading dimension of N:
+            'time', 'position' (Nx3), 'quaternion' (Nx4), 'velocity',
+            'ang_vel', 'acceleration' (Nx3), 'transform' (Nx4x4) as in
+            `process_metadata`, plus 'imu_acceleration' (Nx3), the
+            gravity-compensated linear acceleration that `metadata_to_imu`
+            would publish.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    N = len(times)
+    prev_vel_brh = np.zeros(3) if prev_vel_brh is None \
+        else np.asarray(prev_vel_brh, dtype=np.float64)
+    prev_enu_R_brh = _IDENTITY_3 if prev_enu_R_brh is None \
+        else np.asarray(prev_enu_R_brh, dtype=np.float64)
+
+    assert(N > 0)
+    dt = times - np.concatenate(([prev_time], times[:-1]))
+    assert(np.all(dt > 0.0))
+
+    enu_R_unity = enu_T_unity[:3,:3].astype(np.float64)
+    blh_R_brh = blh_T_brh[:3,:3].astype(np.float64)
+    brh_R_blh = brh_T_blh[:3,:3].astype(np.float64)
+
+    # Poses.
+    unity_R_blh = quaternions_to_rotation_mats(quaternions)
+    enu_R_brh = np.matmul(np.matmul(enu_R_unity, unity_R_blh), blh_R_brh)
+    enu_t_brh = np.asarray(positions, dtype=np.float64).dot(enu_R_unity.T)
+    enu_T_brh = np.zeros((N, 4, 4))
+    enu_T_brh[:,:3,:3] = enu_R_brh
+    enu_T_brh[:,:3,3] = enu_t_brh
+    enu_T_brh[:,3,3] = 1.0
+
+    # Previous rotations and velocities, shifted by one sample.
+    prev_R = np.concatenate((prev_enu_R_brh[None], enu_R_brh[:-1]))
+    vel_brh = np.asarray(velocities, dtype=np.float64).dot(brh_R_blh.T)
+    prev_vel = np.concatenate((prev_vel_brh[None], vel_brh[:-1]))
+
+    # Angular velocity from the logmap of relative rotations.
+    rel_R = np.matmul(np.transpose(prev_R, (0, 2, 1)), enu_R_brh)
+    ang_vel_brh = so3_logmaps(rel_R) / dt[:,None]
+
+    # Acceleration by finite difference of ENU velocities.
+    vel_enu = np.einsum('nij,nj->ni', enu_R_brh, vel_brh)
+    prev_vel_enu = np.einsum('nij,nj->ni', prev_R, prev_vel)
+    acc_enu = (vel_enu - prev_vel_enu) / dt[:,None]
+    acc_brh = np.einsum('nji,nj->ni', enu_R_brh, acc_enu)
+
+    # Gravity in the body frame, as in `metadata_to_imu`.
+    g_brh = np.einsum('nji,j->ni', enu_R_brh, np.asarray(gravity_enu))
+
+    processed_dict = {}
+    processed_dict['position'] = enu_t_brh
+    processed_dict['quaternion'] = rotation_mats_to_quaternions(enu_R_brh)
+    processed_dict['velocity'] = vel_brh
+    processed_dict['ang_vel'] = ang_vel_brh
+    processed_dict['acceleration'] = acc_brh
+    processed_dict['imu_acceleration'] = acc_brh - g_brh
+    processed_dict['time'] = times
+    processed_dict['transform'] = enu_T_brh
+
+    return processed_dict
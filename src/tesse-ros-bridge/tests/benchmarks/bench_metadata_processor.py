@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+""" Benchmark `MetadataProcessor` against `process_metadata`.
+
+    Runs both over the same sequence of synthetic metadata, checks that they
+    agree, and reports the per-sample cost and the share of the IMU period
+    it takes at several IMU rates.
+
+    Usage:
+        python bench_metadata_processor.py [--samples N] [--repeat R]
+"""
+
+import argparse
+import timeit
+
+import numpy as np
+
+import tesse_ros_bridge.utils
+from tesse_ros_bridge.trajectory import CircleTrajectory
+
+IMU_RATES = [200.0, 500.0, 1000.0, 2000.0]
+
+
+def run_functional(sequence):
+    """ Process a sequence with `process_metadata`, threading the state. """
+    prev_time, prev_vel_brh, prev_enu_R_brh = 0.0, [0.0, 0.0, 0.0], \
+        np.identity(3)
+    for metadata in sequence:
+        processed = tesse_ros_bridge.utils.process_metadata(metadata,
+            prev_time, prev_vel_brh, prev_enu_R_brh)
+        prev_time = processed['time']
+        prev_vel_brh = processed['velocity']
+        prev_enu_R_brh = processed['transform'][:3,:3]
+
+
+def run_processor(sequence):
+    """ Process a sequence with a fresh `MetadataProcessor`. """
+    processor = tesse_ros_bridge.utils.MetadataProcessor()
+    for metadata in sequence:
+        processor.process(metadata)
+
+
+def check_agreement(sequence):
+    """ Assert that both implementations give the same results. """
+    processor = tesse_ros_bridge.utils.MetadataProcessor()
+    prev_time, prev_vel_brh, prev_enu_R_brh = 0.0, [0.0, 0.0, 0.0], \
+        np.identity(3)
+    for metadata in sequence:
+        expected = tesse_ros_bridge.utils.process_metadata(metadata,
+            prev_time, prev_vel_brh, prev_enu_R_brh)
+        actual = processor.process(metadata)
+        for key in ['position', 'quaternion', 'velocity', 'ang_vel',
+                    'acceleration', 'transform']:
+            assert(np.allclose(expected[key], actual[key], atol=1e-9))
+        prev_time = expected['time']
+        prev_vel_brh = expected['velocity']
+        prev_enu_R_brh = expected['transform'][:3,:3]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--samples', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    # Start after t=0: the first sample is differenced against t=0.
+    sequence = CircleTrajectory().metadata_sequence(args.samples, 200.0,
+                                                    start_time=1.0)
+    check_agreement(sequence)
+
+    print("%d samples, best of %d" % (args.samples, args.repeat))
+    print("%-20s %10s  %s" % ('', 'us/sample', '  '.join(
+        '%6d Hz' % rate for rate in IMU_RATES)))
+    for name, run in [('process_metadata', run_functional),
+                      ('MetadataProcessor', run_processor)]:
+        best = min(timeit.repeat(lambda: run(sequence), number=1,
+                                 repeat=args.repeat))
+        per_sample = best / len(sequence)
+        print("%-20s %10.2f  %s" % (name, per_sample * 1e6, '  '.join(
+            '%8.2f%%' % (per_sample * rate * 100.0) for rate in IMU_RATES)))
+
+
+if __name__ == '__main__':
+    main()
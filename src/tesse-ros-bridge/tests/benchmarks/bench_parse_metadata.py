@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+""" Benchmark the schema-compiled metadata parser against ElementTree.
+
+    Parses every `tests/data/metadata_*.xml` sample, exactly as Unity sends
+    it over UDP, with both `parse_metadata` and `parse_metadata_etree` and
+    reports the cost per packet and the share of the IMU period it takes.
+
+    Usage:
+        python bench_parse_metadata.py [--iterations N] [--imu-rate HZ]
+"""
+
+import argparse
+import glob
+import os
+import timeit
+
+import tesse_ros_bridge.utils
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir, 'data')
+
+
+def load_corpus():
+    """ Read the raw metadata samples as bytestrings. """
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(DATA_DIR, 'metadata_*.xml'))):
+        with open(path, 'rb') as f:
+            corpus.append(f.read())
+    return corpus
+
+
+def time_parser(parser, corpus, iterations):
+    """ Return the mean time in seconds to parse one packet. """
+    def run():
+        for data in corpus:
+            parser(data)
+
+    best = min(timeit.repeat(run, number=iterations, repeat=5))
+    return best / (iterations * len(corpus))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    arg_parser.add_argument('--iterations', type=int, default=2000)
+    arg_parser.add_argument('--imu-rate', type=float, default=200.0)
+    args = arg_parser.parse_args()
+
+    corpus = load_corpus()
+    assert(len(corpus) > 0)
+
+    # Both parsers must agree before their speed means anything.
+    for data in corpus:
+        assert(tesse_ros_bridge.utils.parse_metadata(data) ==
+               tesse_ros_bridge.utils.parse_metadata_etree(data))
+
+    results = [
+        ('parse_metadata_etree', tesse_ros_bridge.utils.parse_metadata_etree),
+        ('parse_metadata', tesse_ros_bridge.utils.parse_metadata),
+    ]
+
+    print("%d samples x %d iterations, IMU period %.3f ms" %
+          (len(corpus), args.iterations, 1e3 / args.imu_rate))
+    baseline = None
+    for name, parser in results:
+        per_packet = time_parser(parser, corpus, args.iterations)
+        baseline = baseline or per_packet
+        print("%-22s %8.2f us/packet  %5.2f%% of IMU period  %5.2fx" %
+              (name, per_packet * 1e6, per_packet * args.imu_rate * 100.0,
+               baseline / per_packet))
+
+
+if __name__ == '__main__':
+    main()
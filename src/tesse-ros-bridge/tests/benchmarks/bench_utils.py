@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+
+""" Micro-benchmarks of the `tesse_ros_bridge.utils` hot path.
+
+    Times the per-sample and per-camera functions of `utils.py` over a
+    generated corpus of metadata from several kinds of motion, and reports
+    ns/op and, under Python 3, the bytes allocated per op (the tracemalloc
+    high-water mark of a single call, averaged over the corpus).
+
+    Results can be saved as a JSON baseline; a later run compared against it
+    exits with status 1 if any benchmark got slower or allocates more than
+    the tolerance allows. Baselines are only comparable on the same machine
+    and Python version.
+
+    Usage:
+        python bench_utils.py [--samples N] [--repeat R] [--filter NAME]
+        python bench_utils.py --save baseline.json
+        python bench_utils.py --compare baseline.json [--tolerance 0.2]
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+
+import numpy as np
+import rospy
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # Python 2: timing only.
+
+import tesse_ros_bridge.utils
+from tesse_ros_bridge.trajectory import CircleTrajectory
+from tesse_ros_bridge.mock_simulator import CAMERA_INFO_XML
+
+# Kinds of motion in the corpus: walking, a fast and bumpy drone, and slow
+# turning almost in place.
+MOTIONS = [
+    dict(radius=5.0, speed=1.5, bob_amplitude=0.05, bob_frequency=1.8,
+         speed_variation=0.3),
+    dict(radius=20.0, speed=8.0, bob_amplitude=0.3, bob_frequency=4.0,
+         speed_variation=0.5),
+    dict(radius=0.5, speed=0.3, bob_amplitude=0.01, bob_frequency=0.5,
+         speed_variation=0.1),
+]
+
+# Camera resolutions and vertical fields of view in the corpus, chosen so
+# that `generate_camera_info` finds exactly square pixels.
+CAMERAS = [(720, 480, 60.0), (1280, 720, 90.0), (640, 480, 45.0),
+           (1920, 1080, 37.84929), (752, 480, 75.0)]
+
+IMU_RATE = 200.0
+
+
+class Corpus(object):
+    """ Inputs of every benchmark, generated once. """
+
+    def __init__(self, n_samples):
+        self.metadata = []
+        start_time = 1.0
+        per_motion = n_samples // len(MOTIONS)
+        for motion in MOTIONS:
+            self.metadata += CircleTrajectory(**motion).metadata_sequence(
+                per_motion, IMU_RATE, start_time=start_time)
+            start_time += per_motion / IMU_RATE
+        self.metadata_xml = [tesse_ros_bridge.utils.encode_metadata_xml(
+            metadata).decode('ascii') for metadata in self.metadata]
+        # Packets as `udp_cb` receives them, in both wire encodings.
+        self.packets_xml = [tesse_ros_bridge.utils.encode_metadata_xml(
+            metadata) for metadata in self.metadata]
+        self.packets_binary = [tesse_ros_bridge.utils.encode_metadata_binary(
+            metadata) for metadata in self.metadata]
+
+        # Processed metadata, copied out of the processor's buffers.
+        processor = tesse_ros_bridge.utils.MetadataProcessor()
+        self.processed = []
+        for metadata in self.metadata:
+            processed = processor.process(metadata)
+            self.processed.append(dict((key, np.copy(value))
+                                       for key, value in processed.items()))
+        self.transforms = [processed['transform']
+                           for processed in self.processed]
+        self.timestamps = [rospy.Time.from_sec(metadata['time'])
+                           for metadata in self.metadata]
+
+        self.cam_xml = []
+        for width, height, fov in CAMERAS:
+            for camera_id, x in [(0, -0.1), (1, 0.1)]:
+                self.cam_xml.append(CAMERA_INFO_XML % {
+                    'name': 'rgb', 'id': camera_id, 'height': height,
+                    'width': width, 'fov': fov, 'x': x, 'y': 0.0, 'z': 0.0,
+                    'qx': 0.0, 'qy': 0.0, 'qz': 0.0, 'qw': 1.0,
+                    'near': 0.05, 'far': 50.0})
+        self.cam_data = [tesse_ros_bridge.utils.parse_cam_data(xml)
+                         for xml in self.cam_xml]
+        self.cam_pairs = list(zip(self.cam_data[0::2], self.cam_data[1::2]))
+
+
+def process_metadata_chain(corpus):
+    """ `process_metadata` threading its finite-difference state, which
+        restarts whenever the corpus does.
+    """
+    state = [0.0, [0.0, 0.0, 0.0], np.identity(3)]
+
+    def op(metadata):
+        if metadata['time'] <= state[0]:
+            state[:] = [0.0, [0.0, 0.0, 0.0], np.identity(3)]
+        processed = tesse_ros_bridge.utils.process_metadata(metadata, *state)
+        state[0] = processed['time']
+        state[1] = processed['velocity']
+        state[2] = processed['transform'][:3,:3]
+    return op, corpus.metadata
+
+
+def metadata_processor_chain(corpus):
+    """ `MetadataProcessor.process`, as run by the node, reset whenever the
+        corpus restarts.
+    """
+    processor = tesse_ros_bridge.utils.MetadataProcessor()
+
+    def op(metadata):
+        if metadata['time'] <= processor.prev_time:
+            processor.reset()
+        processor.process(metadata)
+    return op, corpus.metadata
+
+
+def quiet(op):
+    """ Wrap an op to send what it prints to /dev/null. """
+    devnull = open(os.devnull, 'w')
+
+    def quiet_op(item):
+        stdout = sys.stdout
+        sys.stdout = devnull
+        try:
+            op(item)
+        finally:
+            sys.stdout = stdout
+    return quiet_op
+
+
+def benchmarks(corpus):
+    """ The benchmarks, as (name, function, inputs) tuples. """
+    utils = tesse_ros_bridge.utils
+    process_op, process_inputs = process_metadata_chain(corpus)
+    processor_op, processor_inputs = metadata_processor_chain(corpus)
+    return [
+        ('parse_metadata', utils.parse_metadata, corpus.metadata_xml),
+        ('decode_metadata_xml', utils.decode_metadata, corpus.packets_xml),
+        ('decode_metadata_binary', utils.decode_metadata,
+            corpus.packets_binary),
+        ('parse_cam_data', utils.parse_cam_data, corpus.cam_xml),
+        ('process_metadata', process_op, process_inputs),
+        ('MetadataProcessor', processor_op, processor_inputs),
+        ('metadata_to_imu', lambda args: utils.metadata_to_imu(
+            args[0], args[1], 'base_link_gt'),
+            list(zip(corpus.processed, corpus.timestamps))),
+        ('metadata_to_odom', lambda args: utils.metadata_to_odom(
+            args[0], args[1], 'world', 'base_link_gt'),
+            list(zip(corpus.processed, corpus.timestamps))),
+        ('get_quaternion', utils.get_quaternion, corpus.transforms),
+        ('generate_camera_info', quiet(lambda pair:
+            utils.generate_camera_info(*pair)), corpus.cam_pairs),
+    ]
+
+
+def time_op(op, inputs, repeat):
+    """ Best-of-`repeat` time of one call, in nanoseconds. """
+    # Repeat short input lists so that each timing spans enough calls.
+    number = max(1, 1000 // len(inputs))
+
+    def run():
+        for item in inputs:
+            op(item)
+
+    best = min(timeit.repeat(run, number=number, repeat=repeat))
+    return best / (number * len(inputs)) * 1e9
+
+
+def measure_allocations(op, inputs, max_calls=200):
+    """ Mean tracemalloc high-water mark of one call, in bytes. """
+    if tracemalloc is None:
+        return None
+    step = max(1, len(inputs) // max_calls)
+    sample = inputs[::step]
+
+    tracemalloc.start()
+    total = 0
+    for item in sample:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        op(item)
+        total += tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return float(total) / len(sample)
+
+
+def run_benchmarks(corpus, repeat, name_filter=None):
+    """ Run the benchmarks and return their results by name. """
+    results = {}
+    for name, op, inputs in benchmarks(corpus):
+        if name_filter and name_filter not in name:
+            continue
+        results[name] = {'ns_per_op': time_op(op, inputs, repeat)}
+        results[name]['alloc_bytes_per_op'] = measure_allocations(op, inputs)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """ Print the change against a baseline and list the regressions. """
+    regressions = []
+    print("%-22s %12s %12s %8s" % ('vs. baseline', 'ns/op', 'B/op', 'change'))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        result = results[name]
+        change = result['ns_per_op'] / base['ns_per_op'] - 1.0
+        alloc = result['alloc_bytes_per_op']
+        base_alloc = base.get('alloc_bytes_per_op')
+        print("%-22s %12.0f %12s %+7.1f%%" % (name, base['ns_per_op'],
+            '-' if base_alloc is None else '%.0f' % base_alloc,
+            change * 100.0))
+        if change > tolerance:
+            regressions.append("%s: %.0f ns/op, baseline %.0f" %
+                               (name, result['ns_per_op'], base['ns_per_op']))
+        # Small allocation changes are noise from interpreter caches.
+        if alloc is not None and base_alloc is not None and \
+                alloc > base_alloc * (1.0 + tolerance) + 256:
+            regressions.append("%s: %.0f B/op, baseline %.0f" %
+                               (name, alloc, base_alloc))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--samples', type=int, default=3000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--filter', default=None,
+                        help='only run benchmarks whose name contains this')
+    parser.add_argument('--save', metavar='JSON',
+                        help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='JSON',
+                        help='compare against a baseline; exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative slowdown, default 0.2')
+    args = parser.parse_args()
+
+    corpus = Corpus(args.samples)
+    results = run_benchmarks(corpus, args.repeat, args.filter)
+
+    print("%d metadata samples, %d camera pairs, best of %d" %
+          (len(corpus.metadata), len(corpus.cam_pairs), args.repeat))
+    print("%-22s %12s %12s" % ('', 'ns/op', 'B/op'))
+    for name in sorted(results):
+        alloc = results[name]['alloc_bytes_per_op']
+        print("%-22s %12.0f %12s" % (name, results[name]['ns_per_op'],
+            '-' if alloc is None else '%.0f' % alloc))
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump({'python': platform.python_version(),
+                       'machine': platform.node(),
+                       'samples': len(corpus.metadata),
+                       'results': results}, baseline_file, indent=2,
+                      sort_keys=True)
+        print("Saved baseline to %s" % args.save)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print("Regressions beyond %.0f%%:" % (args.tolerance * 100.0))
+            for regression in regressions:
+                print("  " + regression)
+            sys.exit(1)
+        print("No regressions beyond %.0f%%" % (args.tolerance * 100.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from tesse_ros_bridge.camera_info_cache import CameraInfoCache, \
+     camera_info_key
+
+class TestCameraInfoCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache', 'camera_info.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_key(self):
+        """Test that keys tell apart every camera parameter."""
+        key = camera_info_key(0, 640, 480, 60, 0.05, 50.0, [-0.05, 0, 0],
+                              [0, 0, 0, 1])
+        self.assertEqual(key, camera_info_key(0, 640, 480, 60.0, 0.05, 50,
+                                              (-0.05, 0.0, 0.0),
+                                              (0.0, 0.0, 0.0, 1.0)))
+        self.assertNotEqual(key, camera_info_key(0, 640, 480, 60, 0.05, 50.0,
+                                                 [0.05, 0, 0], [0, 0, 0, 1]))
+        self.assertNotEqual(key, camera_info_key(1, 640, 480, 60, 0.05, 50.0,
+                                                 [-0.05, 0, 0], [0, 0, 0, 1]))
+
+    def test_persist(self):
+        """Test that entries survive a reload, and only changes are saved."""
+        cache = CameraInfoCache(self.path)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', '<xml a/>')
+        cache.save()
+
+        cache = CameraInfoCache(self.path)
+        self.assertEqual(cache.get('a'), '<xml a/>')
+        cache.put('a', '<xml a/>')
+        self.assertFalse(cache.dirty)
+        cache.save()
+        self.assertEqual(os.listdir(os.path.dirname(self.path)),
+                         ['camera_info.json'])
+
+    def test_corrupt_file(self):
+        """Test that an unreadable file is treated as an empty cache."""
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as cache_file:
+            cache_file.write('{"a": ')
+        cache = CameraInfoCache(self.path)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', '<xml a/>')
+        cache.save()
+        self.assertEqual(CameraInfoCache(self.path).get('a'), '<xml a/>')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+import unittest
+
+from tesse_ros_bridge.camera_scheduler import CameraScheduler
+
+class TestCameraScheduler(unittest.TestCase):
+
+    def test_rates(self):
+        """Test that each camera is due at its own rate."""
+        scheduler = CameraScheduler([60.0, 60.0, 10.0, 5.0], 60.0)
+        counts = [0, 0, 0, 0]
+        for _ in range(600):
+            for i in scheduler.tick():
+                counts[i] += 1
+        self.assertEqual(counts, [600, 600, 100, 50])
+
+    def test_first_tick(self):
+        """Test that every camera is due on the first tick."""
+        scheduler = CameraScheduler([30.0, 7.0], 30.0)
+        self.assertEqual(scheduler.tick(), [0, 1])
+        self.assertEqual(scheduler.tick(), [0])
+
+    def test_non_divisor_rate(self):
+        """Test a rate that does not divide the base rate."""
+        scheduler = CameraScheduler([20.0, 7.0], 20.0)
+        due_ticks = [t for t in range(200) if 1 in scheduler.tick()]
+        self.assertEqual(len(due_ticks), 70)
+        # Spacing is always within one tick of the ideal 20 / 7 ticks.
+        gaps = [b - a for a, b in zip(due_ticks, due_ticks[1:])]
+        self.assertEqual(set(gaps), set([2, 3]))
+
+    def test_requeue(self):
+        """Test that a requeued camera is retried on the next tick, and
+        keeps its schedule."""
+        scheduler = CameraScheduler([30.0, 10.0], 30.0)
+        self.assertEqual(scheduler.tick(), [0, 1])
+        scheduler.requeue([0, 1])
+        self.assertEqual(scheduler.tick(), [0, 1])
+        self.assertEqual(scheduler.tick(), [0])
+        self.assertEqual(scheduler.tick(), [0, 1])
+
+    def test_invalid_rate(self):
+        """Test that rates above the base rate are rejected."""
+        with self.assertRaises(AssertionError):
+            CameraScheduler([30.0], 20.0)
+
+if __name__ == '__main__':
+    unittest.main()
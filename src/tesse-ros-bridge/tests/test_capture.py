@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from tesse_ros_bridge.capture import CaptureWriter, CapturedResponse, \
+     Replayer, read_capture, read_camera_info, CAPTURE_METADATA, \
+     CAPTURE_FRAME, CAPTURE_CAMERA_INFO
+
+class FakeClock(object):
+    """ Wall clock that only advances when slept on or by handlers. """
+
+    def __init__(self):
+        self.now = 100.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'capture.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        """Test that captured records read back unchanged and in order."""
+        rng = np.random.RandomState(0)
+        left = rng.randint(0, 256, (6, 8, 3)).astype(np.uint8)
+        depth = rng.rand(6, 8).astype(np.float32)
+
+        writer = CaptureWriter(self.path)
+        writer.write_camera_info(0, "<camera_info/>", arrival=1.0)
+        writer.write_metadata(b"<TESSE_Agent_Metadata_v0.5/>", arrival=2.0)
+        writer.write_frame([0, 3], CapturedResponse([left, depth], "<meta/>"),
+                           arrival=3.0)
+        writer.write_frame([1], CapturedResponse([b'\xff\xd8jpeg'], "<m/>"),
+                           arrival=4.0)
+        writer.close()
+
+        records = list(read_capture(self.path))
+        self.assertEqual([(kind, arrival) for kind, arrival, _ in records],
+            [(CAPTURE_CAMERA_INFO, 1.0), (CAPTURE_METADATA, 2.0),
+             (CAPTURE_FRAME, 3.0), (CAPTURE_FRAME, 4.0)])
+        self.assertEqual(records[0][2], (0, "<camera_info/>"))
+        self.assertEqual(records[1][2], b"<TESSE_Agent_Metadata_v0.5/>")
+
+        cameras, response = records[2][2]
+        self.assertEqual(cameras, [0, 3])
+        self.assertEqual(response.metadata, "<meta/>")
+        self.assertTrue(np.array_equal(response.images[0], left))
+        self.assertTrue(np.array_equal(response.images[1], depth))
+        self.assertEqual(response.images[1].dtype, np.float32)
+        self.assertEqual(records[3][2][1].images, [b'\xff\xd8jpeg'])
+
+        self.assertEqual(read_camera_info(self.path), {0: "<camera_info/>"})
+
+    def test_write_after_close(self):
+        """Test that records written after closing are dropped and counted."""
+        writer = CaptureWriter(self.path, queue_size=1)
+        for i in range(5):
+            writer.write_metadata(b"packet", arrival=float(i))
+        writer.close()
+        writer.write_metadata(b"late", arrival=5.0)
+        writer.close()
+
+        stats = writer.stats()
+        self.assertEqual((stats['records'], stats['dropped'],
+                          stats['write_errors'], stats['queued']), (5, 1, 0, 0))
+        self.assertEqual([data for _, _, data in read_capture(self.path)],
+                         [b"packet"] * 5)
+
+    def test_replay_timing(self):
+        """Test replay at scaled speed and as fast as possible."""
+        records = [(CAPTURE_METADATA, 10.0 + 0.1 * i, i) for i in range(11)]
+        records.append((CAPTURE_CAMERA_INFO, 11.0, None))
+
+        for speed, wall_time in [(1.0, 1.0), (2.0, 0.5), (0.0, 0.0)]:
+            clock = FakeClock()
+            handled = []
+            replayer = Replayer({CAPTURE_METADATA: handled.append},
+                                speed=speed, wall_clock=clock.time,
+                                sleep=clock.sleep)
+            stats = replayer.run(records)
+
+            self.assertEqual(handled, list(range(11)))
+            self.assertAlmostEqual(stats['wall_time'], wall_time)
+            self.assertAlmostEqual(stats['capture_time'], 1.0)
+            self.assertEqual(stats['stages'][CAPTURE_METADATA]['count'], 11)
+
+    def test_replay_errors(self):
+        """Test that handler errors are counted and replay continues."""
+        def handler(value):
+            if value == 1:
+                raise ValueError("bad record")
+
+        replayer = Replayer({CAPTURE_METADATA: handler}, speed=0.0)
+        stats = replayer.run([(CAPTURE_METADATA, 0.0, i) for i in range(3)])
+        self.assertEqual(stats['stages'][CAPTURE_METADATA]['count'], 3)
+        self.assertEqual(stats['stages'][CAPTURE_METADATA]['errors'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
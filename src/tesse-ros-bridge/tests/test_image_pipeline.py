@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+import threading
+import time
+import unittest
+
+from tesse_ros_bridge.image_pipeline import ImagePipeline
+
+class TestImagePipeline(unittest.TestCase):
+
+    def wait_for(self, condition, timeout=2.0):
+        start = time.time()
+        while not condition() and time.time() - start < timeout:
+            time.sleep(0.001)
+        self.assertTrue(condition())
+
+    def test_in_order(self):
+        """Test that frames are published in order, skips counted."""
+        frames = iter(range(10))
+        published = []
+
+        def fetch():
+            return next(frames, None)
+
+        def publish(frame):
+            if frame == 3:
+                return False
+            published.append(frame)
+
+        pipeline = ImagePipeline(fetch, publish, queue_size=10)
+        pipeline.start()
+        self.wait_for(lambda: pipeline.stats()['skipped'] +
+                              pipeline.stats()['published'] == 10)
+        pipeline.stop()
+
+        self.assertEqual(published, [0, 1, 2, 4, 5, 6, 7, 8, 9])
+        stats = pipeline.stats()
+        self.assertEqual(stats['fetched'], 10)
+        self.assertEqual(stats['published'], 9)
+        self.assertEqual(stats['skipped'], 1)
+        self.assertEqual(stats['dropped'], 0)
+
+    def test_drop_oldest(self):
+        """Test that a slow consumer drops the oldest queued frames."""
+        frames = iter(range(20))
+        published = []
+        dropped = []
+        gate = threading.Event()
+
+        def publish(frame):
+            gate.wait()
+            published.append(frame)
+
+        pipeline = ImagePipeline(lambda: next(frames, None), publish,
+                                 queue_size=2, on_drop=dropped.append)
+        pipeline.start()
+        self.wait_for(lambda: pipeline.stats()['fetched'] == 20)
+        gate.set()
+        self.wait_for(lambda: pipeline.stats()['queued'] == 0 and
+                              pipeline.stats()['published'] ==
+                              20 - pipeline.stats()['dropped'])
+        pipeline.stop()
+
+        stats = pipeline.stats()
+        self.assertGreater(stats['dropped'], 0)
+        self.assertEqual(len(dropped), stats['dropped'])
+        self.assertEqual(sorted(published + dropped), list(range(20)))
+        self.assertEqual(published[-2:], [18, 19])
+        self.assertEqual(published, sorted(published))
+
+    def test_errors(self):
+        """Test that fetch and publish errors are counted, not raised."""
+        calls = [0]
+
+        def fetch():
+            calls[0] += 1
+            if calls[0] == 1:
+                raise IOError("no response")
+            return calls[0] if calls[0] <= 3 else None
+
+        def publish(frame):
+            raise ValueError("bad frame")
+
+        pipeline = ImagePipeline(fetch, publish)
+        pipeline.start()
+        self.wait_for(lambda: pipeline.stats()['publish_errors'] == 2)
+        pipeline.stop()
+        self.assertEqual(pipeline.stats()['fetch_errors'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+import unittest
+
+from tesse_ros_bridge.imu_monitor import ImuMonitor
+
+class TestImuMonitor(unittest.TestCase):
+
+    def test_regular_stream(self):
+        """Test a steady stream published with a constant delay."""
+        monitor = ImuMonitor(rate=200.0, speedup_factor=2.0)
+        for i in range(100):
+            monitor.add(0.005 * i, 50.0 + 0.0025 * i + 0.001)
+
+        stats = monitor.stats()
+        self.assertEqual(stats['samples'], 100)
+        self.assertEqual(stats['gaps'], 0)
+        self.assertAlmostEqual(stats['sim_period']['mean'], 0.005)
+        self.assertAlmostEqual(stats['wall_period']['mean'], 0.0025)
+        self.assertAlmostEqual(stats['rate'], 400.0)
+        self.assertAlmostEqual(stats['delay']['max'], 0.0)
+        self.assertAlmostEqual(stats['jitter'], 0.0)
+        self.assertFalse(stats['jitter_exceeded'])
+
+    def test_irregular_stream(self):
+        """Test counting gaps, and flagging a stream that falls behind in
+        bursts."""
+        monitor = ImuMonitor(rate=100.0, window=10, jitter_threshold=0.001)
+        sim_times = [0.01, 0.02, 0.05, 0.06, 0.07, 0.08, 0.09]
+        for i, sim_time in enumerate(sim_times):
+            # Published in bursts of two, 20 ms apart.
+            monitor.add(sim_time, 1.0 + 0.02 * (i // 2))
+
+        stats = monitor.stats()
+        self.assertEqual(stats['gaps'], 1)
+        self.assertEqual(stats['missing'], 2)
+        self.assertAlmostEqual(stats['sim_period']['max'], 0.03)
+        self.assertAlmostEqual(stats['delay']['max'], 0.03)
+        self.assertTrue(stats['jitter_exceeded'])
+
+        # Only the last `window` samples remain in the statistics.
+        for i in range(10):
+            monitor.add(0.10 + 0.01 * i, 2.0 + 0.01 * i)
+        stats = monitor.stats()
+        self.assertEqual(stats['samples'], 17)
+        self.assertAlmostEqual(stats['sim_period']['max'], 0.01)
+        self.assertFalse(stats['jitter_exceeded'])
+
+
+if __name__ == '__main__':
+    unittest.main()
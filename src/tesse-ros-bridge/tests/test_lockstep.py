@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+import threading
+import unittest
+
+from tesse_ros_bridge.lockstep import LockstepDriver
+
+class FakeSimulator(object):
+    """ Sends the samples of each step from another thread, out of order. """
+
+    def __init__(self, samples_per_step, step_period):
+        self.samples_per_step = samples_per_step
+        self.step_period = step_period
+        self.steps = 0
+        self.driver = None
+
+    def step(self):
+        self.steps += 1
+        start = (self.steps - 1) * self.step_period
+        times = [start + self.step_period * (k + 1) / self.samples_per_step
+                 for k in range(self.samples_per_step)]
+        times.reverse()
+
+        def send():
+            for t in times:
+                self.driver.add_sample(t, {'time': t})
+        threading.Thread(target=send).start()
+
+    def request_frame(self):
+        return self.steps * self.step_period
+
+
+class TestLockstepDriver(unittest.TestCase):
+
+    def test_in_order(self):
+        """Test that each step publishes its samples, then its images."""
+        simulator = FakeSimulator(samples_per_step=10, step_period=0.05)
+        published = []
+        driver = LockstepDriver(simulator.step, simulator.request_frame,
+            lambda sample: published.append(('imu', sample['time'])),
+            lambda frame: published.append(('images', frame)),
+            frame_time=lambda frame: frame, step_period=0.05,
+            samples_per_step=10, time_tolerance=0.001)
+        simulator.driver = driver
+
+        for _ in range(5):
+            self.assertEqual(driver.advance(), 10)
+
+        self.assertEqual(len(published), 55)
+        times = [t for kind, t in published]
+        self.assertEqual(times, sorted(times))
+        for step in range(5):
+            self.assertEqual(published[step * 11 + 10][0], 'images')
+
+        stats = driver.stats()
+        self.assertEqual(stats['steps'], 5)
+        self.assertEqual(stats['samples'], 50)
+        self.assertEqual(stats['missing_samples'], 0)
+        self.assertEqual(stats['frames'], 5)
+        self.assertAlmostEqual(stats['sim_time'], 0.2)
+        self.assertTrue(stats['realtime_factor'] > 0.0)
+
+    def test_missing_samples(self):
+        """Test that a step with lost samples times out and is counted."""
+        driver = LockstepDriver(lambda: None, lambda: 0.2,
+            lambda sample: None, lambda frame: None,
+            frame_time=lambda frame: frame, step_period=0.1,
+            samples_per_step=4, timeout=0.01)
+        driver.add_sample(0.1, None)
+
+        self.assertEqual(driver.advance(), 1)
+        self.assertEqual(driver.advance(), 0)
+
+        stats = driver.stats()
+        self.assertEqual(stats['steps'], 2)
+        self.assertEqual(stats['missing_samples'], 7)
+        self.assertEqual(stats['timeouts'], 2)
+        self.assertEqual(stats['frames'], 2)
+        self.assertEqual(stats['realtime_factor'], 0.0)
+
+    def test_release_by_sim_time(self):
+        """Test that a step ends with its end sample, whatever the count,
+        and that samples of later steps are carried over."""
+        frames = [0.1, 0.2, 0.3]
+        published = []
+        driver = LockstepDriver(lambda: None, lambda: frames.pop(0),
+            lambda sample: published.append(sample), lambda frame: None,
+            frame_time=lambda frame: frame, step_period=0.1,
+            samples_per_step=4, timeout=60.0, time_tolerance=0.001)
+
+        # One sample lost, and one of the next step already arrived.
+        for t in [0.125, 0.05, 0.1, 0.025]:
+            driver.add_sample(t, t)
+        self.assertEqual(driver.advance(), 3)
+        self.assertEqual(published, [0.025, 0.05, 0.1])
+
+        # A late sample of the first step is dropped.
+        for t in [0.2, 0.075, 0.175, 0.15]:
+            driver.add_sample(t, t)
+        self.assertEqual(driver.advance(), 4)
+        self.assertEqual(published[3:], [0.125, 0.15, 0.175, 0.2])
+
+        stats = driver.stats()
+        self.assertEqual(stats['missing_samples'], 1)
+        self.assertEqual(stats['late_samples'], 1)
+        self.assertEqual(stats['timeouts'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
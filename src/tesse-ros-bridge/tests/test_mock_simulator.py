@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+import socket
+import unittest
+import numpy as np
+
+from tesse.env import Env
+from tesse.msgs import Camera, Channels, Compression, DataRequest, \
+     CameraInformationRequest, MetadataRequest, SetCameraParametersRequest, \
+     SetFrameRate, StepWithForce
+
+import tesse_ros_bridge.utils
+from tesse_ros_bridge.mock_simulator import MockSimulator
+
+class TestMockSimulator(unittest.TestCase):
+    """ Drives the mock through tesse-interface, like the bridge does. """
+
+    def setUp(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.settimeout(2.0)
+        self.port = self.socket.getsockname()[1]
+        self.simulator = None
+
+    def tearDown(self):
+        if self.simulator is not None:
+            self.simulator.stop()
+        self.socket.close()
+
+    def start(self, **kwargs):
+        """ Serve a mock on free ports, and connect an Env to it. """
+        self.simulator = MockSimulator(position_port=0, metadata_port=0,
+            image_port=0, step_port=0, udp_port=self.port, **kwargs)
+        self.simulator.start()
+        ports = self.simulator.ports
+        return Env(simulation_ip='127.0.0.1', own_ip='127.0.0.1',
+                   position_port=ports['position'],
+                   metadata_port=ports['metadata'],
+                   image_port=ports['image'], step_port=ports['step'])
+
+    def receive(self, n):
+        return [tesse_ros_bridge.utils.decode_metadata(
+            self.socket.recv(4096)) for _ in range(n)]
+
+    def test_requests(self):
+        """Test camera parameters and information, and synthetic images."""
+        env = self.start(speedup_factor=1e-6)
+        self.assertIsNotNone(env.request(SetCameraParametersRequest(
+            Camera.RGB_RIGHT, 48, 64, 45.0, 0.05, 50.0)))
+        cam_data = tesse_ros_bridge.utils.parse_cam_data(env.request(
+            CameraInformationRequest(Camera.RGB_RIGHT)).metadata)
+        self.assertEqual(cam_data['id'], 1)
+        self.assertEqual(cam_data['parameters'],
+                         {'width': 64, 'height': 48, 'fov': 45.0})
+        self.assertEqual(cam_data['position'], [0.1, 0.0, 0.0])
+
+        for camera in [Camera.RGB_LEFT, Camera.DEPTH]:
+            env.request(SetCameraParametersRequest(camera, 48, 64, 45.0,
+                                                   0.05, 50.0))
+        request = DataRequest(True, [
+            (Camera.RGB_LEFT, Compression.OFF, Channels.SINGLE),
+            (Camera.RGB_RIGHT, Compression.OFF, Channels.THREE),
+            (Camera.DEPTH, Compression.OFF, Channels.THREE)])
+        first = env.request(request)
+        second = env.request(request)
+        left, right, depth = first.images
+        self.assertEqual((left.shape, left.dtype), ((48, 64), np.uint8))
+        self.assertEqual((right.shape, right.dtype), ((48, 64, 3), np.uint8))
+        self.assertEqual((depth.shape, depth.dtype), ((48, 64), np.float32))
+        self.assertTrue(np.all((depth > 0.0) & (depth <= 1.0)))
+        # Images move between frames.
+        self.assertFalse(np.array_equal(left, second.images[0]))
+        self.assertEqual(
+            tesse_ros_bridge.utils.parse_metadata(first.metadata)['time'], 0.0)
+        self.assertEqual(self.simulator.stats()['requests'], 6)
+
+    def test_stream(self):
+        """Test that metadata is streamed as xml, in order at the IMU rate."""
+        self.start(imu_rate=1000.0)
+        packets = [self.socket.recv(4096) for _ in range(50)]
+
+        self.assertTrue(packets[0].startswith(b'<'))
+        times = [tesse_ros_bridge.utils.decode_metadata(packet)['time']
+                 for packet in packets]
+        self.assertTrue(np.allclose(np.diff(times), 0.001))
+        self.assertEqual(times[0], 0.001)
+
+    def test_step_mode(self):
+        """Test that each step sends exactly one frame of metadata."""
+        env = self.start(frame_rate=20.0, imu_rate=200.0,
+                         speedup_factor=1e-6)
+        env.send(SetFrameRate(20))
+        for _ in range(3):
+            env.send(StepWithForce(0, 0, 0))
+        # Answered once the steps before it are done.
+        metadata = tesse_ros_bridge.utils.parse_metadata(
+            env.request(MetadataRequest()).metadata)
+
+        self.assertAlmostEqual(metadata['time'], 0.15)
+        self.assertEqual(self.simulator.stats()['samples'], 30)
+        samples = self.receive(30)
+        self.assertAlmostEqual(samples[-1]['time'], 0.15)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+import unittest
+
+import numpy as np
+
+from tesse_ros_bridge.pose_history import PoseHistory, slerp
+
+def yaw_quaternion(yaw):
+    return [0.0, 0.0, np.sin(yaw / 2.0), np.cos(yaw / 2.0)]
+
+
+class TestPoseHistory(unittest.TestCase):
+
+    def setUp(self):
+        # Moving along x at 1 m/s, turning at 0.5 rad/s.
+        self.history = PoseHistory(capacity=4)
+        for i in range(6):
+            t = 0.1 * i
+            self.history.add(t, [t, 0.0, 0.0], yaw_quaternion(0.5 * t),
+                             [1.0, 0.0, 0.0])
+
+    def test_interpolate(self):
+        """Test looking up times between, at and outside held samples."""
+        self.assertEqual(len(self.history), 4)
+        self.assertAlmostEqual(self.history.time_range()[0], 0.2)
+        self.assertAlmostEqual(self.history.time_range()[1], 0.5)
+
+        times = [0.45, 0.1, 0.2, 0.5, 0.6, 0.333]
+        valid, positions, quaternions, velocities = \
+            self.history.lookup(times)
+        self.assertEqual(list(valid), [True, False, True, True, False, True])
+        for i in np.flatnonzero(valid):
+            np.testing.assert_allclose(positions[i], [times[i], 0.0, 0.0],
+                                       atol=1e-12)
+            np.testing.assert_allclose(quaternions[i],
+                                       yaw_quaternion(0.5 * times[i]),
+                                       atol=1e-12)
+            np.testing.assert_allclose(velocities[i], [1.0, 0.0, 0.0])
+        self.assertFalse(positions[~valid].any())
+
+    def test_empty(self):
+        """Test that nothing is found in an empty history."""
+        history = PoseHistory()
+        self.assertIsNone(history.time_range())
+        valid, positions, _, _ = history.lookup([0.0, 1.0])
+        self.assertFalse(valid.any())
+        self.assertEqual(positions.shape, (2, 3))
+
+    def test_slerp_shortest_arc(self):
+        """Test that SLERP takes the short way between q and -q sides."""
+        q0 = np.array([yaw_quaternion(0.2)])
+        q1 = -np.array([yaw_quaternion(0.4)])
+        q = slerp(q0, q1, np.array([[0.5]]))
+        np.testing.assert_allclose(q[0], yaw_quaternion(0.3), atol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
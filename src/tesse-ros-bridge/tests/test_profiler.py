@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from tesse_ros_bridge.profiler import SamplingProfiler
+
+def spin_inner(stop):
+    total = 0
+    while not stop.is_set():
+        total += sum(range(100))
+    return total
+
+
+def spin_outer(stop):
+    return spin_inner(stop)
+
+
+class TestSamplingProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_profile_thread(self):
+        """Test that a busy thread's stack is sampled and summarized."""
+        stop = threading.Event()
+        busy = threading.Thread(target=spin_outer, args=(stop,), name='busy')
+        busy.start()
+        try:
+            profile = SamplingProfiler(interval=0.002).run(0.2)
+        finally:
+            stop.set()
+            busy.join()
+
+        self.assertTrue(profile.samples > 10)
+        self.assertTrue(profile.thread_samples()['busy'] >= profile.samples)
+        labels = [label for label, _, _ in profile.top_functions(50)]
+        self.assertTrue(labels.index(next(label for label in labels
+            if label.startswith('spin_inner '))) <
+            labels.index(next(label for label in labels
+            if label.startswith('spin_outer '))))
+        self.assertTrue('spin_inner' in profile.summary())
+
+        path = os.path.join(self.directory, 'profile.collapsed')
+        profile.write_collapsed(path)
+        with open(path) as profile_file:
+            lines = [line.rsplit(' ', 1) for line in profile_file]
+        busy_lines = [stack for stack, count in lines
+                      if stack.startswith('busy;')]
+        self.assertTrue(any('spin_outer (test_profiler.py' in stack and
+                            'spin_inner (test_profiler.py' in stack
+                            for stack in busy_lines))
+        self.assertEqual(sum(int(count) for stack, count in lines
+                             if stack.startswith('busy;')),
+                         profile.thread_samples()['busy'])
+
+    def test_one_profile_at_a_time(self):
+        """Test that concurrent profiles are refused."""
+        profiler = SamplingProfiler(interval=0.01)
+        started = threading.Event()
+
+        def sleep(seconds):
+            started.set()
+            threading.Event().wait(seconds)
+        profiler.sleep = sleep
+        first = threading.Thread(target=profiler.run, args=(0.2,))
+        first.start()
+        started.wait()
+        with self.assertRaises(RuntimeError):
+            profiler.run(0.1)
+        first.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from tesse_ros_bridge.recorder import Recorder, Recording
+
+class TestRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        """Test that recorded streams load back record for record."""
+        rng = np.random.RandomState(0)
+        images = rng.randint(0, 256, (10, 6, 8, 3)).astype(np.uint8)
+        accelerations = rng.rand(50, 3)
+
+        # Each chunk holds 4 frames, or 19 IMU records of 32 bytes.
+        frame_bytes = images[0].nbytes + 8
+        recorder = Recorder(self.directory, max_chunk_bytes=4 * frame_bytes)
+        recorder.start()
+        buffer = np.empty(3)
+        for i in range(50):
+            buffer[:] = accelerations[i]
+            recorder.record('imu', {'time': 0.01 * i, 'acceleration': buffer})
+            if i % 5 == 0:
+                recorder.record('left_cam', {'stamp': 0.01 * i,
+                    'image': images[i // 5]}, copy=False)
+        recorder.stop()
+
+        stats = recorder.stats()
+        self.assertEqual(stats['records'], 60)
+        self.assertEqual(stats['write_errors'], 0)
+
+        recording = Recording(self.directory)
+        camera = recording['left_cam']
+        self.assertEqual(camera.chunk_sizes, [4, 4, 2])
+        self.assertEqual(len(camera), 10)
+        self.assertTrue(isinstance(camera.chunks('image')[0], np.memmap))
+        self.assertTrue(np.array_equal(camera.read('image'), images))
+        self.assertTrue(np.array_equal(camera.read('image', 3, 9),
+                                       images[3:9]))
+        self.assertTrue(np.array_equal(camera[5]['image'], images[5]))
+        self.assertAlmostEqual(camera[-1]['stamp'], 0.45)
+
+        imu = recording['imu']
+        self.assertEqual(imu.chunk_sizes, [19, 19, 12])
+        self.assertTrue(np.array_equal(imu.read('acceleration'),
+                                       accelerations))
+        self.assertTrue(np.allclose(imu.read('time'), 0.01 * np.arange(50)))
+
+    def test_layout_mismatch(self):
+        """Test that records must keep the layout of their stream."""
+        recorder = Recorder(self.directory)
+        recorder.start()
+        recorder.record('imu', {'time': 0.0, 'acceleration': np.zeros(3)})
+        with self.assertRaises(ValueError):
+            recorder.record('imu', {'time': 0.1, 'acceleration': np.zeros(4)})
+        with self.assertRaises(ValueError):
+            recorder.record('imu', {'time': 0.1})
+        recorder.stop()
+
+        self.assertEqual(len(Recording(self.directory)['imu']), 1)
+        with self.assertRaises(ValueError):
+            Recorder(self.directory)
+
+    def test_record_after_stop(self):
+        """Test that records after stop are dropped without blocking."""
+        recorder = Recorder(self.directory, queue_size=1)
+        recorder.start()
+        recorder.record('imu', {'time': 0.0})
+        recorder.stop()
+        for i in range(5):
+            recorder.record('imu', {'time': 0.1 * i})
+
+        stats = recorder.stats()
+        self.assertEqual(stats['records'], 1)
+        self.assertEqual(stats['dropped'], 5)
+        self.assertEqual(len(Recording(self.directory)['imu']), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+import unittest
+
+from tesse_ros_bridge.reorder_buffer import ReorderBuffer
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestReorderBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.buffer = ReorderBuffer(period=1.0, latency=0.01,
+                                    wall_clock=self.clock)
+
+    def add(self, sim_time):
+        return self.buffer.add(sim_time, sim_time)
+
+    def test_in_order(self):
+        """Test that an in-order stream passes straight through."""
+        for t in [1.0, 2.0, 3.0]:
+            self.assertEqual(self.add(t), [t])
+        self.assertEqual(self.buffer.stats()['released'], 3)
+
+    def test_reorder_and_drop(self):
+        """Test re-sequencing, and dropping duplicate and stale samples."""
+        self.assertEqual(self.add(1.0), [1.0])
+        self.assertEqual(self.add(3.0), [])         # Held for 2.0.
+        self.assertEqual(self.add(3.0), [])         # Duplicate of a held one.
+        self.assertEqual(self.add(2.0), [2.0, 3.0])
+        self.assertEqual(self.add(3.0), [])         # Duplicate of released.
+        self.assertEqual(self.add(1.5), [])         # Stale.
+
+        stats = self.buffer.stats()
+        self.assertEqual(stats['reordered'], 1)
+        self.assertEqual(stats['duplicates'], 2)
+        self.assertEqual(stats['stale'], 1)
+        self.assertEqual(stats['gaps'], 0)
+        self.assertEqual(stats['held'], 0)
+
+    def test_gap(self):
+        """Test that a hole is given up on after the latency budget."""
+        self.assertEqual(self.add(1.0), [1.0])
+        self.assertEqual(self.add(4.0), [])
+        self.clock.now = 0.02
+        self.assertEqual(self.add(5.0), [4.0, 5.0])
+        self.assertEqual(self.add(2.0), [])         # Too late.
+
+        stats = self.buffer.stats()
+        self.assertEqual(stats['gaps'], 1)
+        self.assertEqual(stats['missing'], 2)
+        self.assertEqual(stats['stale'], 1)
+
+    def test_poll(self):
+        """Test that a held sample is released once the latency budget has
+        passed, with no further samples."""
+        self.assertEqual(self.add(1.0), [1.0])
+        self.assertEqual(self.add(3.0), [])
+        self.assertEqual(self.buffer.poll(), [])
+        self.clock.now = 0.02
+        self.assertEqual(self.buffer.poll(), [3.0])
+        self.assertEqual(self.buffer.stats()['held'], 0)
+
+    def test_overflow_and_flush(self):
+        """Test that a full buffer and a flush release held samples."""
+        buffer = ReorderBuffer(period=1.0, latency=10.0, max_size=2,
+                               wall_clock=self.clock)
+        self.assertEqual(buffer.add(1.0, 1.0), [1.0])
+        self.assertEqual(buffer.add(3.0, 3.0), [])
+        self.assertEqual(buffer.add(5.0, 5.0), [])
+        self.assertEqual(buffer.add(6.0, 6.0), [3.0])
+        self.assertEqual(buffer.flush(), [5.0, 6.0])
+        self.assertEqual(buffer.stats()['overflows'], 1)
+        self.assertEqual(buffer.stats()['gaps'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+import unittest
+
+from tesse_ros_bridge.sim_clock import SimClock
+
+class TestSimClock(unittest.TestCase):
+
+    def test_no_samples(self):
+        """Test that the clock has no time before the first sample."""
+        clock = SimClock()
+        self.assertEqual(clock.now(0.0), None)
+        self.assertEqual(clock.stats()['samples'], 0)
+
+    def test_extrapolation(self):
+        """Test extrapolation between samples, scaled by speedup_factor."""
+        clock = SimClock(speedup_factor=2.0)
+        clock.update(10.0, wall_time=100.0)
+        self.assertAlmostEqual(clock.now(100.0), 5.0)
+        self.assertAlmostEqual(clock.now(100.02), 5.01)
+
+        # Bounded past the last sample.
+        self.assertAlmostEqual(clock.now(200.0), 5.0 + clock.max_extrapolation)
+
+    def test_monotonic(self):
+        """Test that published time never goes backwards."""
+        clock = SimClock(max_extrapolation=1.0)
+        clock.update(1.0, wall_time=0.0)
+        ahead = clock.now(0.5)
+        clock.update(1.1, wall_time=0.5)
+        self.assertEqual(clock.now(0.5), ahead)
+        self.assertGreaterEqual(clock.now(0.6), ahead)
+
+    def test_drift_correction(self):
+        """Test rate estimation and error statistics on a drifting clock."""
+        clock = SimClock(drift_gain=0.1)
+        for i in range(1000):
+            # Simulator runs 1% faster than the wall clock.
+            clock.update(i * 0.00505, wall_time=i * 0.005)
+
+        stats = clock.stats()
+        self.assertEqual(stats['samples'], 999)
+        self.assertAlmostEqual(stats['rate'], 1.01, places=6)
+        self.assertLess(abs(clock.now(999 * 0.005) - 999 * 0.00505), 1e-6)
+        self.assertGreater(stats['max_abs'], 0.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+import unittest
+
+from tesse_ros_bridge.tf_batcher import TfBatcher
+
+class TestTfBatcher(unittest.TestCase):
+
+    def test_deduplicate(self):
+        """Test that each frame pair keeps only increasing stamps."""
+        batcher = TfBatcher()
+        self.assertTrue(batcher.add('world', 'body', 1.0, 'a'))
+        self.assertFalse(batcher.add('world', 'body', 1.0, 'b'))
+        self.assertFalse(batcher.add('world', 'body', 0.5, 'c'))
+        self.assertTrue(batcher.add('world', 'other', 0.5, 'd'))
+        self.assertTrue(batcher.add('world', 'body', 2.0, 'e'))
+
+        # One batch, in stamp order across frame pairs.
+        self.assertEqual(batcher.take(), ['d', 'a', 'e'])
+        self.assertEqual(batcher.take(), [])
+        stats = batcher.stats()
+        self.assertEqual(stats['duplicates'], 1)
+        self.assertEqual(stats['stale'], 1)
+        self.assertEqual(stats['published'], 3)
+        self.assertEqual(stats['batches'], 1)
+
+    def test_rate_limit(self):
+        """Test decimating a 200 Hz stream to 50 Hz."""
+        batcher = TfBatcher(rate=50.0)
+        for i in range(20):
+            batcher.add('world', 'body', 0.005 * i, i)
+        self.assertEqual(batcher.take(), [0, 4, 8, 12, 16])
+        self.assertEqual(batcher.stats()['decimated'], 15)
+
+    def test_max_pending(self):
+        """Test that the oldest transforms are discarded when full."""
+        batcher = TfBatcher(max_pending=2)
+        for i in range(4):
+            batcher.add('world', 'body', float(i), i)
+        self.assertEqual(batcher.take(), [2, 3])
+        self.assertEqual(batcher.stats()['discarded'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+import unittest
+
+from tesse_ros_bridge.timing import StageTimings
+
+class FakeClock(object):
+    """ Clock that advances by a scripted duration on every read. """
+
+    def __init__(self, steps):
+        self.now = 0.0
+        self.steps = list(steps)
+
+    def __call__(self):
+        if self.steps:
+            self.now += self.steps.pop(0)
+        return self.now
+
+
+class TestStageTimings(unittest.TestCase):
+
+    def test_laps(self):
+        """Test that chained laps time consecutive stages."""
+        clock = FakeClock([0.0, 0.001, 0.002, 0.0, 0.003, 0.004])
+        timings = StageTimings(clock=clock)
+        for _ in range(2):
+            t = timings.now()
+            t = timings.lap('decode', t)
+            t = timings.lap('process', t)
+
+        snapshot = timings.snapshot()
+        self.assertEqual(sorted(snapshot), ['decode', 'process'])
+        self.assertEqual(snapshot['decode']['count'], 2)
+        self.assertAlmostEqual(snapshot['decode']['mean'], 0.002)
+        self.assertAlmostEqual(snapshot['decode']['max'], 0.003)
+        self.assertAlmostEqual(snapshot['process']['p50'], 0.003)
+
+    def test_rolling_window(self):
+        """Test that statistics cover only the last `window` laps."""
+        timings = StageTimings(window=100)
+        for i in range(250):
+            timings.record('request', 1.0 if i < 150 else 0.01 * (i - 150))
+
+        stats = timings.snapshot(reset=True)['request']
+        self.assertEqual(stats['count'], 250)
+        self.assertAlmostEqual(stats['max'], 0.99)
+        self.assertAlmostEqual(stats['p50'], 0.495)
+        self.assertTrue(stats['p50'] <= stats['p95'] <= stats['p99'] <=
+                        stats['max'])
+        self.assertEqual(timings.snapshot(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
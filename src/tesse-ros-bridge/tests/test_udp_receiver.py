@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+import socket
+import threading
+import time
+import unittest
+
+from tesse_ros_bridge.udp_receiver import UdpReceiver
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+
+
+class TestUdpReceiver(unittest.TestCase):
+
+    def setUp(self):
+        self.sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def tearDown(self):
+        self.sender.close()
+
+    def send(self, receiver, packets):
+        for packet in packets:
+            self.sender.sendto(packet, ('127.0.0.1', receiver.port))
+
+    def test_backlog_policies(self):
+        """Test that a backlog is drained in one batch, and delivered in
+        full or only its newest datagram, depending on the policy."""
+        packets = [b'packet %d' % i for i in range(50)]
+        for policy, expected in [('all', packets), ('latest', packets[-1:])]:
+            receiver = UdpReceiver(0, host='127.0.0.1', policy=policy)
+            received = []
+            receiver.subscribe('test', received.append)
+
+            # Queue the packets while the receiver isn't reading yet.
+            self.send(receiver, packets)
+            receiver.start()
+            wait_for(lambda: receiver.stats()['received'] == len(packets))
+            receiver.stop()
+
+            self.assertEqual(received, expected)
+            stats = receiver.stats()
+            self.assertEqual(stats['batches'], 1)
+            self.assertEqual(stats['max_batch'], len(packets))
+            self.assertEqual(stats['discarded'],
+                             len(packets) - len(expected))
+
+    def test_callback_errors(self):
+        """Test that callback errors are counted without losing data."""
+        receiver = UdpReceiver(0, host='127.0.0.1')
+        received = []
+
+        def callback(data):
+            if data == b'bad':
+                raise ValueError("bad packet")
+            received.append(data)
+        receiver.subscribe('test', callback)
+        receiver.start()
+        self.send(receiver, [b'one', b'bad', b'two'])
+        wait_for(lambda: len(received) == 2)
+        receiver.stop()
+
+        self.assertEqual(received, [b'one', b'two'])
+        self.assertEqual(receiver.stats()['callback_errors'], 1)
+
+    def test_timeout(self):
+        """Test that the timeout callback runs while no data arrives."""
+        timeouts = []
+        receiver = UdpReceiver(0, host='127.0.0.1', timeout=0.01,
+                               on_timeout=lambda: timeouts.append(1))
+        receiver.start()
+        wait_for(lambda: len(timeouts) >= 3)
+        receiver.stop()
+        self.assertTrue(len(timeouts) >= 3)
+
+    def test_kernel_drops(self):
+        """Test that overflowing a small socket buffer counts drops."""
+        receiver = UdpReceiver(0, host='127.0.0.1', rcvbuf=4096)
+        if receiver.kernel_drops() is None:
+            receiver.stop()
+            self.skipTest("/proc/net/udp is unavailable")
+        self.send(receiver, [b'x' * 1024] * 200)
+        drops = receiver.kernel_drops()
+        receiver.stop()
+        self.assertTrue(drops > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
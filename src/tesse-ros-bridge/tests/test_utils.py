@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+import io
+import re
 import unittest
 import numpy as np
 import xml.etree.ElementTree as ET
@@ -8,6 +10,7 @@ from scipy.spatial.transform import Rotation
 import tf
 import tf2_ros
 from sensor_msgs.msg import CameraInfo
+from cv_bridge import CvBridge
 
 import tesse_ros_bridge.utils
 
@@ -28,6 +31,61 @@ class TestUtilsOffline(unittest.TestCase):
         self.assertEqual(dict['time'], 7.935)
         self.assertEqual(dict['collision_status'], False)
 
+    def test_parse_metadata_schema(self):
+        """Test schema-compiled parser against ElementTree on raw metadata."""
+        for i in range(7):
+            with open("data/metadata_%d.xml" % i, 'rb') as f:
+                data_str = f.read()
+
+            parser = tesse_ros_bridge.utils.metadata_parsers[0]
+            expected = tesse_ros_bridge.utils.parse_metadata_etree(data_str)
+            self.assertEqual(parser.parse(data_str), expected)
+            self.assertEqual(parser.parse(data_str.decode('ascii')), expected)
+            self.assertEqual(tesse_ros_bridge.utils.parse_metadata(data_str),
+                expected)
+
+    def test_parse_metadata_fallback(self):
+        """Test fallback to ElementTree for layouts the schema can't read."""
+        with open("data/metadata_1.xml", 'rb') as f:
+            data_str = f.read()
+        expected = tesse_ros_bridge.utils.parse_metadata_etree(data_str)
+
+        # Unknown schema version.
+        unknown = data_str.replace(b'v0.3', b'v9.9')
+        self.assertEqual(tesse_ros_bridge.utils.metadata_parsers[0].parse(
+            unknown), None)
+        self.assertEqual(tesse_ros_bridge.utils.parse_metadata(unknown),
+            expected)
+
+        # Reordered attributes.
+        reordered = re.sub(br"<quaternion (x='[^']*') (y='[^']*') "
+            br"(z='[^']*') (w='[^']*')", br"<quaternion \4 \1 \2 \3", data_str)
+        self.assertNotEqual(reordered, data_str)
+        self.assertEqual(tesse_ros_bridge.utils.metadata_parsers[0].parse(
+            reordered), None)
+        self.assertEqual(tesse_ros_bridge.utils.parse_metadata(reordered),
+            tesse_ros_bridge.utils.parse_metadata_etree(reordered))
+
+    def test_decode_metadata_binary(self):
+        """Test packed binary metadata round trip and encoding detection."""
+        with open("data/metadata_0.xml", 'rb') as f:
+            data_str = f.read()
+        dict = tesse_ros_bridge.utils.parse_metadata(data_str)
+
+        packet = tesse_ros_bridge.utils.encode_metadata_binary(dict)
+        self.assertEqual(len(packet),
+            tesse_ros_bridge.utils.metadata_binary_dtype.itemsize)
+        self.assertTrue(packet.startswith(
+            tesse_ros_bridge.utils.METADATA_BINARY_MAGIC))
+
+        self.assertEqual(tesse_ros_bridge.utils.decode_metadata_binary(packet),
+            dict)
+        self.assertEqual(tesse_ros_bridge.utils.decode_metadata(packet), dict)
+        self.assertEqual(tesse_ros_bridge.utils.decode_metadata(data_str),
+            dict)
+        self.assertEqual(tesse_ros_bridge.utils.decode_metadata(
+            tesse_ros_bridge.utils.encode_metadata_xml(dict)), dict)
+
     def test_parse_cam_data_0(self):
         """Test corrrect camera metadata parsing from xml message offline."""
         data = ET.parse('data/cam_data_0.xml')
@@ -110,6 +168,115 @@ class TestUtilsOffline(unittest.TestCase):
 
         # TODO(marcus): add more checks
 
+    def test_generate_mono_camera_info(self):
+        """Test that a single camera's CameraInfo matches the left camera's
+        but for its frame."""
+        data = ET.parse('data/cam_data_0.xml')
+        dict = tesse_ros_bridge.utils.parse_cam_data(
+            ET.tostring(data.getroot()))
+
+        left, _ = tesse_ros_bridge.utils.generate_camera_info(dict, dict)
+        depth = tesse_ros_bridge.utils.generate_mono_camera_info(dict,
+                                                                 "depth_cam")
+        self.assertEqual(depth.header.frame_id, "depth_cam")
+        self.assertEqual(list(depth.K), list(left.K))
+        self.assertEqual(list(depth.P), list(left.P))
+
+    def test_make_image_msg(self):
+        """Test zero-copy Image messages against CvBridge, byte for byte."""
+        rng = np.random.RandomState(0)
+        images = [
+            (rng.randint(0, 256, (48, 72)).astype(np.uint8), 'mono8'),
+            (rng.randint(0, 256, (48, 72, 3)).astype(np.uint8), 'rgb8'),
+            (rng.rand(48, 72).astype(np.float32), '32FC1'),
+            # Strided view of a larger array.
+            (rng.rand(48, 72, 3).astype(np.float32)[:,:,1], '32FC1'),
+        ]
+
+        cv_bridge = CvBridge()
+        for image, encoding in images:
+            expected = cv_bridge.cv2_to_imgmsg(image, encoding)
+            actual = tesse_ros_bridge.utils.make_image_msg(image, encoding)
+            for msg in [expected, actual]:
+                msg.header.frame_id = "f"
+                msg.header.stamp.secs = 42
+
+            expected_buff = io.BytesIO()
+            expected.serialize(expected_buff)
+            actual_buff = io.BytesIO()
+            actual.serialize(actual_buff)
+            self.assertEqual(actual_buff.getvalue(), expected_buff.getvalue())
+
+            self.assertEqual(actual.height, expected.height)
+            self.assertEqual(actual.width, expected.width)
+            self.assertEqual(actual.step, expected.step)
+            self.assertEqual(actual.encoding, expected.encoding)
+            self.assertEqual(bytes(actual.data), expected.data)
+
+        with self.assertRaises(ValueError):
+            tesse_ros_bridge.utils.make_image_msg(
+                np.zeros((48, 72)), '32FC1')
+
+    def test_compressed_images(self):
+        """Test CompressedImage forwarding and lossless round trips."""
+        rng = np.random.RandomState(0)
+        rgb = rng.randint(0, 256, (48, 72, 3)).astype(np.uint8)
+        mono = rng.randint(0, 256, (48, 72)).astype(np.uint8)
+
+        # PNG is lossless, so decoding gives back the exact pixels.
+        for image, channels in [(rgb, 3), (mono, 1)]:
+            payload = tesse_ros_bridge.utils.encode_compressed_image(
+                image, 'png')
+            decoded = tesse_ros_bridge.utils.decode_compressed_image(
+                payload, channels)
+            self.assertTrue(np.array_equal(decoded, image))
+
+        # Payloads are forwarded unchanged, with their format detected.
+        for format in ['png', 'jpeg']:
+            payload = tesse_ros_bridge.utils.encode_compressed_image(
+                rgb, format)
+            msg = tesse_ros_bridge.utils.make_compressed_image_msg(payload)
+            self.assertEqual(msg.format, format)
+            self.assertTrue(msg.data is payload)
+
+        # JPEG keeps colors in RGB order.
+        red = np.zeros((16, 16, 3), dtype=np.uint8)
+        red[:, :, 0] = 255
+        decoded = tesse_ros_bridge.utils.decode_compressed_image(
+            tesse_ros_bridge.utils.encode_compressed_image(red), 3)
+        self.assertTrue(np.allclose(decoded, red, atol=2))
+
+        with self.assertRaises(ValueError):
+            tesse_ros_bridge.utils.decode_compressed_image(b'garbage', 3)
+
+    def test_depth_image_converter(self):
+        """Test metric depth conversion in both depth encodings."""
+        depth = np.array([[0.0, 0.1, 0.2], [0.2001, 0.5, 1.0]],
+                         dtype=np.float32)
+
+        converter = tesse_ros_bridge.utils.DepthImageConverter(50.0)
+        meters = converter.convert(depth)
+        self.assertEqual(meters.dtype, np.float32)
+        self.assertTrue(np.array_equal(meters, depth * np.float32(50.0)))
+        # The output buffer is reused across frames.
+        self.assertTrue(converter.convert(depth) is meters)
+
+        # Far-plane pixels have no return and are invalid.
+        converter = tesse_ros_bridge.utils.DepthImageConverter(50.0, '16UC1')
+        self.assertEqual(converter.convert(depth).tolist(),
+                         [[0, 5000, 10000], [10005, 25000, 0]])
+
+        converter = tesse_ros_bridge.utils.DepthImageConverter(50.0,
+            '16UC1', max_range=10.0)
+        millimeters = converter.convert(depth)
+        self.assertEqual(millimeters.dtype, np.uint16)
+        self.assertEqual(millimeters.tolist(), [[0, 5000, 10000], [0, 0, 0]])
+
+        # Max range can't exceed what 16 bits of millimeters hold.
+        converter = tesse_ros_bridge.utils.DepthImageConverter(100.0, '16UC1')
+        self.assertEqual(converter.max_range, 65.535)
+        self.assertEqual(converter.convert(depth)[1].tolist(), [20010, 50000, 0])
+
     def test_vfov_from_hfov(self):
         """Test proper generation of vertical FOV given horizontal FOV."""
         width = 700
@@ -290,5 +457,105 @@ class TestUtilsOffline(unittest.TestCase):
 
         self.assertTrue(np.allclose(expected_acc_3_brh, actual_acc_3, atol=1.e-1))
 
+    def test_so3_kernels(self):
+        """Test closed-form SO(3) kernels against tf and scipy."""
+        rng = np.random.RandomState(0)
+        for _ in range(100):
+            quat = rng.randn(4)
+            T = tf.transformations.quaternion_matrix(quat)
+            R = tesse_ros_bridge.utils.quaternion_to_rotation_mat(quat)
+            self.assertTrue(np.allclose(R, T[:3,:3]))
+
+            q = tesse_ros_bridge.utils.rotation_mat_to_quaternion(R)
+            self.assertTrue(np.allclose(q,
+                tf.transformations.quaternion_from_matrix(T)))
+
+            expected = Rotation.from_quat(
+                tesse_ros_bridge.utils.get_quaternion(T)).as_rotvec()
+            self.assertTrue(np.allclose(
+                tesse_ros_bridge.utils.so3_logmap(R), expected))
+
+        # Small-angle branch of the logmap.
+        T = tf.transformations.quaternion_matrix([1e-6, -2e-6, 3e-6, 1])
+        expected = Rotation.from_quat(
+            tesse_ros_bridge.utils.get_quaternion(T)).as_rotvec()
+        self.assertTrue(np.allclose(
+            tesse_ros_bridge.utils.so3_logmap(T[:3,:3]), expected,
+            atol=1e-12))
+
+    def test_metadata_processor(self):
+        """Test MetadataProcessor against process_metadata on a sequence."""
+        processor = tesse_ros_bridge.utils.MetadataProcessor()
+        prev_time, prev_vel_brh, prev_enu_R_brh = 0, [0,0,0], np.identity(3)
+
+        for i in range(3, 7):
+            data = ET.parse("data/metadata_%d.xml" % i)
+            dict = tesse_ros_bridge.utils.parse_metadata(
+                ET.tostring(data.getroot()))
+
+            expected = tesse_ros_bridge.utils.process_metadata(dict,
+                prev_time, prev_vel_brh, prev_enu_R_brh)
+            actual = processor.process(dict)
+
+            for key in ['position', 'quaternion', 'velocity', 'ang_vel',
+                        'acceleration', 'transform']:
+                self.assertTrue(np.allclose(expected[key], actual[key]))
+            self.assertEqual(expected['time'], actual['time'])
+            self.assertEqual(expected['collision_status'],
+                actual['collision_status'])
+
+            prev_time = expected['time']
+            prev_vel_brh = expected['velocity']
+            prev_enu_R_brh = expected['transform'][:3,:3]
+
+        self.assertEqual(processor.prev_time, prev_time)
+
+    def test_metadata_processor_seed(self):
+        """Test that a seeded MetadataProcessor restarts differencing."""
+        processor = tesse_ros_bridge.utils.MetadataProcessor()
+        data = ET.parse("data/metadata_3.xml")
+        dict = tesse_ros_bridge.utils.parse_metadata(
+            ET.tostring(data.getroot()))
+
+        processor.seed(dict, 0.005)
+        self.assertAlmostEqual(processor.prev_time, dict['time'] - 0.005)
+        processed = processor.process(dict)
+        self.assertTrue(np.allclose(processed['ang_vel'], 0.0))
+        self.assertTrue(np.allclose(processed['acceleration'], 0.0))
+        self.assertTrue(np.allclose(processed['velocity'],
+            tesse_ros_bridge.utils.process_metadata(dict, 0, [0,0,0],
+                np.identity(3))['velocity']))
+
+    def test_process_metadata_batch(self):
+        """Test batch processing against per-sample process_metadata."""
+        dicts = []
+        for i in range(3, 7):
+            data = ET.parse("data/metadata_%d.xml" % i)
+            dicts.append(tesse_ros_bridge.utils.parse_metadata(
+                ET.tostring(data.getroot())))
+
+        batch = tesse_ros_bridge.utils.process_metadata_batch(
+            *tesse_ros_bridge.utils.stack_metadata(dicts))
+
+        prev_time, prev_vel_brh, prev_enu_R_brh = 0, [0,0,0], np.identity(3)
+        for i, dict in enumerate(dicts):
+            proc = tesse_ros_bridge.utils.process_metadata(dict, prev_time,
+                prev_vel_brh, prev_enu_R_brh)
+
+            for key in ['position', 'quaternion', 'velocity', 'ang_vel',
+                        'acceleration', 'transform']:
+                self.assertTrue(np.allclose(proc[key], batch[key][i]))
+            self.assertEqual(proc['time'], batch['time'][i])
+
+            imu = tesse_ros_bridge.utils.metadata_to_imu(proc, 0, "f")
+            self.assertTrue(np.allclose([imu.linear_acceleration.x,
+                                         imu.linear_acceleration.y,
+                                         imu.linear_acceleration.z],
+                                        batch['imu_acceleration'][i]))
+
+            prev_time = proc['time']
+            prev_vel_brh = proc['velocity']
+            prev_enu_R_brh = proc['transform'][:3,:3]
+
 if __name__ == '__main__':
     unittest.main()